@@ -4,3 +4,13 @@ from django.apps import AppConfig
 class ApplicationConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'application'
+
+    def ready(self):
+        """
+        Registra los receptores de señales de los índices en memoria. El
+        calentamiento (`XBRECS_WARMUP`) lo lanzan `wsgi.py` y `asgi.py`.
+        """
+        from . import autocomplete  # noqa: F401
+        from . import keyword_index  # noqa: F401
+        from . import neighbor_table  # noqa: F401
+        from . import refresh  # noqa: F401
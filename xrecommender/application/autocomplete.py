@@ -0,0 +1,551 @@
+import os
+import pickle
+import threading
+import time
+import unicodedata
+from bisect import bisect_left
+from heapq import merge
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from django.conf import settings
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.dispatch import receiver
+
+from .models import (
+    Book, Author, Keyword, index_version, bump_index_version
+)
+
+BOOK = 'book'
+AUTHOR = 'author'
+KEYWORD = 'keyword'
+KIND_ORDER = {BOOK: 0, AUTHOR: 1, KEYWORD: 2}
+MAX_SCAN = 200  # Máximo de entradas examinadas por consulta
+MAX_PENDING = 256  # Elementos cambiados antes de rehacer las listas
+DEFAULT_LIMIT = 8
+SNAPSHOT_VERSION = 2
+INDEX_NAME = 'autocomplete'  # Nombre de la versión compartida
+CHECK_INTERVAL = 5.0  # Segundos entre comprobaciones de la versión
+
+Item = Tuple[str, int]  # (tipo, id)
+# Claves ordenadas, elemento de cada clave y etiqueta de cada elemento
+Entries = Tuple[
+    List[str], List[Tuple[str, int, bool]], Dict[Item, Optional[str]]
+]
+EMPTY: Entries = ([], [], dict())
+
+
+def normalize(text: str) -> str:
+    """
+    Normaliza un texto para la búsqueda por prefijo (minúsculas y
+    sin acentos).
+
+    ## Argumentos:
+    - `text`: Texto a normalizar.
+
+    ## Retorno:
+    - Texto normalizado.
+    """
+    text = unicodedata.normalize('NFKD', text.lower())
+    return ''.join(c for c in text if not unicodedata.combining(c)).strip()
+
+
+def _index_keys(label: str) -> List[str]:
+    """
+    Obtiene las claves con las que se indexa una etiqueta: el texto
+    completo y cada sufijo que empieza en una palabra, para que
+    "hun" encuentre tanto "Hunger Games" como "The Hunger Games".
+
+    ## Argumentos:
+    - `label`: Etiqueta a indexar.
+
+    ## Retorno:
+    - Lista de claves normalizadas.
+    """
+    words = normalize(label).split()
+    return [' '.join(words[i:]) for i in range(len(words))]
+
+
+def _scan(
+    keys: List[str], refs: List[Tuple[str, int, bool]], prefix: str,
+    label_of: Callable[[Item], Optional[str]], best: Dict[Item, Tuple]
+) -> None:
+    """
+    Recorre las claves que empiezan por un prefijo (como mucho
+    `MAX_SCAN`) y guarda la mejor posición de cada elemento encontrado.
+
+    ## Argumentos:
+    - `keys`: Claves normalizadas ordenadas.
+    - `refs`: Elemento al que apunta cada clave.
+    - `prefix`: Prefijo normalizado.
+    - `label_of`: Etiqueta actual de un elemento (`None` si no se usa).
+    - `best`: Diccionario {elemento: posición} que se actualiza.
+    """
+    pos = bisect_left(keys, prefix)
+    end = min(pos + MAX_SCAN, len(keys))
+    while pos < end and keys[pos].startswith(prefix):
+        kind, obj_id, at_start = refs[pos]
+        item = (kind, obj_id)
+        label = label_of(item)
+        if label is not None:
+            rank = (
+                not at_start,
+                KIND_ORDER[kind],
+                len(label),
+                label
+            )
+            if item not in best or rank < best[item]:
+                best[item] = rank
+        pos += 1
+
+
+class PrefixIndex:
+    """
+    Índice de prefijos en memoria sobre títulos de libros, nombres de
+    autores y palabras clave. Las claves se guardan en una lista ordenada
+    y las consultas se resuelven con búsqueda binaria.
+
+    El estado no se modifica: cada actualización lo copia y lo reemplaza
+    de una vez, así que las búsquedas no necesitan el cerrojo. Los cambios
+    se acumulan en unas listas pequeñas de pendientes que se consultan
+    junto a las principales, y éstas sólo se rehacen (una copia completa)
+    cada `MAX_PENDING` elementos cambiados.
+    """
+
+    def __init__(self) -> None:
+        # Listas principales y pendientes: claves normalizadas ordenadas,
+        # elemento al que apunta cada clave (y si la clave es el texto
+        # completo, coincidencia al principio, o el sufijo de una palabra)
+        # y etiqueta de cada elemento. En las pendientes, la etiqueta
+        # `None` indica que el elemento se ha eliminado
+        self._state: Tuple[Entries, Entries] = (EMPTY, EMPTY)
+        self._lock = threading.Lock()
+        self.version = 0  # Versión compartida que refleja el índice
+
+    def __len__(self) -> int:
+        (_, _, labels), (_, _, pending) = self._state
+        return len(labels) + sum(
+            (label is not None) - (item in labels)
+            for item, label in pending.items()
+        )
+
+    def label(self, item: Item) -> Optional[str]:
+        """
+        Obtiene la etiqueta indexada de un elemento.
+
+        ## Argumentos:
+        - `item`: Elemento (tipo, id).
+
+        ## Retorno:
+        - Etiqueta o `None` si no está en el índice.
+        """
+        (_, _, labels), (_, _, pending) = self._state
+        return pending[item] if item in pending else labels.get(item)
+
+    def add(self, kind: str, obj_id: int, label: str) -> None:
+        """
+        Añade (o reemplaza) un elemento en el índice.
+
+        ## Argumentos:
+        - `kind`: Tipo del elemento (`book`, `author` o `keyword`).
+        - `obj_id`: ID del elemento.
+        - `label`: Texto que se mostrará y sobre el que se indexa.
+        """
+        self.update(added=[(kind, obj_id, label)])
+
+    def remove(self, kind: str, obj_id: int) -> None:
+        """
+        Elimina un elemento del índice.
+
+        ## Argumentos:
+        - `kind`: Tipo del elemento.
+        - `obj_id`: ID del elemento.
+        """
+        self.update(removed=[(kind, obj_id)])
+
+    def update(
+        self,
+        added: Iterable[Tuple[str, int, str]] = (),
+        removed: Iterable[Item] = (),
+        version: Optional[int] = None
+    ) -> None:
+        """
+        Añade y elimina un lote de elementos con una sola copia del estado.
+
+        ## Argumentos:
+        - `added`: Tuplas (tipo, id, etiqueta) que se añaden o reemplazan.
+        - `removed`: Elementos (tipo, id) que se eliminan.
+        - `version`: Versión compartida tras el cambio. Si es la siguiente
+        a la del índice, el índice pasa a reflejarla (nadie más ha cambiado
+        los datos entretanto).
+        """
+        with self._lock:
+            main, pending = self._state
+            keys, refs, labels = (
+                list(pending[0]), list(pending[1]), dict(pending[2])
+            )
+            for item in removed:
+                self._remove(keys, refs, labels, item)
+                if item in main[2]:
+                    labels[item] = None
+            for kind, obj_id, label in added:
+                item = (kind, obj_id)
+                self._remove(keys, refs, labels, item)
+                labels[item] = label
+                for i, key in enumerate(_index_keys(label)):
+                    pos = bisect_left(keys, key)
+                    keys.insert(pos, key)
+                    refs.insert(pos, (kind, obj_id, i == 0))
+            pending = (keys, refs, labels)
+            if len(labels) > MAX_PENDING:
+                main, pending = self._merge(main, pending), EMPTY
+            self._state = (main, pending)
+            if version is not None and version == self.version + 1:
+                self.version = version
+
+    @staticmethod
+    def _remove(
+        keys: List[str], refs: List[Tuple[str, int, bool]],
+        labels: Dict[Item, Optional[str]], item: Item
+    ) -> None:
+        label = labels.pop(item, None)
+        if label is None:
+            return
+        for key in _index_keys(label):
+            pos = bisect_left(keys, key)
+            while pos < len(keys) and keys[pos] == key:
+                if refs[pos][:2] == item:
+                    del keys[pos]
+                    del refs[pos]
+                    break
+                pos += 1
+
+    @staticmethod
+    def _merge(main: Entries, pending: Entries) -> Entries:
+        """
+        Aplica los cambios pendientes a las listas principales.
+
+        ## Argumentos:
+        - `main`: Listas principales.
+        - `pending`: Listas pendientes.
+
+        ## Retorno:
+        - Nuevas listas principales.
+        """
+        keys, refs, labels = main
+        pending_keys, pending_refs, changed = pending
+        if not changed:
+            return main
+        entries = merge(
+            ((key, ref) for key, ref in zip(keys, refs)
+             if ref[:2] not in changed),
+            zip(pending_keys, pending_refs), key=lambda e: e[0]
+        )
+        merged_keys: List[str] = []
+        merged_refs: List[Tuple[str, int, bool]] = []
+        for key, ref in entries:
+            merged_keys.append(key)
+            merged_refs.append(ref)
+        labels = {
+            item: label for item, label in labels.items()
+            if item not in changed
+        }
+        labels.update(
+            (item, label) for item, label in changed.items()
+            if label is not None
+        )
+        return merged_keys, merged_refs, labels
+
+    def bulk_load(self, items: Iterable[Tuple[str, int, str]]) -> None:
+        """
+        Carga de golpe un conjunto de elementos, ordenando una única vez.
+
+        ## Argumentos:
+        - `items`: Tuplas (tipo, id, etiqueta).
+        """
+        labels = {(kind, obj_id): label for kind, obj_id, label in items}
+        entries = sorted(
+            (key, (*item, i == 0))
+            for item, label in labels.items()
+            for i, key in enumerate(_index_keys(label))
+        )
+        with self._lock:
+            self._state = ((
+                [key for key, _ in entries], [item for _, item in entries],
+                labels
+            ), EMPTY)
+
+    def search(self, prefix: str, limit: int = DEFAULT_LIMIT) -> List[Dict]:
+        """
+        Busca los elementos cuyas claves empiezan por el prefijo dado.
+
+        Se priorizan las coincidencias al principio del texto, después
+        los libros frente a autores y palabras clave y, por último, las
+        etiquetas más cortas.
+
+        ## Argumentos:
+        - `prefix`: Prefijo a buscar.
+        - `limit`: Número máximo de sugerencias.
+
+        ## Retorno:
+        - Lista de sugerencias ordenadas (`type`, `id`, `label`).
+        """
+        prefix = normalize(prefix)
+        if not prefix:
+            return []
+        (keys, refs, labels), (pending_keys, pending_refs, pending) = \
+            self._state
+        best: Dict[Item, Tuple] = dict()
+        # Las entradas pendientes sustituyen a las principales del elemento
+        _scan(keys, refs, prefix,
+              lambda item: None if item in pending else labels.get(item),
+              best)
+        _scan(pending_keys, pending_refs, prefix, pending.get, best)
+        ranked = sorted(best.items(), key=lambda x: x[1])[:limit]
+        return [
+            {'type': kind, 'id': obj_id, 'label': rank[-1]}
+            for (kind, obj_id), rank in ranked
+        ]
+
+    def save(self, path: str) -> None:
+        """
+        Guarda el índice en disco para cargarlo en el arranque.
+
+        ## Argumentos:
+        - `path`: Ruta del fichero de snapshot.
+        """
+        keys, refs, labels = self._merge(*self._state)
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(
+                (SNAPSHOT_VERSION, self.version, keys, refs, labels), f
+            )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> Optional['PrefixIndex']:
+        """
+        Carga un índice previamente guardado con `save`.
+
+        ## Argumentos:
+        - `path`: Ruta del fichero de snapshot.
+
+        ## Retorno:
+        - Índice cargado o `None` si el snapshot no es compatible.
+        """
+        with open(path, 'rb') as f:
+            data = pickle.load(f)
+        if data[0] != SNAPSHOT_VERSION:
+            return None
+        index = cls()
+        index.version, keys, refs, labels = data[1:]
+        index._state = ((keys, refs, labels), EMPTY)
+        return index
+
+
+def build_index(version: Optional[int] = None) -> PrefixIndex:
+    """
+    Construye el índice de prefijos a partir de la base de datos.
+
+    ## Argumentos:
+    - `version`: Versión compartida que se ha leído antes de construirlo.
+    Por defecto, se lee.
+
+    ## Retorno:
+    - Índice con todos los libros, autores y palabras clave.
+    """
+    index = PrefixIndex()
+    # La versión se lee antes que los datos: si cambian entretanto, el
+    # índice se volverá a construir en la siguiente comprobación
+    if version is None:
+        version = index_version(INDEX_NAME)
+    index.version = version
+    items = [
+        (BOOK, pk, title)
+        for pk, title in Book.objects.values_list('id', 'title')
+    ]
+    items += [
+        (AUTHOR, pk, name)
+        for pk, name in Author.objects.values_list('id', 'name')
+    ]
+    items += [
+        (KEYWORD, pk, word)
+        for pk, word in Keyword.objects.values_list('id', 'word')
+    ]
+    index.bulk_load(items)
+    return index
+
+
+_index: Optional[PrefixIndex] = None
+_index_lock = threading.Lock()
+_checked = 0.0
+
+
+def get_index() -> PrefixIndex:
+    """
+    Obtiene el índice del proceso, cargándolo del snapshot configurado en
+    `XBRECS_AUTOCOMPLETE_SNAPSHOT` o construyéndolo desde la base de datos
+    la primera vez que se usa. La versión compartida se comprueba como
+    mucho cada `CHECK_INTERVAL` segundos; si otro proceso ha cambiado los
+    datos indexados, el índice se reconstruye (y un snapshot con otra
+    versión no se usa).
+
+    ## Retorno:
+    - Índice de prefijos compartido.
+    """
+    global _index, _checked
+    now = time.monotonic()
+    if _index is not None and now - _checked < CHECK_INTERVAL:
+        return _index
+    with _index_lock:
+        if _index is not None and now - _checked < CHECK_INTERVAL:
+            return _index
+        version = index_version(INDEX_NAME)
+        if _index is None or _index.version != version:
+            index = None
+            path = getattr(settings, 'XBRECS_AUTOCOMPLETE_SNAPSHOT', None)
+            if _index is None and path and os.path.exists(path):
+                index = PrefixIndex.load(path)
+            if index is None or index.version != version:
+                index = build_index(version)
+            _index = index
+        _checked = now
+    return _index
+
+
+def suggest(prefix: str, limit: int = DEFAULT_LIMIT) -> List[Dict]:
+    """
+    Obtiene las sugerencias de autocompletado para un prefijo.
+
+    ## Argumentos:
+    - `prefix`: Texto escrito por el usuario.
+    - `limit`: Número máximo de sugerencias.
+
+    ## Retorno:
+    - Lista de sugerencias ordenadas.
+    """
+    return get_index().search(prefix, limit)
+
+
+# Mantenimiento del índice: cada cambio incrementa la versión compartida
+# para que los demás procesos reconstruyan el suyo, y se aplica al índice de
+# este proceso si ya se ha construido (si no, se construirá en el primer uso)
+
+def _index_changed(
+    added: Iterable[Tuple[str, int, str]] = (),
+    removed: Iterable[Item] = ()
+) -> None:
+    """
+    Registra un cambio de los datos indexados.
+
+    ## Argumentos:
+    - `added`: Tuplas (tipo, id, etiqueta) añadidas o modificadas.
+    - `removed`: Elementos (tipo, id) eliminados.
+    """
+    version = bump_index_version(INDEX_NAME)
+    if _index is not None:
+        _index.update(added, removed, version)
+
+
+def _label_changed(kind: str, instance, field: str, **kwargs) -> bool:
+    """
+    Indica si un guardado puede haber cambiado la etiqueta indexada.
+
+    ## Argumentos:
+    - `kind`: Tipo del elemento.
+    - `instance`: Instancia guardada.
+    - `field`: Campo de la etiqueta.
+    - `kwargs`: Argumentos de `post_save`.
+
+    ## Retorno:
+    - `False` si se han guardado otros campos o la etiqueta es la que ya
+    tiene el índice de este proceso.
+    """
+    update_fields = kwargs.get('update_fields')
+    if update_fields is not None and field not in update_fields:
+        return False
+    return kwargs.get('created') or _index is None or \
+        _index.label((kind, instance.id)) != getattr(instance, field)
+
+
+@receiver([post_save], sender=Book)
+def index_book(sender, instance: Book, **kwargs) -> None:
+    """
+    Actualiza el índice tras guardar un libro.
+
+    ## Argumentos:
+    - `sender`: Modelo que envía la señal.
+    - `instance`: Instancia de la señal.
+    - `kwargs`: Argumentos adicionales.
+    """
+    if _label_changed(BOOK, instance, 'title', **kwargs):
+        _index_changed([(BOOK, instance.id, instance.title)])
+
+
+@receiver([post_save], sender=Author)
+def index_author(sender, instance: Author, **kwargs) -> None:
+    """
+    Actualiza el índice tras guardar un autor.
+
+    ## Argumentos:
+    - `sender`: Modelo que envía la señal.
+    - `instance`: Instancia de la señal.
+    - `kwargs`: Argumentos adicionales.
+    """
+    if _label_changed(AUTHOR, instance, 'name', **kwargs):
+        _index_changed([(AUTHOR, instance.id, instance.name)])
+
+
+@receiver([post_save], sender=Keyword)
+def index_keyword(sender, instance: Keyword, **kwargs) -> None:
+    """
+    Actualiza el índice tras guardar una palabra clave.
+
+    ## Argumentos:
+    - `sender`: Modelo que envía la señal.
+    - `instance`: Instancia de la señal.
+    - `kwargs`: Argumentos adicionales.
+    """
+    if _label_changed(KEYWORD, instance, 'word', **kwargs):
+        _index_changed([(KEYWORD, instance.id, instance.word)])
+
+
+@receiver([m2m_changed], sender=Book.authors.through)
+def index_book_authors(
+    sender, instance: Book, action: str, **kwargs
+) -> None:
+    """
+    Añade al índice los autores asociados a un libro (por ejemplo, los
+    creados con `bulk_create`, que no lanzan `post_save`).
+
+    ## Argumentos:
+    - `sender`: Modelo que envía la señal.
+    - `instance`: Instancia de la señal.
+    - `action`: Tipo de cambio en la relación.
+    - `kwargs`: Argumentos adicionales.
+    """
+    if action != 'post_add' or not isinstance(instance, Book):
+        return
+    authors = [
+        (AUTHOR, pk, name)
+        for pk, name in instance.authors.values_list('id', 'name')
+    ]
+    if _index is None or any(
+        _index.label((kind, pk)) != name for kind, pk, name in authors
+    ):
+        _index_changed(authors)
+
+
+@receiver([post_delete], sender=Book)
+@receiver([post_delete], sender=Author)
+@receiver([post_delete], sender=Keyword)
+def unindex_object(sender, instance, **kwargs) -> None:
+    """
+    Elimina del índice un libro, autor o palabra clave borrado.
+
+    ## Argumentos:
+    - `sender`: Modelo que envía la señal.
+    - `instance`: Instancia de la señal.
+    - `kwargs`: Argumentos adicionales.
+    """
+    kind = {Book: BOOK, Author: AUTHOR, Keyword: KEYWORD}[sender]
+    _index_changed(removed=[(kind, instance.id)])
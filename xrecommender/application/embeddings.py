@@ -0,0 +1,141 @@
+import numpy as np
+from scipy.sparse import csr_matrix
+from typing import Dict, List, Tuple
+
+from django.db import transaction
+from django.db.models import F
+
+from .matrices import embedding_matrix, ratings_to_csr
+from .models import User, Book, Rating, LIKES
+
+CHUNK_SIZE = 2048  # Usuarios por bloque
+WORST_USERS = 10  # Usuarios con más desviación que se muestran
+
+
+def user_embeddings(
+    likes: csr_matrix, books: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Calcula los embeddings de un bloque de usuarios como la media de los
+    embeddings de los libros que les gustan ponderada por la valoración
+    (lo mismo que mantienen las señales de `Rating` valoración a
+    valoración).
+
+    ## Argumentos:
+    - `likes`: Valoraciones positivas (usuarios x libros).
+    - `books`: Matriz de embeddings de los libros (float64).
+
+    ## Retorno:
+    - Tupla (embeddings float64, suma de las valoraciones positivas).
+    """
+    sums = np.asarray(likes.sum(axis=1), dtype=np.float64).ravel()
+    embeddings = np.asarray(likes.astype(np.float64) @ books)
+    # Sin valoraciones positivas el embedding queda a cero
+    np.divide(embeddings, sums[:, None], out=embeddings,
+              where=sums[:, None] != 0.0)
+    return embeddings, sums
+
+
+def rebuild_user_embeddings(
+    chunk_size: int = CHUNK_SIZE, dry_run: bool = False,
+    tolerance: float = 0.0
+) -> Dict:
+    """
+    Recalcula el embedding y `sum_ratings` de todos los usuarios a partir
+    de sus valoraciones, por bloques de usuarios, con un producto de la
+    matriz dispersa de valoraciones positivas por la de libros. Repara la
+    deriva de la actualización incremental o los datos que quedan
+    desfasados tras cargas masivas sin señales o un cambio de `LIKES`.
+
+    ## Argumentos:
+    - `chunk_size`: Usuarios por bloque.
+    - `dry_run`: Si es `True`, sólo calcula la desviación sin guardar.
+    - `tolerance`: Desviación máxima a partir de la cual se guarda un
+    usuario.
+
+    ## Retorno:
+    - Diccionario con el informe de desviación: usuarios recalculados y
+    por encima de la tolerancia, desviación máxima y media de los
+    embeddings y de `sum_ratings` y los usuarios con más desviación.
+    """
+    book_ids, books = embedding_matrix(Book.objects.all(), np.float64)
+    user_ids = np.array(list(
+        User.objects.order_by('id').values_list('id', flat=True)
+    ), dtype=np.int64)
+    ids: List[np.ndarray] = []
+    max_devs: List[np.ndarray] = []
+    mean_devs: List[np.ndarray] = []
+    sum_devs: List[np.ndarray] = []
+    changed = 0
+    for start in range(0, len(user_ids), chunk_size):
+        chunk = user_ids[start:start + chunk_size]
+        queryset = User.objects.filter(id__in=chunk.tolist())
+        if not dry_run:
+            # Sólo se bloquean los usuarios si se van a guardar
+            queryset = queryset.select_for_update()
+        with transaction.atomic():
+            users = list(queryset.order_by('id').only(
+                'id', 'embedding', 'sum_ratings'
+            ))
+            chunk = np.array([u.id for u in users], dtype=np.int64)
+            ratings = np.array(list(Rating.objects.filter(
+                user_id__in=chunk.tolist(), rating__gte=LIKES
+            ).values_list('user_id', 'book_id', 'rating')),
+                dtype=np.float64).reshape(-1, 3)
+            likes = ratings_to_csr(
+                ratings[:, 0].astype(np.int64),
+                ratings[:, 1].astype(np.int64),
+                ratings[:, 2], chunk, book_ids
+            )
+            embeddings, sums = user_embeddings(likes, books)
+
+            # Desviación de los datos guardados frente a los recalculados
+            current = np.vstack([
+                np.asarray(u.get_embedding(), dtype=np.float64)
+                for u in users
+            ]) if users else embeddings
+            deviation = np.abs(current - embeddings)
+            max_dev = deviation.max(axis=1, initial=0.0)
+            sum_dev = np.abs(
+                np.array([u.sum_ratings for u in users]) - sums
+            )
+            ids.append(chunk)
+            max_devs.append(max_dev)
+            mean_devs.append(deviation.mean(axis=1))
+            sum_devs.append(sum_dev)
+
+            stale = np.flatnonzero(
+                (max_dev > tolerance) | (sum_dev > tolerance)
+            )
+            changed += len(stale)
+            if dry_run or not len(stale):
+                continue
+            for i in stale.tolist():
+                users[i].set_embedding(embeddings[i])
+                users[i].sum_ratings = float(sums[i])
+            User.objects.bulk_update(
+                [users[i] for i in stale.tolist()],
+                ['embedding', 'sum_ratings'], batch_size=500
+            )
+            # Las recomendaciones cambian con el embedding
+            User.objects.filter(id__in=chunk[stale].tolist()).update(
+                ratings_version=F('ratings_version') + 1
+            )
+
+    user_ids = np.concatenate(ids) if ids else user_ids
+    max_dev = np.concatenate(max_devs) if max_devs else np.zeros(0)
+    mean_dev = np.concatenate(mean_devs) if mean_devs else np.zeros(0)
+    sum_dev = np.concatenate(sum_devs) if sum_devs else np.zeros(0)
+    worst = np.argsort(-max_dev, kind='stable')[:WORST_USERS]
+    return {
+        'users': len(max_dev),
+        'changed': changed,
+        'saved': 0 if dry_run else changed,
+        'max_deviation': float(max_dev.max(initial=0.0)),
+        'mean_deviation': float(mean_dev.mean()) if len(mean_dev) else 0.0,
+        'max_sum_deviation': float(sum_dev.max(initial=0.0)),
+        'worst': [
+            (int(user_ids[i]), float(max_dev[i]), float(mean_dev[i]))
+            for i in worst.tolist() if max_dev[i] > 0.0
+        ],
+    }
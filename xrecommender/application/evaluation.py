@@ -0,0 +1,394 @@
+import multiprocessing
+import os
+import numpy as np
+import pandas as pd
+from typing import Dict, List, Optional, Tuple
+
+# Métricas y cortes de `elliot/experiment_config.yml` (en el mismo orden
+# que las columnas de los resultados de Elliot)
+METRICS = [
+    'nDCG', 'Precision', 'Recall', 'HR', 'MAP', 'MAR', 'MRR',
+    'ItemCoverage', 'EFD', 'EPC', 'Gini'
+]
+USER_METRICS = [
+    'nDCG', 'Precision', 'Recall', 'HR', 'MAP', 'MAR', 'MRR', 'EFD', 'EPC'
+]
+CUTOFFS = [50, 25, 10, 5]
+RELEVANT_THRESHOLD = 0.0
+COLUMNS = ['user_id', 'book_id', 'rating']
+
+
+def read_tsv(path: str, value: str = 'rating') -> pd.DataFrame:
+    """
+    Lee un fichero TSV sin cabecera (usuario, libro, valor) como los de
+    `datasets/training`.
+
+    ## Argumentos:
+    - `path`: Ruta del fichero.
+    - `value`: Nombre de la tercera columna.
+
+    ## Retorno:
+    - `DataFrame` con las columnas `user_id`, `book_id` y `value`.
+    """
+    return pd.read_csv(
+        path, sep='\t', header=None, names=['user_id', 'book_id', value],
+        dtype={'user_id': 'int64', 'book_id': 'int64', value: 'float64'}
+    )
+
+
+def discount(n: int) -> np.ndarray:
+    """
+    Descuento logarítmico de las `n` primeras posiciones, 1/log2(r + 2).
+
+    ## Argumentos:
+    - `n`: Número de posiciones.
+
+    ## Retorno:
+    - Vector de descuentos.
+    """
+    return 1 / np.log2(np.arange(n) + 2)
+
+
+class Evaluator:
+    """
+    Evaluación offline con las mismas métricas que Elliot, calculadas con
+    operaciones sobre matrices (usuarios x posiciones) en lugar de bucles
+    por usuario.
+
+    Como Elliot, sólo considera usuarios y libros del conjunto de
+    entrenamiento, evalúa las métricas de usuario sobre los usuarios con
+    recomendaciones y algún libro relevante en test, y las de sistema
+    (ItemCoverage y Gini) sobre todas las recomendaciones.
+    """
+
+    def __init__(
+        self,
+        train: pd.DataFrame,
+        test: pd.DataFrame,
+        threshold: float = RELEVANT_THRESHOLD
+    ) -> None:
+        self.threshold = threshold
+        self.user_ids = np.unique(train['user_id'].values)
+        self.book_ids = np.unique(train['book_id'].values)
+        self.n_items = len(self.book_ids)
+
+        # Popularidad de los libros en entrenamiento
+        interactions = np.bincount(
+            np.searchsorted(self.book_ids, train['book_id'].values),
+            minlength=self.n_items
+        ).astype(np.float64)
+        self.efd_novelty = -np.log2(interactions / interactions.sum())
+        self.epc_novelty = 1 - interactions / len(self.user_ids)
+
+        # Libros relevantes de test, ordenados por usuario y ganancia
+        test = test[
+            np.isin(test['user_id'].values, self.user_ids) &
+            np.isin(test['book_id'].values, self.book_ids) &
+            (test['rating'].values >= threshold)
+        ]
+        users = np.searchsorted(self.user_ids, test['user_id'].values)
+        items = np.searchsorted(self.book_ids, test['book_id'].values)
+        gains = 2 ** (test['rating'].values - threshold + 1) - 1
+        order = np.lexsort((-gains, users))
+        users, items, gains = users[order], items[order], gains[order]
+        keys = users * self.n_items + items
+        key_order = np.argsort(keys)
+        self.test_keys = keys[key_order]
+        self.test_gains = gains[key_order]
+        self.relevant = np.bincount(users, minlength=len(self.user_ids))
+        # Posición de cada libro relevante en el orden ideal del usuario
+        starts = np.searchsorted(users, users)
+        self._ideal = (users, gains, np.arange(len(users)) - starts)
+        self._idcg: Dict[int, np.ndarray] = dict()
+
+    def idcg(self, cutoff: int) -> np.ndarray:
+        """
+        Obtiene el DCG ideal de cada usuario en un corte.
+
+        ## Argumentos:
+        - `cutoff`: Corte.
+
+        ## Retorno:
+        - Vector con el DCG ideal por usuario.
+        """
+        if cutoff not in self._idcg:
+            users, gains, ranks = self._ideal
+            top = ranks < cutoff
+            self._idcg[cutoff] = np.bincount(
+                users[top],
+                weights=gains[top] * discount(cutoff)[ranks[top]],
+                minlength=len(self.user_ids)
+            )
+        return self._idcg[cutoff]
+
+    def recommendation_matrix(
+        self, recs: pd.DataFrame, top: int
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Convierte las recomendaciones en una matriz de posiciones de libro
+        por usuario, ordenadas por predicción (-1 si no hay libro).
+
+        ## Argumentos:
+        - `recs`: Recomendaciones (`user_id`, `book_id`, `prediction`).
+        - `top`: Número máximo de recomendaciones por usuario.
+
+        ## Retorno:
+        - Tupla (posiciones de los usuarios, matriz usuarios x `top`).
+        """
+        recs = recs[
+            np.isin(recs['user_id'].values, self.user_ids) &
+            np.isin(recs['book_id'].values, self.book_ids)
+        ]
+        users = np.searchsorted(self.user_ids, recs['user_id'].values)
+        items = np.searchsorted(self.book_ids, recs['book_id'].values)
+        order = np.lexsort((-recs['prediction'].values, users))
+        users, items = users[order], items[order]
+        ranks = np.arange(len(users)) - np.searchsorted(users, users)
+        keep = ranks < top
+        rec_users, rows = np.unique(users[keep], return_inverse=True)
+        matrix = np.full((len(rec_users), top), -1, dtype=np.int64)
+        matrix[rows, ranks[keep]] = items[keep]
+        return rec_users, matrix
+
+    def partial(
+        self, users: np.ndarray, items: np.ndarray, cutoffs: List[int]
+    ) -> Dict[int, Tuple[np.ndarray, int, np.ndarray]]:
+        """
+        Calcula las sumas de las métricas de un grupo de usuarios, que
+        después se combinan con las de otros grupos.
+
+        ## Argumentos:
+        - `users`: Posiciones de los usuarios.
+        - `items`: Matriz de recomendaciones de los usuarios.
+        - `cutoffs`: Cortes.
+
+        ## Retorno:
+        - Diccionario corte -> (suma de cada métrica de usuario, usuarios
+        evaluados, recomendaciones de cada libro).
+        """
+        valid = items >= 0
+        keys = users[:, None] * self.n_items + np.where(valid, items, 0)
+        pos = np.minimum(
+            np.searchsorted(self.test_keys, keys), len(self.test_keys) - 1
+        )
+        hits = valid & (self.test_keys[pos] == keys) \
+            if len(self.test_keys) else np.zeros_like(valid)
+        gains = np.where(hits, self.test_gains[pos], 0.0) \
+            if len(self.test_keys) else np.zeros(valid.shape)
+        relevant = self.relevant[users].astype(np.float64)
+        evaluated = relevant > 0
+
+        results = dict()
+        for cutoff in cutoffs:
+            h = hits[:, :cutoff][evaluated].astype(np.float64)
+            g = gains[:, :cutoff][evaluated]
+            v = valid[:, :cutoff][evaluated]
+            it = items[:, :cutoff][evaluated]
+            rel = relevant[evaluated]
+            disc = discount(h.shape[1])
+            n = np.arange(1, h.shape[1] + 1)
+
+            n_hits = h.sum(axis=1)
+            cum_hits = np.cumsum(h, axis=1)
+            first = np.argmax(h, axis=1)
+            norm = (v * disc).sum(axis=1)
+            novelty = np.where(v, self.efd_novelty[np.maximum(it, 0)], 0.0)
+            expected = np.where(v, self.epc_novelty[np.maximum(it, 0)], 0.0)
+            per_user = {
+                'nDCG': (g * disc).sum(axis=1) / self.idcg(cutoff)[
+                    users[evaluated]],
+                'Precision': n_hits / cutoff,
+                'Recall': n_hits / rel,
+                'HR': (n_hits > 0).astype(np.float64),
+                'MAP': (cum_hits / n).sum(axis=1) / cutoff,
+                'MAR': (cum_hits / rel[:, None]).sum(axis=1) / cutoff,
+                'MRR': np.where(n_hits > 0, 1 / (first + 1), 0.0),
+                'EFD': np.divide(
+                    (h * disc * novelty).sum(axis=1), norm,
+                    out=np.zeros_like(norm), where=norm > 0
+                ),
+                'EPC': np.divide(
+                    (h * disc * expected).sum(axis=1), norm,
+                    out=np.zeros_like(norm), where=norm > 0
+                ),
+            }
+            sums = np.array([per_user[m].sum() for m in USER_METRICS])
+            counts = np.bincount(
+                items[:, :cutoff][valid[:, :cutoff]], minlength=self.n_items
+            )
+            results[cutoff] = (sums, int(evaluated.sum()), counts)
+        return results
+
+    def evaluate(
+        self,
+        recs: pd.DataFrame,
+        cutoffs: List[int] = CUTOFFS,
+        workers: int = 1
+    ) -> Dict[int, Dict[str, float]]:
+        """
+        Evalúa unas recomendaciones en varios cortes.
+
+        ## Argumentos:
+        - `recs`: Recomendaciones (`user_id`, `book_id`, `prediction`).
+        - `cutoffs`: Cortes.
+        - `workers`: Número de procesos entre los que se reparten los
+        usuarios.
+
+        ## Retorno:
+        - Diccionario corte -> métrica -> valor.
+        """
+        users, items = self.recommendation_matrix(recs, max(cutoffs))
+        shards = [
+            (users[rows], items[rows])
+            for rows in np.array_split(np.arange(len(users)), max(workers, 1))
+            if len(rows)
+        ]
+        partials = _map_shards(self, shards, cutoffs, workers)
+
+        results = dict()
+        for cutoff in cutoffs:
+            sums = sum(p[cutoff][0] for p in partials)
+            evaluated = sum(p[cutoff][1] for p in partials)
+            counts = sum(p[cutoff][2] for p in partials)
+            metrics = {
+                m: float(s / evaluated) if evaluated else 0.0
+                for m, s in zip(USER_METRICS, sums)
+            }
+            metrics['ItemCoverage'] = float(np.count_nonzero(counts))
+            metrics['Gini'] = gini(counts)
+            results[cutoff] = {m: metrics[m] for m in METRICS}
+        return results
+
+
+def gini(counts: np.ndarray) -> float:
+    """
+    Índice de Gini de la distribución de recomendaciones entre todos los
+    libros, en la forma de Elliot (1 - Gini: más alto, más diverso).
+
+    ## Argumentos:
+    - `counts`: Número de recomendaciones de cada libro.
+
+    ## Retorno:
+    - Valor de la métrica.
+    """
+    n = len(counts)
+    total = counts.sum()
+    if n < 2 or total == 0:
+        return 0.0
+    j = np.arange(1, n + 1)
+    value = ((2 * j - n - 1) * np.sort(counts) / total).sum() / (n - 1)
+    return float(1 - value)
+
+
+# Evaluador compartido con los procesos del pool (se hereda con fork)
+_evaluator: Optional[Evaluator] = None
+
+
+def _partial_shard(args):
+    """Calcula las sumas de un grupo de usuarios en el pool."""
+    users, items, cutoffs = args
+    return _evaluator.partial(users, items, cutoffs)
+
+
+def _map_shards(
+    evaluator: Evaluator,
+    shards: List[Tuple[np.ndarray, np.ndarray]],
+    cutoffs: List[int],
+    workers: int
+) -> List[Dict]:
+    """
+    Calcula las sumas parciales de cada grupo de usuarios, en paralelo si
+    hay varios procesos.
+
+    ## Argumentos:
+    - `evaluator`: Evaluador.
+    - `shards`: Grupos (posiciones de usuario, matriz de recomendaciones).
+    - `cutoffs`: Cortes.
+    - `workers`: Número de procesos.
+
+    ## Retorno:
+    - Lista con el resultado de `Evaluator.partial` de cada grupo.
+    """
+    global _evaluator
+    args = [(users, items, cutoffs) for users, items in shards]
+    if workers <= 1 or len(shards) <= 1 or \
+            'fork' not in multiprocessing.get_all_start_methods():
+        return [evaluator.partial(*a) for a in args]
+    _evaluator = evaluator
+    try:
+        with multiprocessing.get_context('fork').Pool(workers) as pool:
+            return pool.map(_partial_shard, args)
+    finally:
+        _evaluator = None
+
+
+def result_tag(path: str) -> Tuple[str, str]:
+    """
+    Obtiene el nombre del modelo y el sufijo de los ficheros de resultados
+    a partir del nombre del fichero de predicciones, siguiendo la
+    estructura de `elliot/results`: `cutoff_{c}_k_{vecinos}.tsv` para el
+    barrido de vecinos y `cutoff_{c}_{peso}.tsv` para el resto.
+
+    ## Argumentos:
+    - `path`: Ruta del fichero de predicciones.
+
+    ## Retorno:
+    - Tupla (modelo, sufijo).
+    """
+    model = os.path.splitext(os.path.basename(path))[0]
+    parts = model.split('_')
+    if len(parts) == 4 and parts[1] == 'cf' and parts[3] != '0':
+        return model, f"k_{parts[3]}"
+    return model, parts[2] if len(parts) >= 3 else model
+
+
+def write_results(
+    output: str, path: str, results: Dict[int, Dict[str, float]]
+) -> List[str]:
+    """
+    Escribe los resultados con el formato de Elliot, un fichero por corte.
+
+    ## Argumentos:
+    - `output`: Carpeta de resultados.
+    - `path`: Ruta del fichero de predicciones evaluado.
+    - `results`: Resultados por corte.
+
+    ## Retorno:
+    - Rutas de los ficheros escritos.
+    """
+    os.makedirs(output, exist_ok=True)
+    model, tag = result_tag(path)
+    paths = []
+    for cutoff, metrics in results.items():
+        result_path = os.path.join(output, f"cutoff_{cutoff}_{tag}.tsv")
+        with open(result_path, 'w') as f:
+            f.write('\t'.join(['model'] + METRICS) + '\n')
+            f.write('\t'.join(
+                [model] + [repr(metrics[m]) for m in METRICS]
+            ) + '\n')
+        paths.append(result_path)
+    return paths
+
+
+def compare_results(
+    results: Dict[str, float], reference_path: str
+) -> Dict[str, Tuple[float, float]]:
+    """
+    Compara unos resultados con los de un fichero de resultados de Elliot.
+
+    ## Argumentos:
+    - `results`: Métrica -> valor.
+    - `reference_path`: Fichero de resultados de Elliot.
+
+    ## Retorno:
+    - Diccionario métrica -> (valor de Elliot, diferencia relativa).
+    """
+    reference = pd.read_csv(reference_path, sep='\t').iloc[0]
+    comparison = dict()
+    for metric in METRICS:
+        if metric not in reference:
+            continue
+        expected = float(reference[metric])
+        diff = abs(results[metric] - expected) / max(abs(expected), 1e-12)
+        comparison[metric] = (expected, diff)
+    return comparison
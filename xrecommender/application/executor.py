@@ -0,0 +1,72 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+
+_executors: Dict[int, ThreadPoolExecutor] = dict()
+_executors_lock = threading.Lock()
+
+
+def worker_threads() -> int:
+    """
+    Hilos configurados para el trabajo de las vistas asíncronas
+    (`XBRECS_ASYNC_WORKERS`).
+
+    ## Retorno:
+    - Número de hilos (al menos 1).
+    """
+    return max(1, getattr(settings, 'XBRECS_ASYNC_WORKERS', 1))
+
+
+def _executor() -> ThreadPoolExecutor:
+    """
+    Obtiene el pool de hilos del proceso actual. Si el proceso viene de
+    un fork, crea uno nuevo.
+
+    ## Retorno:
+    - Pool de hilos.
+    """
+    pid = os.getpid()
+    with _executors_lock:
+        if pid not in _executors:
+            _executors[pid] = ThreadPoolExecutor(
+                worker_threads(), thread_name_prefix='xbrecs-worker'
+            )
+        return _executors[pid]
+
+
+def _call(fn: Callable, *args, **kwargs) -> Any:
+    """
+    Ejecuta una función en un hilo del pool con el mismo ciclo de vida de
+    las conexiones que una petición síncrona: cada hilo mantiene su
+    conexión y se descarta si ha caducado o ha quedado inservible.
+    """
+    close_old_connections()
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        close_old_connections()
+
+
+async def run_in_worker(fn: Callable, *args, **kwargs) -> Any:
+    """
+    Ejecuta código síncrono (cálculo con NumPy o consultas del ORM) en el
+    pool acotado de hilos sin bloquear el bucle de eventos. Las peticiones
+    que esperan un hilo libre no ocupan ninguno, así que un servidor ASGI
+    atiende muchos clientes lentos con `XBRECS_ASYNC_WORKERS` hilos.
+
+    ## Argumentos:
+    - `fn`: Función a ejecutar.
+    - `args`: Argumentos posicionales.
+    - `kwargs`: Argumentos con nombre.
+
+    ## Retorno:
+    - Resultado de la función.
+    """
+    return await sync_to_async(
+        _call, thread_sensitive=False, executor=_executor()
+    )(fn, *args, **kwargs)
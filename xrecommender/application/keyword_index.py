@@ -0,0 +1,379 @@
+import os
+import threading
+import time
+import numpy as np
+from typing import Dict, Iterable, Optional
+
+from django.conf import settings
+from django.db.models.signals import post_delete, m2m_changed
+from django.dispatch import receiver
+
+from .models import Book, Keyword, index_version, bump_index_version
+
+SNAPSHOT_VERSION = 2
+INDEX_NAME = 'keyword_index'  # Nombre de la versión compartida
+CHECK_INTERVAL = 5.0  # Segundos entre comprobaciones de la versión
+EMPTY = np.zeros(0, dtype=np.int64)
+
+
+def _split_by(
+    keys: np.ndarray, values: np.ndarray
+) -> Dict[int, np.ndarray]:
+    """
+    Agrupa pares (clave, valor) en arrays ordenados de valores por clave.
+
+    ## Argumentos:
+    - `keys`: Claves de los pares.
+    - `values`: Valores de los pares.
+
+    ## Retorno:
+    - Diccionario {clave: array ordenado de valores}.
+    """
+    order = np.lexsort((values, keys))
+    keys, values = keys[order], values[order]
+    unique, starts = np.unique(keys, return_index=True)
+    return dict(zip(unique.tolist(), np.split(values, starts[1:])))
+
+
+class KeywordIndex:
+    """
+    Índice invertido en memoria entre palabras clave y libros. Para cada
+    palabra clave guarda el array ordenado de IDs de sus libros y, para
+    cada libro, el de sus palabras clave, de modo que las intersecciones
+    se resuelven con NumPy sin consultar la base de datos.
+
+    Los arrays no se modifican: cada actualización los reemplaza, así que
+    las lecturas no necesitan el cerrojo.
+    """
+
+    def __init__(self) -> None:
+        self._books: Dict[int, np.ndarray] = dict()  # Palabra -> libros
+        self._keywords: Dict[int, np.ndarray] = dict()  # Libro -> palabras
+        self._lock = threading.Lock()
+        self.version = 0  # Versión compartida que refleja el índice
+
+    def __len__(self) -> int:
+        return len(self._books)
+
+    @classmethod
+    def from_pairs(
+        cls, book_ids: np.ndarray, keyword_ids: np.ndarray
+    ) -> 'KeywordIndex':
+        """
+        Construye el índice a partir de los pares (libro, palabra clave).
+
+        ## Argumentos:
+        - `book_ids`: IDs de los libros de cada par.
+        - `keyword_ids`: IDs de las palabras clave de cada par.
+
+        ## Retorno:
+        - Índice construido.
+        """
+        book_ids = np.asarray(book_ids, dtype=np.int64)
+        keyword_ids = np.asarray(keyword_ids, dtype=np.int64)
+        index = cls()
+        index._books = _split_by(keyword_ids, book_ids)
+        index._keywords = _split_by(book_ids, keyword_ids)
+        return index
+
+    def books_of(self, keyword_id: int) -> np.ndarray:
+        """
+        Obtiene los libros de una palabra clave.
+
+        ## Argumentos:
+        - `keyword_id`: ID de la palabra clave.
+
+        ## Retorno:
+        - Array ordenado de IDs de libros.
+        """
+        return self._books.get(keyword_id, EMPTY)
+
+    def keywords_of(self, book_id: int) -> np.ndarray:
+        """
+        Obtiene las palabras clave de un libro.
+
+        ## Argumentos:
+        - `book_id`: ID del libro.
+
+        ## Retorno:
+        - Array ordenado de IDs de palabras clave.
+        """
+        return self._keywords.get(book_id, EMPTY)
+
+    def books_with_any(self, keyword_ids: Iterable[int]) -> np.ndarray:
+        """
+        Obtiene los libros que tienen alguna de las palabras clave dadas.
+
+        ## Argumentos:
+        - `keyword_ids`: IDs de las palabras clave.
+
+        ## Retorno:
+        - Array ordenado de IDs de libros (sin repetidos).
+        """
+        arrays = [self.books_of(kw) for kw in keyword_ids]
+        return np.unique(np.concatenate(arrays)) if arrays else EMPTY
+
+    def keywords_of_books(self, book_ids: Iterable[int]) -> np.ndarray:
+        """
+        Obtiene las palabras clave de un conjunto de libros.
+
+        ## Argumentos:
+        - `book_ids`: IDs de los libros.
+
+        ## Retorno:
+        - Array ordenado de IDs de palabras clave (sin repetidos).
+        """
+        arrays = [self.keywords_of(book) for book in book_ids]
+        return np.unique(np.concatenate(arrays)) if arrays else EMPTY
+
+    def link(
+        self, book_ids: Iterable[int], keyword_ids: Iterable[int]
+    ) -> None:
+        """
+        Añade las relaciones entre cada libro y cada palabra clave dados.
+
+        ## Argumentos:
+        - `book_ids`: IDs de los libros.
+        - `keyword_ids`: IDs de las palabras clave.
+        """
+        book_ids = np.unique(np.asarray(list(book_ids), dtype=np.int64))
+        keyword_ids = np.unique(np.asarray(list(keyword_ids), dtype=np.int64))
+        with self._lock:
+            for kw in keyword_ids.tolist():
+                self._books[kw] = np.union1d(self.books_of(kw), book_ids)
+            for book in book_ids.tolist():
+                self._keywords[book] = np.union1d(
+                    self.keywords_of(book), keyword_ids
+                )
+
+    def unlink(
+        self, book_ids: Iterable[int], keyword_ids: Iterable[int]
+    ) -> None:
+        """
+        Elimina las relaciones entre cada libro y cada palabra clave dados.
+
+        ## Argumentos:
+        - `book_ids`: IDs de los libros.
+        - `keyword_ids`: IDs de las palabras clave.
+        """
+        book_ids = np.asarray(list(book_ids), dtype=np.int64)
+        keyword_ids = np.asarray(list(keyword_ids), dtype=np.int64)
+        with self._lock:
+            self._unlink(self._books, keyword_ids, book_ids)
+            self._unlink(self._keywords, book_ids, keyword_ids)
+
+    @staticmethod
+    def _unlink(
+        table: Dict[int, np.ndarray], keys: np.ndarray, values: np.ndarray
+    ) -> None:
+        for key in keys.tolist():
+            remaining = np.setdiff1d(
+                table.get(key, EMPTY), values, assume_unique=True
+            )
+            if len(remaining):
+                table[key] = remaining
+            else:
+                table.pop(key, None)
+
+    def remove_book(self, book_id: int) -> None:
+        """
+        Elimina un libro del índice.
+
+        ## Argumentos:
+        - `book_id`: ID del libro.
+        """
+        self.unlink([book_id], self.keywords_of(book_id))
+
+    def remove_keyword(self, keyword_id: int) -> None:
+        """
+        Elimina una palabra clave del índice.
+
+        ## Argumentos:
+        - `keyword_id`: ID de la palabra clave.
+        """
+        self.unlink(self.books_of(keyword_id), [keyword_id])
+
+    def save(self, path: str) -> None:
+        """
+        Guarda el índice en disco (como pares libro-palabra clave) para
+        cargarlo en el arranque.
+
+        ## Argumentos:
+        - `path`: Ruta del fichero de snapshot (`.npz`).
+        """
+        with self._lock:
+            books = dict(self._books)
+        keyword_ids = np.array(list(books), dtype=np.int64)
+        sizes = [len(books[kw]) for kw in keyword_ids.tolist()]
+        book_ids = np.concatenate(list(books.values())) if books else EMPTY
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.savez(
+                f, version=np.array(SNAPSHOT_VERSION),
+                index_version=np.array(self.version),
+                book_ids=book_ids, keyword_ids=np.repeat(keyword_ids, sizes)
+            )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(
+        cls, path: str, version: Optional[int] = None
+    ) -> Optional['KeywordIndex']:
+        """
+        Carga un índice previamente guardado con `save`.
+
+        ## Argumentos:
+        - `path`: Ruta del fichero de snapshot.
+        - `version`: Si se indica, versión compartida actual: un snapshot
+        de otra versión no se carga.
+
+        ## Retorno:
+        - Índice cargado o `None` si el snapshot no es compatible o está
+        desactualizado.
+        """
+        with np.load(path) as data:
+            if int(data['version']) != SNAPSHOT_VERSION:
+                return None
+            saved = int(data['index_version'])
+            if version is not None and saved != version:
+                return None
+            index = cls.from_pairs(data['book_ids'], data['keyword_ids'])
+        index.version = saved
+        return index
+
+
+def build_index(version: Optional[int] = None) -> KeywordIndex:
+    """
+    Construye el índice invertido a partir de la base de datos con una
+    única consulta sobre la tabla intermedia de la relación.
+
+    ## Argumentos:
+    - `version`: Versión compartida que se ha leído antes de construirlo.
+    Por defecto, se lee.
+
+    ## Retorno:
+    - Índice con todas las relaciones libro-palabra clave.
+    """
+    # La versión se lee antes que los datos: si cambian entretanto, el
+    # índice se volverá a construir en la siguiente comprobación
+    if version is None:
+        version = index_version(INDEX_NAME)
+    pairs = np.array(list(
+        Book.keywords.through.objects.values_list('book_id', 'keyword_id')
+    ), dtype=np.int64).reshape(-1, 2)
+    index = KeywordIndex.from_pairs(pairs[:, 0], pairs[:, 1])
+    index.version = version
+    return index
+
+
+_index: Optional[KeywordIndex] = None
+_index_lock = threading.Lock()
+_checked = 0.0
+
+
+def get_keyword_index() -> KeywordIndex:
+    """
+    Obtiene el índice del proceso, cargándolo del snapshot configurado en
+    `XBRECS_KEYWORD_INDEX_SNAPSHOT` o construyéndolo desde la base de datos
+    la primera vez que se usa. La versión compartida se comprueba como
+    mucho cada `CHECK_INTERVAL` segundos; si otro proceso ha cambiado las
+    relaciones, el índice se reconstruye (y un snapshot con otra versión
+    no se carga).
+
+    ## Retorno:
+    - Índice invertido compartido.
+    """
+    global _index, _checked
+    now = time.monotonic()
+    if _index is not None and now - _checked < CHECK_INTERVAL:
+        return _index
+    with _index_lock:
+        if _index is not None and now - _checked < CHECK_INTERVAL:
+            return _index
+        version = index_version(INDEX_NAME)
+        if _index is None or _index.version != version:
+            index = None
+            path = getattr(settings, 'XBRECS_KEYWORD_INDEX_SNAPSHOT', None)
+            if _index is None and path and os.path.exists(path):
+                index = KeywordIndex.load(path, version)
+            _index = index if index is not None else build_index(version)
+        _checked = now
+    return _index
+
+
+# Mantenimiento del índice: cada cambio incrementa la versión compartida
+# para que los demás procesos reconstruyan el suyo, y se aplica al índice de
+# este proceso si ya se ha construido (si no, se construirá en el primer
+# uso). Si nadie más ha cambiado las relaciones entretanto, el índice de
+# este proceso pasa a reflejar la nueva versión
+
+def _index_changed() -> Optional[KeywordIndex]:
+    """
+    Registra un cambio de las relaciones indexadas.
+
+    ## Retorno:
+    - Índice de este proceso, si ya se ha construido.
+    """
+    version = bump_index_version(INDEX_NAME)
+    index = _index
+    if index is not None and version == index.version + 1:
+        index.version = version
+    return index
+
+
+@receiver([m2m_changed], sender=Book.keywords.through)
+def index_book_keywords(
+    sender, instance, action: str, reverse: bool, pk_set, **kwargs
+) -> None:
+    """
+    Actualiza el índice tras cambiar las palabras clave de un libro (o los
+    libros de una palabra clave).
+
+    ## Argumentos:
+    - `sender`: Modelo intermedio de la relación.
+    - `instance`: Libro (o palabra clave si `reverse`).
+    - `action`: Tipo de cambio en la relación.
+    - `reverse`: Indica si el cambio se hace desde la palabra clave.
+    - `pk_set`: IDs de los objetos añadidos o eliminados.
+    - `kwargs`: Argumentos adicionales.
+    """
+    if action == 'post_clear':
+        index = _index_changed()
+        if index is None:
+            return
+        if reverse:
+            index.remove_keyword(instance.pk)
+        else:
+            index.remove_book(instance.pk)
+        return
+    if action not in ('post_add', 'post_remove') or not pk_set:
+        return
+    index = _index_changed()
+    if index is None:
+        return
+    book_ids, keyword_ids = (pk_set, [instance.pk]) if reverse \
+        else ([instance.pk], pk_set)
+    if action == 'post_add':
+        index.link(book_ids, keyword_ids)
+    else:
+        index.unlink(book_ids, keyword_ids)
+
+
+@receiver([post_delete], sender=Book)
+@receiver([post_delete], sender=Keyword)
+def unindex_book_or_keyword(sender, instance, **kwargs) -> None:
+    """
+    Elimina del índice un libro o una palabra clave borrados.
+
+    ## Argumentos:
+    - `sender`: Modelo que envía la señal.
+    - `instance`: Instancia de la señal.
+    - `kwargs`: Argumentos adicionales.
+    """
+    index = _index_changed()
+    if index is None:
+        return
+    if sender is Book:
+        index.remove_book(instance.pk)
+    else:
+        index.remove_keyword(instance.pk)
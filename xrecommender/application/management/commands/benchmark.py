@@ -0,0 +1,295 @@
+import io
+import json
+import os
+import statistics
+import time
+from contextlib import redirect_stdout
+from typing import Callable, Dict, List, Optional
+
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from application.models import User, Book, Rating, LIKES
+from application.recommend import (
+    k_nearest, top_k_books, recommend_books, recommend_books_many
+)
+from application.synthetic import synthetic_database
+from application.xai import (
+    xai_explanation_dict,
+    sort_rec_books_by_keyword_count,
+    pyvis_graph_html
+)
+from .synthesize import add_dataset_arguments, dataset_options
+
+NEAREST_USERS = 35
+REC_BOOKS = 5
+
+
+def measure(
+    fn: Callable[[], None],
+    repeat: int,
+    setup: Optional[Callable[[], None]] = None
+) -> List[float]:
+    """
+    Mide el tiempo de ejecución de una función varias veces.
+
+    ## Argumentos:
+    - `fn`: Función a medir.
+    - `repeat`: Número de repeticiones.
+    - `setup`: Función que prepara cada repetición, sin medir su tiempo.
+
+    ## Retorno:
+    - Tiempos de cada repetición en segundos.
+    """
+    times = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return times
+
+
+class Command(BaseCommand):
+    """
+    Clase para ejecutar los micro-benchmarks del recomendador sobre un
+    dataset sintético cargado en una base de datos SQLite temporal.
+    """
+    help = (
+        "Ejecuta los micro-benchmarks sobre un dataset sintético y los "
+        "compara con la línea base guardada."
+    )
+
+    def add_arguments(self, parser):
+        add_dataset_arguments(parser)
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument(
+            '--sample-users', type=int, default=10,
+            help="Usuarios sobre los que se mide cada función."
+        )
+        parser.add_argument(
+            '--baseline',
+            default=getattr(settings, 'BENCHMARK_BASELINE', None) or
+            os.path.join(settings.BASE_DIR, 'benchmarks', 'baseline.json'),
+            help="Fichero JSON con la línea base."
+        )
+        parser.add_argument(
+            '--save-baseline', action='store_true',
+            help="Guarda los resultados como nueva línea base."
+        )
+        parser.add_argument(
+            '--check', action='store_true',
+            help="Falla si no hay línea base con la que comparar."
+        )
+        parser.add_argument(
+            '--tolerance', type=float, default=0.25,
+            help="Empeoramiento relativo permitido respecto a la línea base."
+        )
+
+    def handle(self, *args, **kwargs):
+        """
+        Esta función se ejecuta cuando se llama al comando desde la terminal.
+        """
+        if connection.vendor != 'sqlite':
+            raise CommandError(
+                "Los benchmarks deben ejecutarse sobre SQLite "
+                "(--settings=xrecommender.settings_bench)."
+            )
+        options = dataset_options(kwargs)
+        print("Generando dataset sintético...")
+        with synthetic_database(populate=False, **options) as paths:
+            results = self.run_benchmarks(
+                paths, kwargs['repeat'], kwargs['sample_users']
+            )
+
+        self.report(results)
+        if kwargs['save_baseline']:
+            self.save_baseline(kwargs['baseline'], options, results)
+            return
+        self.check_baseline(
+            kwargs['baseline'], options, results, kwargs['tolerance'],
+            kwargs['check']
+        )
+
+    def run_benchmarks(
+        self, paths: Dict[str, str], repeat: int, sample_users: int
+    ) -> Dict[str, Dict[str, float]]:
+        """
+        Ejecuta todos los benchmarks.
+
+        ## Argumentos:
+        - `paths`: Rutas del dataset sintético.
+        - `repeat`: Número de repeticiones de cada benchmark.
+        - `sample_users`: Número de usuarios de la muestra.
+
+        ## Retorno:
+        - Diccionario con el tiempo mediano y mínimo por llamada de cada
+        benchmark.
+        """
+        results: Dict[str, Dict[str, float]] = dict()
+
+        def record(
+            name: str,
+            fn: Callable[[], None],
+            calls: int,
+            n: int = repeat,
+            setup: Optional[Callable[[], None]] = None
+        ) -> None:
+            print(f"Midiendo {name}...")
+            with redirect_stdout(io.StringIO()):
+                times = [t / calls for t in measure(fn, n, setup)]
+            results[name] = {
+                'median': statistics.median(times),
+                'min': min(times),
+            }
+
+        # Carga completa de la base de datos (sólo una vez, la limpia)
+        record('populate', lambda: call_command('populate', **paths), 1, 1)
+
+        # Muestra de usuarios con valoraciones positivas
+        users = list(
+            User.objects.filter(rating__rating__gte=LIKES)
+            .distinct().order_by('id')[:sample_users]
+        )
+        if not users:
+            raise CommandError("El dataset no tiene valoraciones positivas.")
+        calls = len(users)
+        nearest = {u.id: k_nearest(u, NEAREST_USERS) for u in users}
+        recs = {
+            u.id: [b for b, _ in top_k_books(u, nearest[u.id], REC_BOOKS)]
+            for u in users
+        }
+        explain = {
+            u.id: xai_explanation_dict(u, recs[u.id]) for u in users
+        }
+        unrated = {
+            u.id: Book.objects.exclude(rating__user=u).order_by('id').first()
+            for u in users
+        }
+
+        record('k_nearest', lambda: [
+            k_nearest(u, NEAREST_USERS) for u in users
+        ], calls)
+        record('top_k_books', lambda: [
+            top_k_books(u, nearest[u.id], REC_BOOKS) for u in users
+        ], calls)
+        record('recommend_books', lambda: [
+            recommend_books(u, NEAREST_USERS, REC_BOOKS) for u in users
+        ], calls)
+        record('recommend_books_many', lambda: recommend_books_many(
+            users, NEAREST_USERS, REC_BOOKS
+        ), calls)
+        record('xai_explanation_dict', lambda: [
+            xai_explanation_dict(u, recs[u.id]) for u in users
+        ], calls)
+        record('sort_rec_books_by_keyword_count', lambda: [
+            sort_rec_books_by_keyword_count(explain[u.id], recs[u.id])
+            for u in users
+        ], calls)
+        record('pyvis_graph_html', lambda: [
+            pyvis_graph_html(u, recs[u.id], explain[u.id]) for u in users
+        ], calls)
+
+        # Señales de valoraciones: alta, modificación y borrado
+        def rate(value: float) -> None:
+            for u in users:
+                rating = Rating.objects.filter(
+                    user=u, book=unrated[u.id]
+                ).first() or Rating(user=u, book=unrated[u.id])
+                rating.rating = value
+                rating.save()
+
+        def unrate() -> None:
+            for u in users:
+                Rating.objects.filter(user=u, book=unrated[u.id]).delete()
+
+        record('rating_create', lambda: rate(1.0), calls, setup=unrate)
+        record(
+            'rating_update', lambda: rate(0.75), calls,
+            setup=lambda: rate(1.0)
+        )
+        record('rating_delete', unrate, calls, setup=lambda: rate(1.0))
+        return results
+
+    def report(self, results: Dict[str, Dict[str, float]]) -> None:
+        """
+        Muestra los resultados por pantalla.
+
+        ## Argumentos:
+        - `results`: Resultados de los benchmarks.
+        """
+        print(f"{'benchmark':<34}{'mediana (ms)':>14}{'mínimo (ms)':>14}")
+        for name, res in results.items():
+            print(
+                f"{name:<34}{1000 * res['median']:>14.3f}"
+                f"{1000 * res['min']:>14.3f}"
+            )
+
+    def save_baseline(
+        self, path: str, options: Dict, results: Dict[str, Dict[str, float]]
+    ) -> None:
+        """
+        Guarda los resultados como línea base.
+
+        ## Argumentos:
+        - `path`: Ruta del fichero de línea base.
+        - `options`: Configuración del dataset sintético.
+        - `results`: Resultados de los benchmarks.
+        """
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+            json.dump({'dataset': options, 'results': results}, f, indent=2)
+        print(f"Línea base guardada en {path}")
+
+    def check_baseline(
+        self,
+        path: str,
+        options: Dict,
+        results: Dict[str, Dict[str, float]],
+        tolerance: float,
+        check: bool = False
+    ) -> None:
+        """
+        Compara los resultados con la línea base y falla si alguno de los
+        benchmarks ha empeorado más de lo permitido o, con `check`, si no
+        hay línea base.
+
+        ## Argumentos:
+        - `path`: Ruta del fichero de línea base.
+        - `options`: Configuración del dataset sintético.
+        - `results`: Resultados de los benchmarks.
+        - `tolerance`: Empeoramiento relativo permitido.
+        - `check`: Indica si la falta de línea base es un error.
+        """
+        if not os.path.exists(path):
+            if check:
+                raise CommandError(
+                    f"No existe la línea base {path}; usa --save-baseline "
+                    "para guardarla."
+                )
+            print("No hay línea base; usa --save-baseline para guardarla.")
+            return
+        with open(path) as f:
+            baseline = json.load(f)
+        if baseline['dataset'] != options:
+            raise CommandError(
+                "La línea base se generó con otro dataset sintético: "
+                f"{baseline['dataset']}"
+            )
+        regressions = []
+        for name, res in results.items():
+            base = baseline['results'].get(name)
+            if base is None:
+                continue
+            ratio = res['median'] / base['median']
+            if ratio > 1 + tolerance:
+                regressions.append(f"{name} ({ratio:.2f}x)")
+        if regressions:
+            raise CommandError(
+                "Regresiones respecto a la línea base: " +
+                ", ".join(regressions)
+            )
+        print("Sin regresiones respecto a la línea base.")
@@ -0,0 +1,27 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from application.autocomplete import build_index
+
+
+class Command(BaseCommand):
+    """Clase para generar el snapshot del índice de autocompletado."""
+    help = "Genera el snapshot del índice de autocompletado."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--output', default=settings.XBRECS_AUTOCOMPLETE_SNAPSHOT,
+            help="Ruta del fichero de snapshot."
+        )
+
+    def handle(self, *args, **kwargs):
+        """
+        Esta función se ejecuta cuando se llama al comando desde la terminal.
+        """
+        if not kwargs['output']:
+            raise CommandError("No se ha indicado la ruta del snapshot.")
+        print("Construyendo índice de autocompletado...")
+        index = build_index()
+        index.save(kwargs['output'])
+        print(f"Índice con {len(index)} elementos guardado en "
+              f"{kwargs['output']}")
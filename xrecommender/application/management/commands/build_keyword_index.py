@@ -0,0 +1,30 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from application.keyword_index import build_index
+
+
+class Command(BaseCommand):
+    """
+    Clase para generar el snapshot del índice invertido de palabras clave
+    y libros.
+    """
+    help = "Genera el snapshot del índice invertido de palabras clave."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--output', default=settings.XBRECS_KEYWORD_INDEX_SNAPSHOT,
+            help="Ruta del fichero de snapshot."
+        )
+
+    def handle(self, *args, **kwargs):
+        """
+        Esta función se ejecuta cuando se llama al comando desde la terminal.
+        """
+        if not kwargs['output']:
+            raise CommandError("No se ha indicado la ruta del snapshot.")
+        print("Construyendo índice de palabras clave...")
+        index = build_index()
+        index.save(kwargs['output'])
+        print(f"Índice con {len(index)} palabras clave guardado en "
+              f"{kwargs['output']}")
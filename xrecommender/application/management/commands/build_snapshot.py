@@ -0,0 +1,98 @@
+import os
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from application import refresh
+from application.neighbors import QUANTIZATIONS
+from application.snapshot import (
+    DEFAULT_NEIGHBORS, DEFAULT_KEEP, GENERATIONS,
+    write_snapshot, activate_generation, current_generation
+)
+
+
+class Command(BaseCommand):
+    """
+    Clase para generar una nueva generación del snapshot del modelo
+    (embeddings, valoraciones y vecinos precalculados) o activar una
+    generación existente.
+    """
+    help = (
+        "Genera el snapshot del modelo que los procesos del servidor abren "
+        "con mmap y lo activa de forma atómica."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--output', default=getattr(settings, 'XBRECS_SNAPSHOT_DIR', None),
+            help="Carpeta de snapshots (por defecto XBRECS_SNAPSHOT_DIR)."
+        )
+        parser.add_argument(
+            '--neighbors', type=int, default=DEFAULT_NEIGHBORS,
+            help="Vecinos por usuario de la tabla precalculada."
+        )
+        parser.add_argument(
+            '--keep', type=int, default=DEFAULT_KEEP,
+            help="Generaciones que se conservan."
+        )
+        parser.add_argument(
+            '--quantize', choices=QUANTIZATIONS,
+            help="Guarda también la matriz de usuarios cuantizada para la "
+                 "búsqueda aproximada de vecinos."
+        )
+        parser.add_argument(
+            '--pca-dim', type=int,
+            help="Dimensión de la proyección PCA para la búsqueda de "
+                 "candidatos en el espacio reducido."
+        )
+        parser.add_argument(
+            '--no-activate', action='store_true',
+            help="Genera el snapshot sin activarlo."
+        )
+        parser.add_argument(
+            '--activate', metavar='GENERATION',
+            help="Activa una generación existente sin generar otra."
+        )
+
+    def handle(self, *args, **kwargs):
+        """
+        Esta función se ejecuta cuando se llama al comando desde la terminal.
+        """
+        root = kwargs['output']
+        if not root:
+            raise CommandError(
+                "No hay carpeta de snapshots: usa --output o "
+                "XBRECS_SNAPSHOT_DIR."
+            )
+
+        if kwargs['activate']:
+            try:
+                activate_generation(root, kwargs['activate'])
+            except ValueError as e:
+                raise CommandError(str(e))
+            print(f"Generación activa: {kwargs['activate']}")
+            self.mark_stored_recommendations()
+            return
+
+        os.makedirs(os.path.join(root, GENERATIONS), exist_ok=True)
+        start = time.perf_counter()
+        print("Generando snapshot...")
+        path = write_snapshot(
+            root, kwargs['neighbors'], kwargs['keep'],
+            not kwargs['no_activate'], kwargs['quantize'], kwargs['pca_dim']
+        )
+        print(f"Snapshot generado en {path} "
+              f"({time.perf_counter() - start:.1f} s)")
+        print(f"Generación activa: {current_generation(root)}")
+        if not kwargs['no_activate']:
+            self.mark_stored_recommendations()
+
+    def mark_stored_recommendations(self):
+        """
+        Marca todos los usuarios como pendientes de recalcular sus
+        recomendaciones guardadas, si están activadas.
+        """
+        if refresh.is_enabled():
+            print(f"{refresh.mark_all_dirty()} usuarios pendientes de "
+                  f"recalcular sus recomendaciones")
@@ -0,0 +1,213 @@
+import time
+import numpy as np
+from typing import Callable, List, Tuple
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from application.neighbors import (
+    EXACT, QUANTIZED, PCA, USERS, BOOKS, search, recall, fit_pca, project
+)
+from application.snapshot import open_generation
+
+NEAREST_USERS = 35
+
+
+class ProjectedSnapshot:
+    """
+    Vista de un snapshot con una proyección PCA ajustada al vuelo, para
+    comparar dimensiones sin generar un snapshot por cada una.
+    """
+
+    def __init__(self, snapshot, dim: int) -> None:
+        self.snapshot = snapshot
+        self.pca_mean, self.pca_components, self.explained = fit_pca(
+            snapshot.books, dim
+        )
+        self.users_pca = project(
+            snapshot.users, self.pca_mean, self.pca_components
+        )
+        self.books_pca = project(
+            snapshot.books, self.pca_mean, self.pca_components
+        )
+
+    def __getattr__(self, name):
+        return getattr(self.snapshot, name)
+
+
+class Command(BaseCommand):
+    """
+    Clase para comparar la búsqueda aproximada de vecinos con la exacta
+    sobre una muestra de usuarios del snapshot activo: recall, latencia
+    por consulta y memoria de la matriz que se recorre.
+    """
+    help = (
+        "Compara el recall y la latencia de la búsqueda aproximada de "
+        "vecinos con la búsqueda exacta."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--snapshot', default=getattr(settings, 'XBRECS_SNAPSHOT_DIR',
+                                          None),
+            help="Carpeta de snapshots (por defecto XBRECS_SNAPSHOT_DIR)."
+        )
+        parser.add_argument('--k', type=int, default=NEAREST_USERS)
+        parser.add_argument(
+            '--candidates', type=int, nargs='+', default=[100, 300, 1000],
+            help="Candidatos que se reordenan con la similitud exacta."
+        )
+        parser.add_argument(
+            '--pca-dims', type=int, nargs='*', default=[],
+            help="Dimensiones PCA que se ajustan al vuelo para compararlas "
+                 "(además de la del snapshot, si la tiene y --kind es "
+                 "users)."
+        )
+        parser.add_argument(
+            '--kind', choices=[USERS, BOOKS], default=USERS,
+            help="Búsqueda usuario-usuario o usuario-libro."
+        )
+        parser.add_argument('--sample', type=int, default=200)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument(
+            '--min-recall', type=float,
+            help="Falla si algún recall queda por debajo de este valor."
+        )
+
+    def handle(self, *args, **kwargs):
+        """
+        Esta función se ejecuta cuando se llama al comando desde la terminal.
+        """
+        snapshot = open_generation(kwargs['snapshot']) \
+            if kwargs['snapshot'] else None
+        if snapshot is None:
+            raise CommandError("No hay ningún snapshot activo.")
+
+        rng = np.random.default_rng(kwargs['seed'])
+        rows = np.sort(rng.choice(
+            len(snapshot.user_ids), min(kwargs['sample'],
+                                        len(snapshot.user_ids)),
+            replace=False
+        ))
+        vectors = np.asarray(snapshot.users[rows])
+        k = kwargs['k']
+        kind = kwargs['kind']
+        # En la búsqueda usuario-libro no hay ninguna fila que excluir
+        excluded = rows if kind == USERS else np.full(len(rows), -1)
+
+        exact, exact_ms = self.timed_search(
+            lambda v, r: search(snapshot, v, k, r, EXACT, kind=kind),
+            vectors, excluded
+        )
+        results: List[Tuple[str, float, float, int]] = [
+            (EXACT, 1.0, exact_ms, getattr(snapshot, kind).nbytes)
+        ]
+        for variant, fn, nbytes in self.variants(snapshot, k, kwargs):
+            found, ms = self.timed_search(fn, vectors, excluded)
+            results.append((variant, recall(exact, found), ms, nbytes))
+
+        self.report(results, len(rows), k)
+        if kwargs['min_recall'] is not None:
+            low = [r[0] for r in results if r[1] < kwargs['min_recall']]
+            if low:
+                raise CommandError(
+                    "Recall por debajo del mínimo: " + ", ".join(low)
+                )
+
+    def variants(
+        self, snapshot, k: int, kwargs
+    ) -> List[Tuple[str, Callable, int]]:
+        """
+        Obtiene las búsquedas aproximadas disponibles: la cuantizada y la
+        PCA del snapshot (si las tiene) y las PCA ajustadas al vuelo.
+
+        ## Argumentos:
+        - `snapshot`: Snapshot del modelo.
+        - `k`: Número de vecinos.
+        - `kwargs`: Argumentos del comando.
+
+        ## Retorno:
+        - Lista de tuplas (nombre, función de búsqueda, bytes de la matriz
+        recorrida).
+        """
+        kind = kwargs['kind']
+        sources = []
+        if kind == USERS and snapshot.users_q is not None:
+            sources.append((
+                f"{QUANTIZED}-{snapshot.users_q.dtype.name}", snapshot,
+                QUANTIZED,
+                snapshot.users_q.nbytes + snapshot.users_scale.nbytes
+            ))
+        # El snapshot sólo guarda la proyección de los usuarios
+        if kind == USERS and snapshot.users_pca is not None:
+            sources.append((
+                f"{PCA}-{snapshot.pca_components.shape[0]}", snapshot, PCA,
+                snapshot.users_pca.nbytes
+            ))
+        for dim in kwargs['pca_dims']:
+            projected = ProjectedSnapshot(snapshot, dim)
+            print(f"PCA {dim}: varianza explicada "
+                  f"{projected.explained:.3f}")
+            sources.append((
+                f"{PCA}-{dim} (al vuelo)", projected, PCA,
+                getattr(projected, f"{kind}_pca").nbytes
+            ))
+        if not sources:
+            print("El snapshot no tiene matrices para la búsqueda "
+                  "aproximada (build_snapshot --quantize/--pca-dim).")
+
+        variants = []
+        for name, source, mode, nbytes in sources:
+            for candidates in kwargs['candidates']:
+                variants.append((
+                    f"{name}@{candidates}",
+                    lambda v, r, s=source, m=mode, c=candidates: search(
+                        s, v, k, r, m, c, kind
+                    ),
+                    nbytes
+                ))
+        return variants
+
+    def timed_search(
+        self, fn: Callable, vectors: np.ndarray, rows: np.ndarray
+    ) -> Tuple[np.ndarray, float]:
+        """
+        Ejecuta una búsqueda usuario a usuario, como en las peticiones.
+
+        ## Argumentos:
+        - `fn`: Función de búsqueda `fn(vectores, filas excluidas)`.
+        - `vectors`: Vectores de la muestra.
+        - `rows`: Filas de la muestra en el snapshot.
+
+        ## Retorno:
+        - Tupla (vecinos de cada usuario, latencia media en ms).
+        """
+        found = []
+        start = time.perf_counter()
+        for i in range(len(rows)):
+            neighbors, _ = fn(vectors[i:i + 1], rows[i:i + 1])
+            found.append(neighbors[0])
+        elapsed = time.perf_counter() - start
+        width = max((len(f) for f in found), default=0)
+        matrix = np.full((len(found), width), -1, dtype=np.int64)
+        for i, f in enumerate(found):
+            matrix[i, :len(f)] = f
+        return matrix, 1000 * elapsed / max(len(rows), 1)
+
+    def report(
+        self, results: List[Tuple[str, float, float, int]], n: int, k: int
+    ) -> None:
+        """
+        Muestra los resultados por pantalla.
+
+        ## Argumentos:
+        - `results`: Tuplas (búsqueda, recall, ms por consulta, bytes).
+        - `n`: Usuarios de la muestra.
+        - `k`: Número de vecinos.
+        """
+        print(f"{n} usuarios, k={k}")
+        print(f"{'búsqueda':<32}{'recall':>10}{'ms/consulta':>14}"
+              f"{'memoria (MB)':>14}")
+        for name, value, ms, nbytes in results:
+            print(f"{name:<32}{value:>10.4f}{ms:>14.3f}"
+                  f"{nbytes / 2 ** 20:>14.2f}")
@@ -0,0 +1,89 @@
+import io
+from contextlib import redirect_stdout
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client, override_settings
+from django.urls import reverse
+
+from application.models import User, Book, Keyword, LIKES
+from application.query_budget import QueryBudgetExceeded, RAISE
+from application.synthetic import synthetic_database
+from .synthesize import add_dataset_arguments, dataset_options
+
+XHR = {'HTTP_X_REQUESTED_WITH': 'XMLHttpRequest'}
+
+
+class Command(BaseCommand):
+    """
+    Clase para comprobar el presupuesto de consultas de las vistas sobre
+    un dataset sintético.
+    """
+    help = (
+        "Comprueba que las vistas no superan su presupuesto de consultas "
+        "sobre un dataset sintético."
+    )
+
+    def add_arguments(self, parser):
+        add_dataset_arguments(parser)
+
+    def handle(self, *args, **kwargs):
+        """
+        Esta función se ejecuta cuando se llama al comando desde la terminal.
+        """
+        if connection.vendor != 'sqlite':
+            raise CommandError(
+                "La comprobación debe ejecutarse sobre SQLite "
+                "(--settings=xrecommender.settings_bench)."
+            )
+        print("Generando dataset sintético...")
+        with synthetic_database(**dataset_options(kwargs)):
+            failures = self.check_views()
+        if failures:
+            raise CommandError(
+                "Presupuestos de consultas superados:\n\n" +
+                "\n\n".join(failures)
+            )
+        print("Todas las vistas cumplen su presupuesto de consultas.")
+
+    def check_views(self):
+        """
+        Hace una petición a cada vista con presupuesto y comprueba que
+        no lo supera.
+
+        ## Retorno:
+        - Lista de informes de las vistas que superan su presupuesto.
+        """
+        user = User.objects.filter(
+            rating__rating__gte=LIKES
+        ).order_by('id').first()
+        book = Book.objects.exclude(rating__user=user).order_by('id').first()
+        keyword = Keyword.objects.order_by('id').first()
+        requests = [
+            ('get', reverse('recommend', args=[5]), {}, {}),
+            ('get', reverse('profile'), {}, {}),
+            ('get', reverse('book-detail', args=[book.id]), {}, {}),
+            ('get', reverse('discover'), {}, {}),
+            ('get', reverse('search'), {'q': keyword.word}, {}),
+            ('post', reverse('book-rate', args=[book.id]),
+             {'rating': 5}, XHR),
+            ('post', reverse('book-rate', args=[book.id]),
+             {'rating': 2}, XHR),
+        ]
+        failures = []
+        with override_settings(XBRECS_QUERY_BUDGET=RAISE):
+            client = Client()
+            client.force_login(user)
+            for method, url, data, extra in requests:
+                try:
+                    with redirect_stdout(io.StringIO()):
+                        response = getattr(client, method)(
+                            url, data, **extra
+                        )
+                    print(f"{url}: {response.status_code}, "
+                          f"{response.wsgi_request.query_counter.count} "
+                          "consultas")
+                except QueryBudgetExceeded as e:
+                    print(f"{url}: presupuesto superado")
+                    failures.append(str(e))
+        return failures
@@ -0,0 +1,172 @@
+import os
+import time
+from typing import Dict, List
+
+from django.core.management.base import BaseCommand, CommandError
+
+from application.evaluation import (
+    METRICS, CUTOFFS, RELEVANT_THRESHOLD,
+    Evaluator, read_tsv, result_tag, write_results, compare_results
+)
+
+training_path = os.path.join(os.getcwd(), "..", "datasets", "training")
+# Los resultados de Elliot de `elliot/results/knn/user-user` son la
+# referencia de `--compare`: los propios se escriben en otra carpeta
+results_path = os.path.join(
+    os.getcwd(), "..", "elliot", "results", "xbrecs", "user-user"
+)
+
+
+def add_evaluation_arguments(parser) -> None:
+    """
+    Añade los argumentos de la evaluación offline.
+
+    ## Argumentos:
+    - `parser`: Parser de argumentos del comando.
+    """
+    parser.add_argument(
+        '--train',
+        default=os.path.join(training_path, "train_valid_reduced.tsv"),
+        help="Conjunto de entrenamiento (popularidad y catálogo)."
+    )
+    parser.add_argument(
+        '--test', default=os.path.join(training_path, "test_reduced.tsv"),
+        help="Conjunto de test."
+    )
+    parser.add_argument('--cutoffs', type=int, nargs='+', default=CUTOFFS)
+    parser.add_argument(
+        '--threshold', type=float, default=RELEVANT_THRESHOLD,
+        help="Valoración mínima de un libro relevante."
+    )
+    parser.add_argument(
+        '--results', default=results_path,
+        help="Carpeta donde se escriben los resultados."
+    )
+
+
+def load_evaluator(kwargs) -> Evaluator:
+    """
+    Crea el evaluador a partir de los argumentos del comando.
+
+    ## Argumentos:
+    - `kwargs`: Argumentos del comando.
+
+    ## Retorno:
+    - Evaluador.
+    """
+    for path in [kwargs['train'], kwargs['test']]:
+        if not os.path.exists(path):
+            raise CommandError(f"No existe el fichero {path}")
+    return Evaluator(
+        read_tsv(kwargs['train']), read_tsv(kwargs['test']),
+        kwargs['threshold']
+    )
+
+
+def report(model: str, results: Dict[int, Dict[str, float]]) -> None:
+    """
+    Muestra los resultados por pantalla.
+
+    ## Argumentos:
+    - `model`: Nombre del modelo.
+    - `results`: Resultados por corte.
+    """
+    print(model)
+    print(f"{'cutoff':<8}" + ''.join(f"{m:>13}" for m in METRICS))
+    for cutoff, metrics in results.items():
+        print(f"{cutoff:<8}" + ''.join(f"{metrics[m]:>13.5f}"
+                                       for m in METRICS))
+
+
+class Command(BaseCommand):
+    """
+    Clase para evaluar ficheros de predicciones con las métricas de
+    `elliot/experiment_config.yml` sin ejecutar Elliot.
+    """
+    help = (
+        "Evalúa ficheros de predicciones con las métricas de Elliot y "
+        "escribe los resultados con su mismo formato."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'predictions', nargs='+', help="Ficheros de predicciones."
+        )
+        add_evaluation_arguments(parser)
+        parser.add_argument(
+            '--workers', type=int, default=os.cpu_count() or 1,
+            help="Número de procesos."
+        )
+        parser.add_argument(
+            '--compare',
+            help="Carpeta con los resultados de Elliot con los que comparar "
+                 "(ficheros con el mismo nombre)."
+        )
+        parser.add_argument(
+            '--tolerance', type=float, default=1e-6,
+            help="Diferencia relativa permitida al comparar."
+        )
+
+    def handle(self, *args, **kwargs):
+        """
+        Esta función se ejecuta cuando se llama al comando desde la terminal.
+        """
+        start = time.perf_counter()
+        evaluator = load_evaluator(kwargs)
+        print(f"Evaluador listo ({time.perf_counter() - start:.1f} s)")
+
+        mismatches: List[str] = []
+        for path in kwargs['predictions']:
+            start = time.perf_counter()
+            results = evaluator.evaluate(
+                read_tsv(path, 'prediction'), kwargs['cutoffs'],
+                kwargs['workers']
+            )
+            model, tag = result_tag(path)
+            report(model, results)
+            print(f"({time.perf_counter() - start:.1f} s)")
+            if kwargs['compare']:
+                mismatches += self.compare(
+                    results, kwargs['compare'], tag, kwargs['tolerance']
+                )
+            else:
+                write_results(kwargs['results'], path, results)
+
+        if mismatches:
+            raise CommandError(
+                "Diferencias con Elliot: " + ", ".join(mismatches)
+            )
+
+    def compare(
+        self,
+        results: Dict[int, Dict[str, float]],
+        folder: str,
+        tag: str,
+        tolerance: float
+    ) -> List[str]:
+        """
+        Compara los resultados con los de Elliot.
+
+        ## Argumentos:
+        - `results`: Resultados por corte.
+        - `folder`: Carpeta con los resultados de Elliot.
+        - `tag`: Sufijo de los ficheros de resultados.
+        - `tolerance`: Diferencia relativa permitida.
+
+        ## Retorno:
+        - Métricas que superan la tolerancia.
+        """
+        mismatches = []
+        for cutoff, metrics in results.items():
+            reference = os.path.join(folder, f"cutoff_{cutoff}_{tag}.tsv")
+            if not os.path.exists(reference):
+                print(f"No existe {reference}")
+                continue
+            for metric, (expected, diff) in compare_results(
+                metrics, reference
+            ).items():
+                if diff > tolerance:
+                    mismatches.append(f"{metric}@{cutoff} ({tag})")
+                    print(f"  {metric}@{cutoff}: {metrics[metric]:.6f} "
+                          f"(Elliot {expected:.6f}, {100 * diff:.4f} %)")
+        return mismatches
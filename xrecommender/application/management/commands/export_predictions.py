@@ -0,0 +1,75 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from application.predictions import (
+    ENGINES, CF, DEFAULT_TOP, DEFAULT_BATCH_SIZE,
+    PredictionData, export_predictions, prediction_filename
+)
+
+# Carpeta de predicciones que lee la configuración de Elliot
+predictions_path = os.path.join(
+    os.getcwd(), "..", "datasets", "training", "predictions"
+)
+
+
+class Command(BaseCommand):
+    """
+    Clase para generar los ficheros de predicciones que evalúa Elliot
+    (`ProxyRecommender`) a partir de los datos cargados en la base de datos.
+    """
+    help = (
+        "Genera las predicciones top-N de todos los usuarios en el formato "
+        "TSV del ProxyRecommender de Elliot."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--engine', choices=sorted(ENGINES), default=CF,
+            help="Motor: cf (usuario-usuario), cb (usuario-libro) o "
+                 "ii (libro-libro)."
+        )
+        parser.add_argument(
+            '--neighbors', type=int, nargs='+', default=[35],
+            help="Número de vecinos del motor usuario-usuario (se genera un "
+                 "fichero por valor)."
+        )
+        parser.add_argument('--top', type=int, default=DEFAULT_TOP)
+        parser.add_argument(
+            '--workers', type=int, default=os.cpu_count() or 1,
+            help="Número de procesos."
+        )
+        parser.add_argument('--batch-size', type=int,
+                            default=DEFAULT_BATCH_SIZE)
+        parser.add_argument(
+            '--output', default=predictions_path,
+            help="Carpeta de salida."
+        )
+
+    def handle(self, *args, **kwargs):
+        """
+        Esta función se ejecuta cuando se llama al comando desde la terminal.
+        """
+        output = kwargs['output']
+        os.makedirs(output, exist_ok=True)
+
+        start = time.perf_counter()
+        print("Cargando matrices de la base de datos...")
+        data = PredictionData.from_database()
+        if not len(data.user_ids) or not len(data.book_ids):
+            raise CommandError("La base de datos no tiene valoraciones.")
+        print(f"{len(data.user_ids)} usuarios y {len(data.book_ids)} libros "
+              f"({time.perf_counter() - start:.1f} s)")
+
+        engine = kwargs['engine']
+        neighbors_list = kwargs['neighbors'] if engine == CF else [0]
+        for neighbors in neighbors_list:
+            path = os.path.join(output, prediction_filename(engine, neighbors))
+            start = time.perf_counter()
+            lines = export_predictions(
+                path, engine, neighbors, kwargs['top'], kwargs['workers'],
+                kwargs['batch_size'], data
+            )
+            print(f"{path}: {lines} predicciones "
+                  f"({time.perf_counter() - start:.1f} s)")
@@ -0,0 +1,418 @@
+import io
+import json
+import os
+import random
+import socket
+import tempfile
+import threading
+import time
+import numpy as np
+from collections import defaultdict
+from contextlib import redirect_stdout
+from http.cookiejar import CookieJar
+from typing import Dict, List, Optional, Tuple
+from urllib.error import HTTPError, URLError
+from urllib.parse import urlencode
+from urllib.request import HTTPCookieProcessor, Request, build_opener
+
+from django.conf import settings
+from django.core.asgi import get_asgi_application
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.core.servers.basehttp import ThreadedWSGIServer, WSGIRequestHandler
+from django.core.wsgi import get_wsgi_application
+from django.db import connection
+
+from application.models import User, Book, Keyword
+from application.synthetic import generate_dataset
+from .synthesize import add_dataset_arguments, dataset_options
+
+PASSWORD = "3BP_san-ti_{}"  # Contraseña de los usuarios creados por populate
+PERCENTILES = [50, 95, 99]
+WSGI = 'wsgi'
+ASGI = 'asgi'
+STARTUP_TIMEOUT = 10.0  # Segundos de espera al arranque del servidor ASGI
+
+# Peso de cada acción dentro de una sesión
+ACTIONS = {
+    'recommend': 2,
+    'rate': 3,
+    'search': 2,
+    'profile': 1,
+    'book-detail': 2,
+}
+
+
+class QuietHandler(WSGIRequestHandler):
+    """Manejador de peticiones que no escribe cada petición por pantalla."""
+
+    def log_message(self, format, *args):
+        pass
+
+
+class Stats:
+    """Latencias y errores por endpoint, compartidos entre sesiones."""
+
+    def __init__(self) -> None:
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def record(self, name: str, latency: float, ok: bool) -> None:
+        """
+        Registra una petición.
+
+        ## Argumentos:
+        - `name`: Nombre del endpoint.
+        - `latency`: Latencia en segundos.
+        - `ok`: Indica si la petición tuvo éxito.
+        """
+        with self._lock:
+            self.latencies[name].append(latency)
+            if not ok:
+                self.errors[name] += 1
+
+    def summary(self, elapsed: float) -> Dict[str, Dict[str, float]]:
+        """
+        Resume las medidas por endpoint.
+
+        ## Argumentos:
+        - `elapsed`: Duración de la prueba en segundos.
+
+        ## Retorno:
+        - Diccionario endpoint -> peticiones, errores, rendimiento
+        (peticiones/s) y percentiles de latencia (ms).
+        """
+        summary = dict()
+        names = sorted(self.latencies)
+        all_latencies = [t for n in names for t in self.latencies[n]]
+        for name, latencies in [(n, self.latencies[n]) for n in names] + \
+                [('total', all_latencies)]:
+            if not latencies:
+                continue
+            ms = 1000 * np.array(latencies)
+            errors = sum(self.errors.values()) if name == 'total' \
+                else self.errors[name]
+            summary[name] = {
+                'requests': len(latencies),
+                'errors': errors,
+                'throughput': len(latencies) / elapsed,
+                **{
+                    f'p{p}': float(v) for p, v in
+                    zip(PERCENTILES, np.percentile(ms, PERCENTILES))
+                },
+            }
+        return summary
+
+
+class Session:
+    """Sesión de un usuario simulado con sus propias cookies."""
+
+    def __init__(self, base_url: str, stats: Stats, timeout: float) -> None:
+        self.base_url = base_url.rstrip('/')
+        self.stats = stats
+        self.timeout = timeout
+        self.cookies = CookieJar()
+        self.opener = build_opener(HTTPCookieProcessor(self.cookies))
+
+    def csrf_token(self) -> str:
+        """
+        Obtiene el token CSRF de las cookies de la sesión.
+
+        ## Retorno:
+        - Token CSRF.
+        """
+        for cookie in self.cookies:
+            if cookie.name == 'csrftoken':
+                return cookie.value
+        return ''
+
+    def request(
+        self,
+        name: str,
+        path: str,
+        data: Optional[Dict] = None,
+        headers: Optional[Dict] = None
+    ) -> bool:
+        """
+        Hace una petición y registra su latencia.
+
+        ## Argumentos:
+        - `name`: Nombre del endpoint en las estadísticas.
+        - `path`: Ruta de la petición.
+        - `data`: Datos del formulario (si se indican, la petición es POST).
+        - `headers`: Cabeceras adicionales.
+
+        ## Retorno:
+        - `True` si la petición tuvo éxito.
+        """
+        body = urlencode(data).encode() if data is not None else None
+        request = Request(
+            self.base_url + path, data=body, headers=headers or {}
+        )
+        start = time.perf_counter()
+        ok = True
+        try:
+            with self.opener.open(request, timeout=self.timeout) as response:
+                response.read()
+        except (HTTPError, URLError, socket.timeout, ConnectionError):
+            ok = False
+        self.stats.record(name, time.perf_counter() - start, ok)
+        return ok
+
+    def login(self, user_id: int) -> bool:
+        """
+        Inicia sesión con un usuario creado por `populate`.
+
+        ## Argumentos:
+        - `user_id`: ID del usuario.
+
+        ## Retorno:
+        - `True` si se ha iniciado sesión.
+        """
+        self.request('login-form', '/accounts/login/')
+        return self.request('login', '/accounts/login/', {
+            'username': f"usuario_{user_id}",
+            'password': PASSWORD.format(user_id),
+            'csrfmiddlewaretoken': self.csrf_token(),
+        }, {'Referer': self.base_url + '/accounts/login/'})
+
+
+class Command(BaseCommand):
+    """
+    Clase para hacer pruebas de carga en bucle cerrado: cada usuario
+    simulado lanza su siguiente petición en cuanto recibe la respuesta
+    (más un tiempo de reflexión opcional).
+    """
+    help = (
+        "Prueba de carga con sesiones de usuario simuladas y percentiles "
+        "de latencia por endpoint."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--url',
+            help="URL de un servidor ya arrancado (por ejemplo, gunicorn). "
+                 "Si no se indica, se arranca un servidor en este proceso."
+        )
+        parser.add_argument(
+            '--server', choices=[WSGI, ASGI], default=WSGI,
+            help="Servidor que se arranca en este proceso: WSGI con un hilo "
+                 "por conexión o ASGI (uvicorn) con las vistas asíncronas "
+                 "(XBRECS_ASYNC_VIEWS=1)."
+        )
+        parser.add_argument(
+            '--data', choices=['synthetic', 'existing'], default='synthetic',
+            help="Carga la base de datos con un dataset sintético antes de "
+                 "la prueba o usa los datos existentes (p. ej. de populate)."
+        )
+        add_dataset_arguments(parser)
+        parser.add_argument('--concurrency', type=int, default=8)
+        parser.add_argument(
+            '--duration', type=float, default=30.0,
+            help="Duración de la prueba en segundos."
+        )
+        parser.add_argument(
+            '--think-time', type=float, default=0.0,
+            help="Pausa media entre peticiones de una sesión (segundos)."
+        )
+        parser.add_argument('--rec-count', type=int, default=5)
+        parser.add_argument('--timeout', type=float, default=60.0)
+        parser.add_argument(
+            '--output', help="Fichero JSON donde guardar los resultados."
+        )
+
+    def handle(self, *args, **kwargs):
+        """
+        Esta función se ejecuta cuando se llama al comando desde la terminal.
+        """
+        if kwargs['data'] == 'synthetic':
+            if connection.vendor != 'sqlite':
+                raise CommandError(
+                    "El dataset sintético sólo se carga sobre SQLite "
+                    "(--settings=xrecommender.settings_bench)."
+                )
+            self.seed(kwargs)
+
+        user_ids = list(User.objects.filter(
+            username__startswith='usuario_'
+        ).values_list('id', flat=True))
+        book_ids = list(Book.objects.values_list('id', flat=True))
+        words = list(Keyword.objects.values_list('word', flat=True)[:500])
+        if not user_ids or not book_ids:
+            raise CommandError("La base de datos no tiene usuarios o libros.")
+        connection.close()
+
+        httpd = None
+        asgi_server = None
+        base_url = kwargs['url']
+        if base_url is None and kwargs['server'] == ASGI:
+            asgi_server, base_url = self.start_asgi_server()
+        elif base_url is None:
+            httpd = ThreadedWSGIServer(('127.0.0.1', 0), QuietHandler)
+            httpd.set_app(get_wsgi_application())
+            threading.Thread(target=httpd.serve_forever, daemon=True).start()
+            base_url = f"http://127.0.0.1:{httpd.server_address[1]}"
+        print(f"Prueba de carga contra {base_url} con "
+              f"{kwargs['concurrency']} sesiones durante "
+              f"{kwargs['duration']:.0f} s...")
+
+        stats = Stats()
+        deadline = time.monotonic() + kwargs['duration']
+        workers = [
+            threading.Thread(target=self.run_session, args=(
+                base_url, stats, deadline, i, user_ids, book_ids, words,
+                kwargs
+            ))
+            for i in range(kwargs['concurrency'])
+        ]
+        start = time.monotonic()
+        with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+        elapsed = time.monotonic() - start
+        if httpd is not None:
+            httpd.shutdown()
+        if asgi_server is not None:
+            asgi_server.should_exit = True
+
+        summary = stats.summary(elapsed)
+        self.report(summary)
+        if kwargs['output']:
+            with open(kwargs['output'], 'w') as f:
+                json.dump({
+                    'server': kwargs['server'] if kwargs['url'] is None
+                    else kwargs['url'],
+                    'concurrency': kwargs['concurrency'],
+                    'duration': elapsed,
+                    'endpoints': summary,
+                }, f, indent=2)
+
+    def start_asgi_server(self):
+        """
+        Arranca un servidor ASGI (uvicorn) en un hilo de este proceso.
+
+        ## Retorno:
+        - Tupla (servidor, URL base).
+        """
+        try:
+            import uvicorn
+        except ImportError:
+            raise CommandError(
+                "El servidor ASGI necesita uvicorn (pip install uvicorn)."
+            )
+        if not getattr(settings, 'XBRECS_ASYNC_VIEWS', False):
+            print("Aviso: XBRECS_ASYNC_VIEWS está desactivado, el servidor "
+                  "ASGI usará las vistas síncronas.")
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.bind(('127.0.0.1', 0))
+        server = uvicorn.Server(uvicorn.Config(
+            get_asgi_application(), lifespan='off', log_level='warning',
+            access_log=False
+        ))
+        threading.Thread(
+            target=server.run, kwargs={'sockets': [sock]}, daemon=True
+        ).start()
+        deadline = time.monotonic() + STARTUP_TIMEOUT
+        while not server.started:
+            if time.monotonic() > deadline:
+                raise CommandError("El servidor ASGI no ha arrancado.")
+            time.sleep(0.05)
+        return server, f"http://127.0.0.1:{sock.getsockname()[1]}"
+
+    def seed(self, kwargs) -> None:
+        """
+        Carga la base de datos con un dataset sintético.
+
+        ## Argumentos:
+        - `kwargs`: Argumentos del comando.
+        """
+        print("Cargando dataset sintético...")
+        with tempfile.TemporaryDirectory() as tmp_path:
+            paths = generate_dataset(tmp_path, **dataset_options(kwargs))
+            with redirect_stdout(io.StringIO()):
+                call_command('migrate', verbosity=0, run_syncdb=True)
+                call_command('populate', **paths)
+
+    def run_session(
+        self,
+        base_url: str,
+        stats: Stats,
+        deadline: float,
+        index: int,
+        user_ids: List[int],
+        book_ids: List[int],
+        words: List[str],
+        kwargs
+    ) -> None:
+        """
+        Ejecuta una sesión de usuario hasta que se acabe el tiempo:
+        inicia sesión y después elige acciones al azar según su peso.
+
+        ## Argumentos:
+        - `base_url`: URL del servidor.
+        - `stats`: Estadísticas compartidas.
+        - `deadline`: Instante (monotónico) en que termina la prueba.
+        - `index`: Número de la sesión (semilla de sus elecciones).
+        - `user_ids`: IDs de los usuarios disponibles.
+        - `book_ids`: IDs de los libros.
+        - `words`: Palabras clave para las búsquedas.
+        - `kwargs`: Argumentos del comando.
+        """
+        rng = random.Random(index)
+        session = Session(base_url, stats, kwargs['timeout'])
+        if not session.login(user_ids[index % len(user_ids)]):
+            return
+        actions, weights = zip(*ACTIONS.items())
+        xhr = {'X-Requested-With': 'XMLHttpRequest'}
+        while time.monotonic() < deadline:
+            action = rng.choices(actions, weights)[0]
+            if action == 'recommend':
+                session.request(
+                    action, f"/application/recommend/{kwargs['rec_count']}"
+                )
+            elif action == 'rate':
+                headers = {**xhr, 'X-CSRFToken': session.csrf_token()}
+                session.request(
+                    action,
+                    f"/application/book-rate/{rng.choice(book_ids)}/",
+                    {'rating': rng.randint(1, 5)},
+                    headers
+                )
+            elif action == 'search':
+                query = urlencode({'q': rng.choice(words) if words else 'a'})
+                session.request(action, f"/application/search/?{query}")
+            elif action == 'profile':
+                session.request(action, "/application/profile/")
+            else:
+                session.request(
+                    action,
+                    f"/application/book-detail/{rng.choice(book_ids)}/"
+                )
+            if kwargs['think_time']:
+                time.sleep(rng.expovariate(1 / kwargs['think_time']))
+
+    def report(self, summary: Dict[str, Dict[str, float]]) -> None:
+        """
+        Muestra los resultados por pantalla.
+
+        ## Argumentos:
+        - `summary`: Resumen por endpoint.
+        """
+        header: List[Tuple[str, int]] = [
+            ('endpoint', 14), ('peticiones', 11), ('errores', 9),
+            ('req/s', 9), ('p50 (ms)', 10), ('p95 (ms)', 10),
+            ('p99 (ms)', 10),
+        ]
+        print(''.join(
+            f"{h:<{w}}" if i == 0 else f"{h:>{w}}"
+            for i, (h, w) in enumerate(header)
+        ))
+        for name, res in summary.items():
+            print(
+                f"{name:<14}{res['requests']:>11}{res['errors']:>9}"
+                f"{res['throughput']:>9.1f}{res['p50']:>10.1f}"
+                f"{res['p95']:>10.1f}{res['p99']:>10.1f}"
+            )
@@ -5,16 +5,16 @@ from ast import literal_eval
 from typing import Dict, List
 
 from django.core.management.base import BaseCommand
-from application.models import Keyword, Author, Book, User, Rating
+from application.models import (
+    Keyword, Author, Book, User, Rating, rebuild_user_keywords
+)
+from application import neighbor_table, refresh
+from application.popularity import rebuild_book_stats
 from django.contrib.auth.hashers import make_password
 
 dataset_path = os.path.join(os.getcwd(), "..", "datasets")
 model_path = os.path.join(os.getcwd(), "..", "models")
 json_file_path = "keyword_books_lemmatized.json"
-train_df = pd.read_csv(
-    os.path.join(dataset_path, "training", "train_reduced.tsv"),
-    sep='\t', names=['user_id', 'book_id', 'rating']
-)
 
 
 class Command(BaseCommand):
@@ -24,14 +24,39 @@ class Command(BaseCommand):
     def __init__(self, sneaky=True, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dataset-path', default=dataset_path,
+            help="Carpeta con los datasets (training, goodbooks_ext y raw)."
+        )
+        parser.add_argument(
+            '--model-path', default=model_path,
+            help="Carpeta con los perfiles de usuario (user_profiles.pkl)."
+        )
+        parser.add_argument(
+            '--keywords-file', default=json_file_path,
+            help="Fichero JSON con las palabras clave de cada libro."
+        )
+
     def handle(self, *args, **kwargs):
         """
         Esta función se ejecuta cuando se llama al comando desde la terminal.
         """
+        self.dataset_path = kwargs.get('dataset_path', dataset_path)
+        self.model_path = kwargs.get('model_path', model_path)
+        self.json_file_path = kwargs.get('keywords_file', json_file_path)
+        self.train_df = pd.read_csv(
+            os.path.join(self.dataset_path, "training", "train_reduced.tsv"),
+            sep='\t', names=['user_id', 'book_id', 'rating']
+        )
         self.cleanDataBase()  # Limpia la base de datos
         self.book()  # Crea los libros
         self.user()  # Crea los usuarios
         self.rating()  # Crea las valoraciones
+        self.book_stats()  # Calcula los agregados de los libros
+        self.user_keywords()  # Calcula los perfiles de palabras clave
+        self.user_neighbors()  # Construye la tabla de vecinos
+        self.stored_recommendations()  # Encola todos los usuarios
 
     def cleanDataBase(self):
         """
@@ -49,21 +74,25 @@ class Command(BaseCommand):
         print("Creando libros...")
         # Se cargan los datos completos de los libros
         books_full_df = pd.read_csv(
-            os.path.join(dataset_path, "goodbooks_ext", "books_enriched.csv"),
+            os.path.join(
+                self.dataset_path, "goodbooks_ext", "books_enriched.csv"
+            ),
             index_col=[0],
             converters={"authors": literal_eval, "genres": literal_eval}
         )
         # Se cargan los embeddings de los libros
         books_embedding_df = pd.DataFrame(
-            pd.read_pickle(os.path.join(dataset_path, "raw", "books_raw.pkl"))
+            pd.read_pickle(
+                os.path.join(self.dataset_path, "raw", "books_raw.pkl")
+            )
         )
         # Se filtran los libros que aparecen en el conjunto de entrenamiento
-        book_ids: List[int] = sorted(train_df['book_id'].unique())
+        book_ids: List[int] = sorted(self.train_df['book_id'].unique())
         books_full_df = books_full_df[books_full_df['book_id'].isin(book_ids)]
         books_embedding_df = books_embedding_df[
             books_embedding_df['book_id'].isin(book_ids)
         ]
-        with open(json_file_path, "r") as jsonfile:
+        with open(self.json_file_path, "r") as jsonfile:
             books_keyword_dict: Dict[int, List[str]] = json.load(jsonfile)
 
         # Creación de las entradas de libros
@@ -113,7 +142,7 @@ class Command(BaseCommand):
         """
         print("Creando usuarios...")
         users_df = pd.DataFrame(
-            pd.read_pickle(os.path.join(model_path, "user_profiles.pkl"))
+            pd.read_pickle(os.path.join(self.model_path, "user_profiles.pkl"))
         )
         # Creación de las entradas de usuarios
         User.objects.bulk_create([
@@ -141,7 +170,7 @@ class Command(BaseCommand):
                 user_id=row['user_id'],
                 book_id=row['book_id'],
                 rating=row['rating']
-            ) for _, row in train_df.iterrows()
+            ) for _, row in self.train_df.iterrows()
         ])
 
         # Actualización de la suma de las valoraciones de los usuarios
@@ -151,3 +180,37 @@ class Command(BaseCommand):
                 [r.rating for r in Rating.objects.filter(user=user)]
             )
             user.save()
+
+    def book_stats(self):
+        """
+        Se calculan los agregados de las valoraciones de los libros (la
+        carga masiva no dispara las señales que los mantienen).
+        """
+        print("Calculando agregados de los libros...")
+        rebuild_book_stats()
+
+    def user_keywords(self):
+        """
+        Se calculan los perfiles de palabras clave de los usuarios.
+        """
+        print("Calculando perfiles de palabras clave...")
+        rebuild_user_keywords()
+
+    def user_neighbors(self):
+        """
+        Se construye la tabla de vecinos de los usuarios, si está activada.
+        """
+        if not neighbor_table.is_enabled():
+            return
+        print("Construyendo tabla de vecinos...")
+        neighbor_table.rebuild_user_neighbors()
+
+    def stored_recommendations(self):
+        """
+        Se marcan todos los usuarios como pendientes de calcular sus
+        recomendaciones, si las listas guardadas están activadas.
+        """
+        if not refresh.is_enabled():
+            return
+        print("Encolando usuarios para calcular sus recomendaciones...")
+        refresh.mark_all_dirty()
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from application.popularity import rebuild_book_stats, refresh_popularity
+
+
+class Command(BaseCommand):
+    """
+    Clase para recalcular los agregados de las valoraciones de los libros
+    a partir de la tabla de valoraciones.
+    """
+    help = "Recalcula los agregados de las valoraciones de los libros."
+
+    def handle(self, *args, **kwargs):
+        """
+        Esta función se ejecuta cuando se llama al comando desde la terminal.
+        """
+        print("Calculando agregados de los libros...")
+        print(f"Agregados de {rebuild_book_stats()} libros guardados")
+        refresh_popularity()
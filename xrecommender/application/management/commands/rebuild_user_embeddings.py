@@ -0,0 +1,88 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from application import neighbor_table, refresh
+from application.embeddings import CHUNK_SIZE, rebuild_user_embeddings
+from application.snapshot import get_snapshot
+
+
+class Command(BaseCommand):
+    """
+    Clase para recalcular los embeddings de todos los usuarios a partir
+    de sus valoraciones y mostrar su desviación respecto a los guardados.
+    """
+    help = (
+        "Recalcula el embedding y la suma de valoraciones de todos los "
+        "usuarios a partir de las valoraciones positivas."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help="Sólo muestra la desviación, sin guardar nada."
+        )
+        parser.add_argument(
+            '--chunk-size', type=int, default=CHUNK_SIZE,
+            help="Usuarios por bloque."
+        )
+        parser.add_argument(
+            '--tolerance', type=float, default=0.0,
+            help="Desviación a partir de la cual se guarda un usuario."
+        )
+
+    def handle(self, *args, **kwargs):
+        """
+        Esta función se ejecuta cuando se llama al comando desde la terminal.
+        """
+        start = time.perf_counter()
+        print("Recalculando embeddings de usuarios...")
+        report = rebuild_user_embeddings(
+            kwargs['chunk_size'], kwargs['dry_run'], kwargs['tolerance']
+        )
+        print(f"{report['users']} usuarios en "
+              f"{time.perf_counter() - start:.1f} s")
+        print(f"Desviación máxima del embedding: "
+              f"{report['max_deviation']:.3e}")
+        print(f"Desviación media del embedding: "
+              f"{report['mean_deviation']:.3e}")
+        print(f"Desviación máxima de sum_ratings: "
+              f"{report['max_sum_deviation']:.3e}")
+        print(f"Usuarios por encima de la tolerancia: {report['changed']}")
+        if report['worst']:
+            print(f"{'usuario':>10}{'máxima':>14}{'media':>14}")
+            for user_id, max_dev, mean_dev in report['worst']:
+                print(f"{user_id:>10}{max_dev:>14.3e}{mean_dev:>14.3e}")
+        if kwargs['dry_run']:
+            print("Simulación: no se ha guardado ningún usuario")
+        else:
+            print(f"{report['saved']} usuarios guardados")
+            if report['saved']:
+                self.refresh_derived_data()
+
+    def refresh_derived_data(self):
+        """
+        Actualiza los datos que dependen de los embeddings de los usuarios:
+        reconstruye la tabla de vecinos (si está activada), marca las
+        recomendaciones guardadas y avisa si el snapshot activo ha quedado
+        desfasado.
+        """
+        if neighbor_table.is_enabled():
+            print("Reconstruyendo tabla de vecinos...")
+            total = neighbor_table.rebuild_user_neighbors()
+            print(f"{total} vecinos guardados")
+        self.mark_stored_recommendations()
+        snapshot = get_snapshot()
+        if snapshot is not None:
+            print(f"El snapshot activo ({snapshot.generation}) tiene los "
+                  f"embeddings anteriores; genera uno nuevo con "
+                  f"`make build_snapshot`")
+
+    def mark_stored_recommendations(self):
+        """
+        Marca todos los usuarios como pendientes de recalcular sus
+        recomendaciones guardadas, si están activadas.
+        """
+        if refresh.is_enabled():
+            print(f"{refresh.mark_all_dirty()} usuarios pendientes de "
+                  f"recalcular sus recomendaciones")
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from application.models import rebuild_user_keywords
+
+
+class Command(BaseCommand):
+    """
+    Clase para recalcular los perfiles de palabras clave de los usuarios
+    a partir de las valoraciones positivas.
+    """
+    help = "Recalcula los perfiles de palabras clave de los usuarios."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--users', type=int, nargs='+',
+            help="IDs de los usuarios. Por defecto, todos."
+        )
+
+    def handle(self, *args, **kwargs):
+        """
+        Esta función se ejecuta cuando se llama al comando desde la terminal.
+        """
+        print("Calculando perfiles de palabras clave...")
+        entries = rebuild_user_keywords(kwargs['users'])
+        print(f"{entries} entradas de perfil guardadas")
@@ -0,0 +1,39 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from application import refresh
+from application.neighbor_table import rebuild_user_neighbors, table_size
+
+
+class Command(BaseCommand):
+    """
+    Clase para construir la tabla de vecinos más próximos de cada usuario.
+    """
+    help = "Construye la tabla de vecinos más próximos de cada usuario."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--k', type=int, default=table_size(),
+            help="Vecinos por usuario."
+        )
+
+    def handle(self, *args, **kwargs):
+        """
+        Esta función se ejecuta cuando se llama al comando desde la terminal.
+        """
+        print("Construyendo tabla de vecinos...")
+        start = time.perf_counter()
+        total = rebuild_user_neighbors(kwargs['k'])
+        print(f"{total} vecinos guardados en "
+              f"{time.perf_counter() - start:.2f} s")
+        self.mark_stored_recommendations()
+
+    def mark_stored_recommendations(self):
+        """
+        Marca todos los usuarios como pendientes de recalcular sus
+        recomendaciones guardadas, si están activadas.
+        """
+        if refresh.is_enabled():
+            print(f"{refresh.mark_all_dirty()} usuarios pendientes de "
+                  f"recalcular sus recomendaciones")
@@ -0,0 +1,75 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from application.refresh import (
+    BATCH_SIZE, is_enabled, is_requested, mark_all_dirty, refresh_dirty_users
+)
+
+
+class Command(BaseCommand):
+    """
+    Clase para recalcular las listas de recomendaciones guardadas de los
+    usuarios pendientes.
+    """
+    help = (
+        "Recalcula por lotes las recomendaciones de los usuarios marcados "
+        "como pendientes, empezando por los más activos."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=BATCH_SIZE,
+            help="Usuarios por lote."
+        )
+        parser.add_argument(
+            '--max-users', type=int, default=None,
+            help="Máximo de usuarios por pasada (por defecto, toda la cola)."
+        )
+        parser.add_argument(
+            '--rate', type=float, default=None,
+            help="Máximo de usuarios por segundo."
+        )
+        parser.add_argument(
+            '--all', action='store_true',
+            help="Marca antes todos los usuarios como pendientes."
+        )
+        parser.add_argument(
+            '--loop', action='store_true',
+            help="Sigue recalculando los nuevos pendientes."
+        )
+        parser.add_argument(
+            '--interval', type=float, default=5.0,
+            help="Segundos de espera con la cola vacía (con --loop)."
+        )
+
+    def handle(self, *args, **kwargs):
+        """
+        Esta función se ejecuta cuando se llama al comando desde la terminal.
+        """
+        if not is_requested():
+            raise CommandError(
+                "Las listas guardadas están desactivadas "
+                "(XBRECS_STORED_RECOMMENDATIONS)."
+            )
+        if not is_enabled():
+            raise CommandError(
+                "Las listas guardadas necesitan la tabla de vecinos "
+                "(XBRECS_NEIGHBOR_TABLE)."
+            )
+        if kwargs['all']:
+            print(f"{mark_all_dirty()} usuarios marcados como pendientes")
+        while True:
+            report = refresh_dirty_users(
+                kwargs['batch_size'], kwargs['max_users'], kwargs['rate']
+            )
+            if report['batches'] or not kwargs['loop']:
+                print(f"{report['refreshed']} usuarios recalculados en "
+                      f"{report['seconds']:.1f} s "
+                      f"({report['cold_start']} sin señal, "
+                      f"{report['remarked']} marcados de nuevo, "
+                      f"{report['backlog']} pendientes)")
+            if not kwargs['loop']:
+                break
+            if not report['backlog']:
+                time.sleep(kwargs['interval'])
@@ -0,0 +1,102 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from application.evaluation import read_tsv, write_results
+from application.models import LIKES
+from application.predictions import (
+    DEFAULT_TOP, DEFAULT_BATCH_SIZE,
+    PredictionData, sweep_predictions, sweep_folder
+)
+from .evaluate import add_evaluation_arguments, load_evaluator, report
+from .export_predictions import predictions_path
+
+# Números de vecinos del barrido de `elliot/results/knn/user-user`
+DEFAULT_KS = [5, 7, 9, 11, 13, 15, 19, 23, 27, 31, 35, 39, 43, 47, 51, 55]
+
+
+class Command(BaseCommand):
+    """
+    Clase para generar las predicciones usuario-usuario de un barrido de
+    hiperparámetros (número de vecinos y umbral de valoración positiva)
+    calculando las similitudes entre usuarios una sola vez.
+    """
+    help = (
+        "Genera las predicciones usuario-usuario para varios números de "
+        "vecinos y umbrales de valoración positiva en una sola pasada."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--k', type=int, nargs='+', default=DEFAULT_KS,
+            help="Números de vecinos."
+        )
+        parser.add_argument(
+            '--likes', type=float, nargs='+', default=[LIKES],
+            help="Umbrales de valoración positiva."
+        )
+        parser.add_argument('--top', type=int, default=DEFAULT_TOP)
+        parser.add_argument(
+            '--workers', type=int, default=os.cpu_count() or 1,
+            help="Número de procesos."
+        )
+        parser.add_argument('--batch-size', type=int,
+                            default=DEFAULT_BATCH_SIZE)
+        parser.add_argument(
+            '--output', default=predictions_path,
+            help="Carpeta de salida."
+        )
+        parser.add_argument(
+            '--evaluate', action='store_true',
+            help="Evalúa cada configuración con las métricas de Elliot."
+        )
+        add_evaluation_arguments(parser)
+
+    def handle(self, *args, **kwargs):
+        """
+        Esta función se ejecuta cuando se llama al comando desde la terminal.
+        """
+        if min(kwargs['k']) < 1:
+            raise CommandError("El número de vecinos debe ser positivo.")
+
+        start = time.perf_counter()
+        print("Cargando matrices de la base de datos...")
+        data = PredictionData.from_database()
+        if not len(data.user_ids) or not len(data.book_ids):
+            raise CommandError("La base de datos no tiene valoraciones.")
+        print(f"{len(data.user_ids)} usuarios y {len(data.book_ids)} libros "
+              f"({time.perf_counter() - start:.1f} s)")
+
+        start = time.perf_counter()
+        paths = sweep_predictions(
+            kwargs['output'], kwargs['k'], kwargs['likes'], kwargs['top'],
+            kwargs['workers'], kwargs['batch_size'], data
+        )
+        for (threshold, k), path in sorted(paths.items()):
+            print(f"likes={threshold:g} k={k}: {path}")
+        print(f"{len(paths)} configuraciones en "
+              f"{time.perf_counter() - start:.1f} s")
+
+        if kwargs['evaluate']:
+            self.evaluate(paths, kwargs)
+
+    def evaluate(self, paths, kwargs) -> None:
+        """
+        Evalúa las predicciones del barrido y escribe los resultados con
+        la estructura de `elliot/results` (una carpeta por umbral).
+
+        ## Argumentos:
+        - `paths`: Diccionario (umbral, k) -> fichero de predicciones.
+        - `kwargs`: Argumentos del comando.
+        """
+        evaluator = load_evaluator(kwargs)
+        for (threshold, k), path in sorted(paths.items()):
+            results = evaluator.evaluate(
+                read_tsv(path, 'prediction'), kwargs['cutoffs'],
+                kwargs['workers']
+            )
+            report(f"likes={threshold:g} k={k}", results)
+            write_results(
+                sweep_folder(kwargs['results'], threshold), path, results
+            )
@@ -0,0 +1,66 @@
+from django.core.management.base import BaseCommand
+
+from application.synthetic import generate_dataset
+
+
+def add_dataset_arguments(parser) -> None:
+    """
+    Añade los argumentos que configuran el dataset sintético.
+
+    ## Argumentos:
+    - `parser`: Parser de argumentos del comando.
+    """
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--books', type=int, default=500)
+    parser.add_argument(
+        '--density', type=float, default=0.05,
+        help="Proporción de libros valorados por cada usuario."
+    )
+    parser.add_argument('--keywords', type=int, default=300)
+    parser.add_argument('--keywords-per-book', type=int, default=8)
+    parser.add_argument('--dim', type=int, default=768)
+    parser.add_argument('--seed', type=int, default=42)
+
+
+def dataset_options(kwargs) -> dict:
+    """
+    Extrae de los argumentos del comando la configuración del dataset.
+
+    ## Argumentos:
+    - `kwargs`: Argumentos del comando.
+
+    ## Retorno:
+    - Argumentos para `generate_dataset`.
+    """
+    return {
+        'users': kwargs['users'],
+        'books': kwargs['books'],
+        'density': kwargs['density'],
+        'keywords': kwargs['keywords'],
+        'keywords_per_book': kwargs['keywords_per_book'],
+        'dim': kwargs['dim'],
+        'seed': kwargs['seed'],
+    }
+
+
+class Command(BaseCommand):
+    """Clase para generar un dataset sintético con el formato de populate."""
+    help = "Genera un dataset sintético que puede cargarse con populate."
+
+    def add_arguments(self, parser):
+        parser.add_argument('output', help="Carpeta de salida.")
+        add_dataset_arguments(parser)
+
+    def handle(self, *args, **kwargs):
+        """
+        Esta función se ejecuta cuando se llama al comando desde la terminal.
+        """
+        print("Generando dataset sintético...")
+        paths = generate_dataset(kwargs['output'], **dataset_options(kwargs))
+        print(
+            "Dataset generado. Para cargarlo:\n"
+            f"  python manage.py populate"
+            f" --dataset-path {paths['dataset_path']}"
+            f" --model-path {paths['model_path']}"
+            f" --keywords-file {paths['keywords_file']}"
+        )
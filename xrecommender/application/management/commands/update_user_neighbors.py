@@ -0,0 +1,55 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from application.neighbor_table import (
+    PENDING_BATCH_SIZE, is_enabled, process_pending_updates
+)
+
+
+class Command(BaseCommand):
+    """
+    Clase para aplicar a la tabla de vecinos las actualizaciones de los
+    usuarios cuyo embedding ha cambiado.
+    """
+    help = (
+        "Actualiza la tabla de vecinos con los usuarios en cola, con un "
+        "recorrido de los embeddings por lote."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=PENDING_BATCH_SIZE,
+            help="Usuarios por lote."
+        )
+        parser.add_argument(
+            '--loop', action='store_true',
+            help="Sigue procesando los nuevos usuarios en cola."
+        )
+        parser.add_argument(
+            '--interval', type=float, default=1.0,
+            help="Segundos de espera con la cola vacía (con --loop)."
+        )
+
+    def handle(self, *args, **kwargs):
+        """
+        Esta función se ejecuta cuando se llama al comando desde la terminal.
+        """
+        if not is_enabled():
+            raise CommandError(
+                "La tabla de vecinos está desactivada (XBRECS_NEIGHBOR_TABLE)."
+            )
+        while True:
+            start = time.perf_counter()
+            report = process_pending_updates(kwargs['batch_size'])
+            if report['users']:
+                print(f"{report['users']} usuarios, {report['lists']} listas "
+                      f"reescritas en {time.perf_counter() - start:.2f} s "
+                      f"({report['pending']} pendientes)")
+            elif not kwargs['loop']:
+                print("No hay actualizaciones pendientes")
+            if report['pending']:
+                continue
+            if not kwargs['loop']:
+                break
+            time.sleep(kwargs['interval'])
@@ -0,0 +1,248 @@
+import pickle
+import numpy as np
+from itertools import islice
+from scipy.sparse import csr_matrix
+from typing import Iterator, Optional, Tuple
+
+from django.db import models
+
+from .models import User, Book, Rating, LIKES
+
+
+def embedding_matrix(
+    queryset: models.QuerySet, dtype: type = np.float32
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Obtiene los embeddings de un conjunto de usuarios o libros como matriz.
+
+    ## Argumentos:
+    - `queryset`: Usuarios o libros.
+    - `dtype`: Tipo de la matriz (float32 por defecto).
+
+    ## Retorno:
+    - Tupla (IDs ordenados, matriz con un embedding por fila).
+    """
+    rows = list(queryset.order_by('id').values_list('id', 'embedding'))
+    ids = np.array([pk for pk, _ in rows], dtype=np.int64)
+    if not rows:
+        return ids, np.zeros((0, 0), dtype=dtype)
+    matrix = np.vstack([
+        pickle.loads(embedding) for _, embedding in rows
+    ]).astype(dtype)
+    return ids, matrix
+
+
+def iter_embedding_blocks(
+    queryset: models.QuerySet, block_size: int
+) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+    """
+    Recorre los embeddings de un conjunto de usuarios o libros por
+    bloques, en el orden del queryset y sin cargarlos todos en memoria.
+
+    ## Argumentos:
+    - `queryset`: Usuarios o libros.
+    - `block_size`: Filas de cada bloque.
+
+    ## Retorno:
+    - Iterador de tuplas (IDs, matriz float32 con un embedding por fila).
+    """
+    rows = queryset.values_list('id', 'embedding').iterator(
+        chunk_size=block_size
+    )
+    while True:
+        block = list(islice(rows, block_size))
+        if not block:
+            return
+        yield (np.array([pk for pk, _ in block], dtype=np.int64),
+               np.vstack([pickle.loads(embedding) for _, embedding in block])
+               .astype(np.float32))
+
+
+def user_matrix(
+    queryset: Optional[models.QuerySet] = None
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Obtiene la matriz de embeddings de usuarios. Por defecto, la de los
+    usuarios con alguna valoración.
+
+    ## Argumentos:
+    - `queryset`: Usuarios a incluir.
+
+    ## Retorno:
+    - Tupla (IDs de usuario, matriz de embeddings).
+    """
+    if queryset is None:
+        queryset = User.objects.filter(rating__isnull=False).distinct()
+    return embedding_matrix(queryset)
+
+
+def book_matrix(
+    queryset: Optional[models.QuerySet] = None
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Obtiene la matriz de embeddings de libros.
+
+    ## Argumentos:
+    - `queryset`: Libros a incluir. Por defecto, todos.
+
+    ## Retorno:
+    - Tupla (IDs de libro, matriz de embeddings).
+    """
+    return embedding_matrix(
+        Book.objects.all() if queryset is None else queryset
+    )
+
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    """
+    Normaliza las filas de una matriz (las filas nulas se quedan a cero,
+    como en `cosine_similarity`).
+
+    ## Argumentos:
+    - `matrix`: Matriz a normalizar.
+
+    ## Retorno:
+    - Matriz float32 con filas de norma 1 (o nulas).
+    """
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return np.divide(
+        matrix, norms, out=np.zeros_like(matrix), where=norms != 0
+    )
+
+
+def rating_matrix(
+    user_ids: np.ndarray,
+    book_ids: np.ndarray,
+    min_rating: Optional[float] = None
+) -> csr_matrix:
+    """
+    Obtiene la matriz dispersa de valoraciones (usuarios x libros). Las
+    valoraciones de usuarios o libros que no estén en los IDs dados se
+    descartan.
+
+    ## Argumentos:
+    - `user_ids`: IDs de usuario ordenados (filas).
+    - `book_ids`: IDs de libro ordenados (columnas).
+    - `min_rating`: Si se indica, sólo se incluyen las valoraciones
+    mayores o iguales.
+
+    ## Retorno:
+    - Matriz CSR float32 con las valoraciones.
+    """
+    ratings = Rating.objects.all()
+    if min_rating is not None:
+        ratings = ratings.filter(rating__gte=min_rating)
+    values = np.array(
+        list(ratings.values_list('user_id', 'book_id', 'rating')),
+        dtype=np.float64
+    ).reshape(-1, 3)
+    return ratings_to_csr(
+        values[:, 0].astype(np.int64), values[:, 1].astype(np.int64),
+        values[:, 2], user_ids, book_ids
+    )
+
+
+def ratings_to_csr(
+    rating_users: np.ndarray,
+    rating_books: np.ndarray,
+    rating_values: np.ndarray,
+    user_ids: np.ndarray,
+    book_ids: np.ndarray
+) -> csr_matrix:
+    """
+    Construye la matriz dispersa de valoraciones a partir de tripletas.
+
+    ## Argumentos:
+    - `rating_users`: ID de usuario de cada valoración.
+    - `rating_books`: ID de libro de cada valoración.
+    - `rating_values`: Valor de cada valoración.
+    - `user_ids`: IDs de usuario ordenados (filas).
+    - `book_ids`: IDs de libro ordenados (columnas).
+
+    ## Retorno:
+    - Matriz CSR float32 (usuarios x libros).
+    """
+    rows = np.searchsorted(user_ids, rating_users)
+    cols = np.searchsorted(book_ids, rating_books)
+    rows_clip = np.minimum(rows, max(len(user_ids) - 1, 0))
+    cols_clip = np.minimum(cols, max(len(book_ids) - 1, 0))
+    valid = (rows < len(user_ids)) & (cols < len(book_ids))
+    if len(user_ids) and len(book_ids):
+        valid &= (user_ids[rows_clip] == rating_users) & \
+            (book_ids[cols_clip] == rating_books)
+    return csr_matrix(
+        (rating_values[valid].astype(np.float32),
+         (rows[valid], cols[valid])),
+        shape=(len(user_ids), len(book_ids))
+    )
+
+
+def likes_matrix(ratings: csr_matrix, likes: float = LIKES) -> csr_matrix:
+    """
+    Filtra una matriz de valoraciones para quedarse con las positivas.
+
+    ## Argumentos:
+    - `ratings`: Matriz de valoraciones.
+    - `likes`: Umbral de valoración positiva.
+
+    ## Retorno:
+    - Matriz CSR con las valoraciones mayores o iguales que el umbral.
+    """
+    liked = ratings.multiply(ratings >= likes).tocsr()
+    liked.eliminate_zeros()
+    return liked
+
+
+def top_n_indices(scores: np.ndarray, n: int) -> np.ndarray:
+    """
+    Obtiene los índices de las `n` mayores puntuaciones de cada fila,
+    ordenados de mayor a menor puntuación.
+
+    ## Argumentos:
+    - `scores`: Matriz de puntuaciones (una fila por usuario). Las
+    posiciones descartadas deben valer `-inf`.
+    - `n`: Número de índices por fila.
+
+    ## Retorno:
+    - Matriz de índices (filas x min(n, columnas)).
+    """
+    n = min(n, scores.shape[1])
+    if n == 0:
+        return np.zeros((scores.shape[0], 0), dtype=np.int64)
+    if n < scores.shape[1]:
+        candidates = np.argpartition(-scores, n - 1, axis=1)[:, :n]
+    else:
+        candidates = np.tile(np.arange(n), (scores.shape[0], 1))
+    order = np.argsort(
+        -np.take_along_axis(scores, candidates, axis=1), axis=1,
+        kind='stable'
+    )
+    return np.take_along_axis(candidates, order, axis=1)
+
+
+def nearest_neighbors(
+    vectors: np.ndarray, candidates: np.ndarray, n: int,
+    exclude: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Calcula los `n` vecinos más próximos (similitud coseno) de un lote
+    de vectores normalizados.
+
+    ## Argumentos:
+    - `vectors`: Vectores normalizados del lote (una fila por usuario).
+    - `candidates`: Vectores normalizados de los posibles vecinos.
+    - `n`: Número de vecinos.
+    - `exclude`: Posición en `candidates` de cada vector del lote (el
+    propio usuario, que no es vecino de sí mismo), o -1.
+
+    ## Retorno:
+    - Tupla (índices de los vecinos, similitudes), ambas de tamaño
+    lote x n y ordenadas de mayor a menor similitud.
+    """
+    sims = vectors @ candidates.T
+    rows = np.flatnonzero(exclude >= 0)
+    sims[rows, exclude[rows]] = -np.inf
+    neighbors = top_n_indices(sims, n)
+    neighbor_sims = np.take_along_axis(sims, neighbors, axis=1)
+    return neighbors, neighbor_sims
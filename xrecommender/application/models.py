@@ -1,13 +1,34 @@
 import numpy as np
 import pickle
-
-from django.db import models
+from datetime import datetime, timezone as dt_timezone
+from typing import Dict, Iterable, Optional
+
+from django.db import models, transaction, connection, IntegrityError
+from django.db.models import F, Count, Sum, Case, When, Value
+from django.db.models.functions import Abs, Greatest, Log, Power
+from django.db.models.lookups import GreaterThan
+from django.utils import timezone
 from django.contrib.auth.models import AbstractUser
-from django.db.models.signals import pre_save, post_save, post_delete
-from django.dispatch import receiver
+from django.db.models.signals import (
+    pre_save, post_save, post_delete, m2m_changed
+)
+from django.dispatch import receiver, Signal
 
 LIKES = 0.75
 EMBEDDING_DIM = 768
+# Actividad reciente de los libros: cada valoración positiva pesa
+# 2^((t - época) / semivida), y se guarda el logaritmo en base 2 de la suma
+# de los pesos, es decir, la actividad con decaimiento exponencial escalada
+# por un factor común a todos los libros (ordenar por él es ordenar por la
+# actividad reciente). En escala logarítmica el valor crece de forma lineal
+# con el tiempo, sin desbordarse ni perder precisión
+TRENDING_EPOCH = datetime(2024, 1, 1, tzinfo=dt_timezone.utc)
+TRENDING_HALF_LIFE = 7 * 24 * 3600  # Semivida en segundos (una semana)
+NO_TRENDING = -1e9  # Sin actividad (log2 de una suma vacía)
+# Diferencia de exponentes a partir de la cual el sumando menor no cambia
+# el resultado en coma flotante (y 2^-x no se calcula: en PostgreSQL el
+# desbordamiento por abajo es un error)
+TRENDING_MAX_GAP = 64.0
 
 
 class Keyword(models.Model):
@@ -106,6 +127,10 @@ class User(AbstractUser):
         default=default_embedding
     )  # Embedding SBERT del usuario
     sum_ratings = models.FloatField(default=0.0)  # Suma de las valoraciones
+    # Versión de las valoraciones: cambia con cada alta, modificación o
+    # borrado y, con la tabla de vecinos, cuando cambian sus vecinos o las
+    # valoraciones positivas de estos (ETag de las recomendaciones)
+    ratings_version = models.PositiveIntegerField(default=0)
 
     def set_embedding(self, embedding: np.ndarray) -> None:
         """
@@ -163,14 +188,26 @@ class User(AbstractUser):
 
     def get_keywords(self) -> models.QuerySet[Keyword]:
         """
-        Obtiene las palabras clave de los libros que le gustan al usuario.
+        Obtiene las palabras clave de los libros que le gustan al usuario
+        (del perfil materializado en `UserKeyword`).
 
         ## Retorno:
         - Palabras clave de los libros que le gustan al usuario.
         """
-        return Keyword.objects.filter(
-            book__rating__user=self, book__rating__rating__gte=LIKES
-        ).distinct()
+        return Keyword.objects.filter(userkeyword__user=self)
+
+    def get_keyword_profile(self) -> Dict[int, float]:
+        """
+        Obtiene el perfil de palabras clave del usuario con una consulta
+        por índice.
+
+        ## Retorno:
+        - Diccionario {ID de palabra clave: suma de las valoraciones de
+        los libros que le gustan con esa palabra clave}.
+        """
+        return dict(UserKeyword.objects.filter(
+            user=self
+        ).values_list('keyword_id', 'weight'))
 
     def __str__(self) -> str:
         """
@@ -188,6 +225,18 @@ class Rating(models.Model):
     book = models.ForeignKey(Book, on_delete=models.CASCADE)
     rating = models.FloatField()  # 0.0, 0.25, 0.5, 0.75, 1.0
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'book'], name='rating_user_book_unique'
+            ),
+        ]
+        indexes = [
+            # Valoraciones positivas de un usuario (rating >= LIKES)
+            models.Index(fields=['user', 'rating'],
+                         name='rating_user_rating_idx'),
+        ]
+
     def __str__(self) -> str:
         """
         Representación en string de la valoración.
@@ -198,6 +247,388 @@ class Rating(models.Model):
         return f'{self.user} - {self.book} - {self.rating}'
 
 
+class BookStats(models.Model):
+    """
+    Modelo con los agregados de las valoraciones de cada libro, mantenidos
+    de forma incremental por las señales de `Rating`.
+    """
+    book = models.OneToOneField(
+        Book, on_delete=models.CASCADE, primary_key=True,
+        related_name='stats'
+    )
+    rating_count = models.IntegerField(default=0)  # Número de valoraciones
+    rating_sum = models.FloatField(default=0.0)  # Suma de las valoraciones
+    like_count = models.IntegerField(default=0)  # Valoraciones positivas
+    # Actividad reciente escalada (log2, ver `trending_exponent`)
+    trending = models.FloatField(default=NO_TRENDING)
+    last_rated = models.DateTimeField(null=True)  # Última valoración
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-like_count'], name='bookstats_likes_idx'),
+            models.Index(fields=['-trending'], name='bookstats_trend_idx'),
+        ]
+
+    @property
+    def mean_rating(self) -> float:
+        """
+        Valoración media del libro.
+
+        ## Retorno:
+        - Media de las valoraciones (0 si no tiene ninguna).
+        """
+        return self.rating_sum / self.rating_count if self.rating_count \
+            else 0.0
+
+    def __str__(self) -> str:
+        """
+        Representación en string de los agregados.
+
+        ## Retorno:
+        - Libro y número de valoraciones positivas.
+        """
+        return f'{self.book} - {self.like_count}'
+
+
+class UserKeyword(models.Model):
+    """
+    Modelo con el perfil de palabras clave de cada usuario: las palabras
+    clave de los libros que le gustan, con el número de libros y la suma
+    de sus valoraciones. Se mantiene de forma incremental con los cambios
+    de valoraciones y se puede recalcular con `rebuild_user_keywords`.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    keyword = models.ForeignKey(Keyword, on_delete=models.CASCADE)
+    count = models.IntegerField(default=0)  # Libros que le gustan
+    weight = models.FloatField(default=0.0)  # Suma de sus valoraciones
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'keyword'], name='userkeyword_unique'
+            ),
+        ]
+
+    def __str__(self) -> str:
+        """
+        Representación en string de la palabra clave del perfil.
+
+        ## Retorno:
+        - Usuario, palabra clave y peso.
+        """
+        return f'{self.user} - {self.keyword} - {self.weight}'
+
+
+class UserNeighbor(models.Model):
+    """
+    Modelo con la tabla de vecinos más próximos de cada usuario: una fila
+    por vecino con su similitud y su posición en la lista (0 el más
+    próximo). Se construye con `neighbor_table.rebuild_user_neighbors` y
+    se mantiene de forma incremental cuando cambia un embedding.
+    """
+    user = models.ForeignKey(
+        User, on_delete=models.CASCADE, related_name='neighbors'
+    )
+    neighbor = models.ForeignKey(
+        User, on_delete=models.CASCADE, related_name='+'
+    )
+    similarity = models.FloatField()  # Similitud coseno
+    rank = models.PositiveSmallIntegerField()  # Posición en la lista
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'rank'], name='userneighbor_user_rank_unique'
+            ),
+        ]
+        indexes = [
+            # Primero y último de cada lista (umbral de entrada)
+            models.Index(fields=['rank'], name='userneighbor_rank_idx'),
+        ]
+
+    def __str__(self) -> str:
+        """
+        Representación en string del vecino.
+
+        ## Retorno:
+        - Usuario, vecino y similitud.
+        """
+        return f'{self.user} - {self.neighbor} - {self.similarity}'
+
+
+class PendingNeighborUpdate(models.Model):
+    """
+    Modelo con la cola de usuarios cuyo embedding ha cambiado y cuyas
+    listas de vecinos (`UserNeighbor`) falta actualizar. Mientras un
+    usuario está en la cola, su lista no se usa.
+    """
+    user = models.OneToOneField(
+        User, on_delete=models.CASCADE, primary_key=True,
+        related_name='pending_neighbor_update'
+    )
+    marked_at = models.DateTimeField()  # Última vez que se ha marcado
+
+    def __str__(self) -> str:
+        """
+        Representación en string del usuario pendiente.
+
+        ## Retorno:
+        - Usuario y fecha de la marca.
+        """
+        return f'{self.user} - {self.marked_at}'
+
+
+class UserRecommendation(models.Model):
+    """
+    Modelo con la lista de recomendaciones guardada de cada usuario: una
+    fila por libro con su predicción y su posición. Se borra al marcar el
+    usuario como pendiente (`DirtyUser`) y la vuelve a guardar
+    `refresh.refresh_dirty_users`. Guarda la generación del snapshot y la
+    versión de las valoraciones del usuario con las que se calculó: si ya
+    no coinciden, no se usa.
+    """
+    user = models.ForeignKey(
+        User, on_delete=models.CASCADE, related_name='stored_recommendations'
+    )
+    book = models.ForeignKey(
+        Book, on_delete=models.CASCADE, related_name='+'
+    )
+    score = models.FloatField()  # Predicción
+    rank = models.PositiveSmallIntegerField()  # Posición en la lista
+    generation = models.CharField(max_length=64)  # Snapshot o 'db'
+    ratings_version = models.PositiveIntegerField()  # Del usuario
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'rank'],
+                name='userrecommendation_user_rank_unique'
+            ),
+        ]
+
+    def __str__(self) -> str:
+        """
+        Representación en string de la recomendación.
+
+        ## Retorno:
+        - Usuario, libro y predicción.
+        """
+        return f'{self.user} - {self.book} - {self.score}'
+
+
+class DirtyUser(models.Model):
+    """
+    Modelo con la cola de usuarios cuyas recomendaciones hay que volver a
+    calcular, porque han valorado un libro o han cambiado sus vecinos.
+    """
+    user = models.OneToOneField(
+        User, on_delete=models.CASCADE, primary_key=True, related_name='+'
+    )
+    marked_at = models.DateTimeField()  # Última vez que se ha marcado
+
+    def __str__(self) -> str:
+        """
+        Representación en string del usuario pendiente.
+
+        ## Retorno:
+        - Usuario y fecha de la marca.
+        """
+        return f'{self.user} - {self.marked_at}'
+
+
+class IndexVersion(models.Model):
+    """
+    Modelo con la versión compartida de cada índice en memoria
+    (autocompletado, palabras clave). Cada cambio de los datos indexados
+    la incrementa; los procesos la comprueban al leer su índice y lo
+    reconstruyen si no coincide con la suya.
+    """
+    name = models.CharField(max_length=32, primary_key=True)
+    version = models.PositiveBigIntegerField(default=0)
+
+    def __str__(self) -> str:
+        """
+        Representación en string de la versión.
+
+        ## Retorno:
+        - Nombre del índice y versión.
+        """
+        return f'{self.name} - {self.version}'
+
+
+def index_version(name: str) -> int:
+    """
+    Obtiene la versión compartida de un índice en memoria.
+
+    ## Argumentos:
+    - `name`: Nombre del índice.
+
+    ## Retorno:
+    - Versión (0 si todavía no se ha modificado).
+    """
+    return IndexVersion.objects.filter(name=name).values_list(
+        'version', flat=True
+    ).first() or 0
+
+
+def bump_index_version(name: str) -> int:
+    """
+    Incrementa la versión compartida de un índice en memoria. La fila
+    queda bloqueada hasta el final de la transacción, así que la versión
+    devuelta es la de este cambio.
+
+    ## Argumentos:
+    - `name`: Nombre del índice.
+
+    ## Retorno:
+    - Nueva versión.
+    """
+    versions = IndexVersion.objects.filter(name=name)
+    with transaction.atomic():
+        IndexVersion.objects.get_or_create(name=name)
+        versions.update(version=F('version') + 1)
+        return versions.values_list('version', flat=True).get()
+
+
+def rebuild_user_keywords(user_ids: Optional[Iterable[int]] = None) -> int:
+    """
+    Recalcula el perfil de palabras clave de los usuarios a partir de las
+    valoraciones positivas.
+
+    ## Argumentos:
+    - `user_ids`: IDs de los usuarios. Por defecto, todos.
+
+    ## Retorno:
+    - Número de entradas del perfil guardadas.
+    """
+    ratings = Rating.objects.filter(
+        rating__gte=LIKES, book__keywords__isnull=False
+    )
+    profiles = UserKeyword.objects.all()
+    if user_ids is not None:
+        user_ids = list(user_ids)
+        ratings = ratings.filter(user_id__in=user_ids)
+        profiles = profiles.filter(user_id__in=user_ids)
+    rows = ratings.values('user_id', 'book__keywords').annotate(
+        n=Count('id'), total=Sum('rating')
+    ).values_list('user_id', 'book__keywords', 'n', 'total')
+    entries = [
+        UserKeyword(user_id=user_id, keyword_id=keyword_id, count=n,
+                    weight=total)
+        for user_id, keyword_id, n, total in rows
+    ]
+    with transaction.atomic():
+        profiles.delete()
+        UserKeyword.objects.bulk_create(entries, batch_size=1000)
+    return len(entries)
+
+
+def trending_exponent(when: datetime) -> float:
+    """
+    Peso de una valoración positiva en la actividad reciente, en escala
+    logarítmica.
+
+    ## Argumentos:
+    - `when`: Momento de la valoración.
+
+    ## Retorno:
+    - (when - época) / semivida, es decir, log2 del peso.
+    """
+    return (when - TRENDING_EPOCH).total_seconds() / TRENDING_HALF_LIFE
+
+
+def add_trending(exponent: float) -> Case:
+    """
+    Expresión que suma a la actividad reciente guardada (en log2) un peso
+    2^`exponent`, como log2(2^a + 2^b) = max(a, b) + log2(1 + 2^-|a - b|).
+
+    ## Argumentos:
+    - `exponent`: log2 del peso que se suma.
+
+    ## Retorno:
+    - Expresión para actualizar el campo `trending`.
+    """
+    exponent = Value(exponent, output_field=models.FloatField())
+    top = Greatest(F('trending'), exponent)
+    gap = Abs(F('trending') - exponent)
+    return Case(
+        When(GreaterThan(gap, TRENDING_MAX_GAP), then=top),
+        default=top + Log(2.0, 1.0 + Power(2.0, -gap)),
+        output_field=models.FloatField()
+    )
+
+
+# Señal que se envía cada vez que cambia una valoración, tanto desde las
+# señales del ORM como desde `upsert_rating` (que no las dispara).
+# Argumentos: `user`, `book`, `previous` (`None` si la valoración es nueva)
+# y `new` (`None` si se ha eliminado)
+rating_changed = Signal()
+
+
+def upsert_rating(user: User, book: Book, value: float) -> Optional[float]:
+    """
+    Guarda la valoración de un usuario para un libro, creándola o
+    actualizándola, y envía `rating_changed`. La lectura del valor
+    anterior, la escritura y la señal se hacen en una sola transacción con
+    la fila bloqueada (`SELECT ... FOR UPDATE`), así que dos peticiones
+    simultáneas no pueden leer el mismo valor anterior.
+
+    ## Argumentos:
+    - `user`: Usuario.
+    - `book`: Libro.
+    - `value`: Valoración.
+
+    ## Retorno:
+    - Valoración anterior o `None` si es nueva.
+    """
+    ratings = Rating.objects.filter(user=user, book=book)
+    with transaction.atomic():
+        previous = ratings.select_for_update().values_list(
+            'rating', flat=True
+        ).first()
+        if previous is None and not _insert_rating(user.id, book.id, value):
+            # Otra petición la ha creado a la vez: se bloquea y se actualiza
+            previous = ratings.select_for_update().values_list(
+                'rating', flat=True
+            ).first()
+        if previous is not None:
+            ratings.update(rating=value)
+        rating_changed.send(
+            sender=Rating, user=user, book=book, previous=previous, new=value
+        )
+    return previous
+
+
+def _insert_rating(user_id: int, book_id: int, value: float) -> bool:
+    """
+    Inserta una valoración si no existe, sin abortar la transacción si
+    otra petición la acaba de crear (`INSERT ... ON CONFLICT DO NOTHING`,
+    en PostgreSQL y SQLite).
+
+    ## Argumentos:
+    - `user_id`: ID del usuario.
+    - `book_id`: ID del libro.
+    - `value`: Valoración.
+
+    ## Retorno:
+    - `True` si se ha insertado.
+    """
+    qn = connection.ops.quote_name
+    table = qn(Rating._meta.db_table)
+    user_col, book_col, rating_col = (
+        qn(Rating._meta.get_field(name).column)
+        for name in ('user', 'book', 'rating')
+    )
+    sql = (
+        f"INSERT INTO {table} ({user_col}, {book_col}, {rating_col}) "
+        f"VALUES (%s, %s, %s) "
+        f"ON CONFLICT ({user_col}, {book_col}) DO NOTHING"
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [user_id, book_id, value])
+        return cursor.rowcount == 1
+
+
 @receiver([pre_save], sender=Rating)
 def capture_previous_rating(sender, instance: Rating, **kwargs) -> None:
     """
@@ -208,23 +639,20 @@ def capture_previous_rating(sender, instance: Rating, **kwargs) -> None:
     - `instance`: Instancia de la señal.
     - `kwargs`: Argumentos adicionales.
     """
-    global previous_rating_value
+    instance._previous_rating = None
     # Acceder a la valoración anterior
     if instance.pk:
-        previous_rating = Rating.objects.filter(
-            user=instance.user, book=instance.book
-        ).first().rating
-        # Guardar la valoración anterior
-        previous_rating_value = previous_rating
+        instance._previous_rating = Rating.objects.filter(
+            pk=instance.pk
+        ).values_list('rating', flat=True).first()
 
 
 @receiver([post_save], sender=Rating)
-def update_user_embedding_after_new_rating(
+def rating_saved(
     sender, instance: Rating, created: bool, **kwargs
 ) -> None:
     """
-    Actualiza el embedding del usuario tras añadir o
-    actualizar una valoración.
+    Envía `rating_changed` tras añadir o actualizar una valoración.
 
     ## Argumentos:
     - `sender`: Modelo que envía la señal.
@@ -232,46 +660,67 @@ def update_user_embedding_after_new_rating(
     - `created`: Indica si la señal es por una nueva creación.
     - `kwargs`: Argumentos adicionales.
     """
-    global previous_rating_value
+    previous = None if created else getattr(instance, '_previous_rating',
+                                            None)
+    rating_changed.send(
+        sender=Rating, user=instance.user, book=instance.book,
+        previous=previous, new=instance.rating
+    )
+
+
+@receiver([post_delete], sender=Rating)
+def rating_deleted(sender, instance: Rating, **kwargs) -> None:
+    """
+    Envía `rating_changed` tras eliminar una valoración.
+
+    ## Argumentos:
+    - `sender`: Modelo que envía la señal.
+    - `instance`: Instancia de la señal.
+    - `kwargs`: Argumentos adicionales.
+    """
+    rating_changed.send(
+        sender=Rating, user=instance.user, book=instance.book,
+        previous=instance.rating, new=None
+    )
+
+
+@receiver(rating_changed)
+def update_user_embedding(
+    sender, user: User, book: Book, previous: Optional[float],
+    new: Optional[float], **kwargs
+) -> None:
+    """
+    Actualiza el embedding del usuario tras un cambio en sus valoraciones.
+    El embedding es la media de los embeddings de los libros que le
+    gustan ponderada por la valoración, así que sólo cambia si la
+    valoración anterior o la nueva son positivas.
+
+    ## Argumentos:
+    - `sender`: Modelo que envía la señal.
+    - `user`: Usuario.
+    - `book`: Libro valorado.
+    - `previous`: Valoración anterior (`None` si es nueva).
+    - `new`: Valoración nueva (`None` si se ha eliminado).
+    - `kwargs`: Argumentos adicionales.
+    """
+    print(f"Cambio de valoración: {previous} -> {new}")
+    liked_before = previous is not None and previous >= LIKES
+    liked_now = new is not None and new >= LIKES
+    if not liked_before and not liked_now:
+        print("Valoraciones negativas, no se actualiza embedding")
+        return
+
     # Datos de usuario y valoración
-    user = instance.user
     new_user_embedding = user.sum_ratings * user.get_embedding()
     new_sum_ratings = user.sum_ratings
-    new_rating_value = instance.rating
-    book_embedding = instance.book.get_embedding()
-    # Caso en el que se añade una valoración por primera vez
-    if created:
-        print("Trigger para añadir valoración")
-        print(f"Nuevo rating: {new_rating_value}")
-        if new_rating_value < LIKES:
-            print("Valoración negativa, no se actualiza embedding")
-            return
-        new_sum_ratings += new_rating_value
-        new_user_embedding += new_rating_value * book_embedding
-    # Caso en el que se actualiza la valoración
-    else:
-        print("Trigger para actualizar valoración")
-        print(f"Rating anterior: {previous_rating_value}")
-        print(f"Nuevo rating: {new_rating_value}")
-        if previous_rating_value < LIKES and new_rating_value < LIKES:
-            print(
-                "Ambas valoraciones son negativas, no se actualiza embedding"
-            )
-            return
-        elif previous_rating_value < LIKES and new_rating_value >= LIKES:
-            print("Valoración anterior negativa, nueva positiva")
-            new_sum_ratings += new_rating_value
-            new_user_embedding += new_rating_value * book_embedding
-        elif previous_rating_value >= LIKES and new_rating_value < LIKES:
-            print("Valoración anterior positiva, nueva negativa")
-            new_sum_ratings -= previous_rating_value
-            new_user_embedding -= previous_rating_value * book_embedding
-        elif previous_rating_value >= LIKES and new_rating_value >= LIKES:
-            print("Ambas valoraciones son positivas")
-            new_sum_ratings -= previous_rating_value
-            new_sum_ratings += new_rating_value
-            new_user_embedding -= previous_rating_value * book_embedding
-            new_user_embedding += new_rating_value * book_embedding
+    book_embedding = book.get_embedding()
+    # Se quita la valoración anterior y se añade la nueva
+    if liked_before:
+        new_sum_ratings -= previous
+        new_user_embedding -= previous * book_embedding
+    if liked_now:
+        new_sum_ratings += new
+        new_user_embedding += new * book_embedding
 
     # Suma ponderada de las valoraciones
     if new_sum_ratings != 0.0:
@@ -280,42 +729,146 @@ def update_user_embedding_after_new_rating(
     # Se actualizan los datos del usuario
     user.sum_ratings = new_sum_ratings
     user.set_embedding(new_user_embedding)
-    user.save()
+    user.save(update_fields=['sum_ratings', 'embedding'])
 
 
-@receiver([post_delete], sender=Rating)
-def update_user_embedding_after_delete_rating(
-    sender, instance: Rating, **kwargs
+@receiver(rating_changed)
+def increment_ratings_version(sender, user: User, **kwargs) -> None:
+    """
+    Incrementa la versión de las valoraciones del usuario tras añadir,
+    actualizar o eliminar una valoración.
+
+    ## Argumentos:
+    - `sender`: Modelo que envía la señal.
+    - `user`: Usuario.
+    - `kwargs`: Argumentos adicionales.
+    """
+    User.objects.filter(id=user.id).update(
+        ratings_version=F('ratings_version') + 1
+    )
+
+
+@receiver(rating_changed)
+def update_book_stats(
+    sender, book: Book, previous: Optional[float], new: Optional[float],
+    **kwargs
 ) -> None:
     """
-    Actualiza el embedding del usuario tras eliminar una valoración.
+    Actualiza los agregados del libro tras añadir, actualizar o eliminar
+    una valoración. Los contadores se actualizan con expresiones `F` en
+    una sola consulta.
 
     ## Argumentos:
     - `sender`: Modelo que envía la señal.
-    - `instance`: Instancia de la señal.
+    - `book`: Libro valorado.
+    - `previous`: Valoración anterior (`None` si es nueva).
+    - `new`: Valoración nueva (`None` si se ha eliminado).
     - `kwargs`: Argumentos adicionales.
     """
-    print("Trigger para eliminar valoración")
-    deleted_rating_value = instance.rating
-    if deleted_rating_value < LIKES:
-        print("Valoración negativa, no se actualiza embedding")
+    now = timezone.now()
+    count = int(new is not None) - int(previous is not None)
+    total = (new or 0.0) - (previous or 0.0)
+    likes = int(new is not None and new >= LIKES) - \
+        int(previous is not None and previous >= LIKES)
+    trend = trending_exponent(now) if likes > 0 else None
+
+    fields = {
+        'rating_count': F('rating_count') + count,
+        'rating_sum': F('rating_sum') + total,
+        'like_count': F('like_count') + likes,
+    }
+    if trend is not None:
+        fields['trending'] = add_trending(trend)
+    if new is not None:
+        fields['last_rated'] = now
+    stats = BookStats.objects.filter(book_id=book.id)
+    if stats.update(**fields) or previous is not None or new is None:
         return
+    # Primera valoración del libro (si otra petición crea la fila a la
+    # vez, se repite la actualización). Si falta la fila de un libro con
+    # valoraciones, los agregados se recalculan con `rebuild_book_stats`
+    try:
+        with transaction.atomic():
+            BookStats.objects.create(
+                book_id=book.id, rating_count=count, rating_sum=total,
+                like_count=likes,
+                trending=NO_TRENDING if trend is None else trend,
+                last_rated=now
+            )
+    except IntegrityError:
+        stats.update(**fields)
 
-    # Datos de usuario y valoración
-    user = instance.user
-    new_user_embedding = user.sum_ratings * user.get_embedding()
-    new_sum_ratings = user.sum_ratings
-    book_embedding = instance.book.get_embedding()
 
-    # Recálculo de la suma de las valoraciones y del embedding
-    new_sum_ratings -= deleted_rating_value
-    new_user_embedding -= deleted_rating_value * book_embedding
+@receiver(rating_changed)
+def update_user_keywords(
+    sender, user: User, book: Book, previous: Optional[float],
+    new: Optional[float], **kwargs
+) -> None:
+    """
+    Actualiza el perfil de palabras clave del usuario cuando una
+    valoración cruza el umbral `LIKES` (en cualquier sentido) o cambia una
+    valoración positiva.
 
-    # Suma ponderada de las valoraciones
-    if new_sum_ratings != 0.0:
-        new_user_embedding /= new_sum_ratings
+    ## Argumentos:
+    - `sender`: Modelo que envía la señal.
+    - `user`: Usuario.
+    - `book`: Libro valorado.
+    - `previous`: Valoración anterior (`None` si es nueva).
+    - `new`: Valoración nueva (`None` si se ha eliminado).
+    - `kwargs`: Argumentos adicionales.
+    """
+    liked_before = previous is not None and previous >= LIKES
+    liked_now = new is not None and new >= LIKES
+    count = int(liked_now) - int(liked_before)
+    weight = (new if liked_now else 0.0) - (previous if liked_before else 0.0)
+    if count == 0 and weight == 0.0:
+        return
+    keyword_ids = list(book.keywords.values_list('id', flat=True))
+    if not keyword_ids:
+        return
+    profile = UserKeyword.objects.filter(
+        user_id=user.id, keyword_id__in=keyword_ids
+    )
+    if count > 0:
+        UserKeyword.objects.bulk_create([
+            UserKeyword(user_id=user.id, keyword_id=keyword_id)
+            for keyword_id in keyword_ids
+        ], ignore_conflicts=True)
+    profile.update(count=F('count') + count, weight=F('weight') + weight)
+    if count < 0:
+        profile.filter(count__lte=0).delete()
+
+
+@receiver([m2m_changed], sender=Book.keywords.through)
+def update_user_keywords_after_book_keywords(
+    sender, instance, action: str, reverse: bool, pk_set, **kwargs
+) -> None:
+    """
+    Recalcula el perfil de palabras clave de los usuarios a los que les
+    gustan los libros cuyas palabras clave han cambiado.
 
-    # Se actualizan los datos del usuario
-    user.sum_ratings = new_sum_ratings
-    user.set_embedding(new_user_embedding)
-    user.save()
+    ## Argumentos:
+    - `sender`: Modelo intermedio de la relación.
+    - `instance`: Libro (o palabra clave si `reverse`).
+    - `action`: Acción de la señal.
+    - `reverse`: Indica si el cambio se hace desde la palabra clave.
+    - `pk_set`: IDs de los objetos añadidos o eliminados.
+    - `kwargs`: Argumentos adicionales.
+    """
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        book_ids = [instance.pk]
+    elif pk_set is not None:
+        book_ids = list(pk_set)
+    else:
+        # Se han quitado todos los libros de una palabra clave: no se
+        # sabe cuáles eran, así que se recalculan todos los perfiles
+        rebuild_user_keywords()
+        return
+    user_ids = Rating.objects.filter(
+        book_id__in=book_ids, rating__gte=LIKES
+    ).values_list('user_id', flat=True).distinct()
+    user_ids = list(user_ids)
+    if user_ids:
+        rebuild_user_keywords(user_ids)
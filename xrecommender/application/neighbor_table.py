@@ -0,0 +1,402 @@
+import numpy as np
+from collections import defaultdict
+from sklearn.preprocessing import normalize
+from typing import Dict, List, Optional, Tuple
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F
+from django.dispatch import receiver, Signal
+from django.utils import timezone
+
+from .matrices import embedding_matrix
+from .models import (
+    User, UserNeighbor, PendingNeighborUpdate, LIKES, rating_changed
+)
+from .neighbors import exact_search
+
+BATCH_SIZE = 1024  # Usuarios por lote al construir la tabla
+PENDING_BATCH_SIZE = 256  # Usuarios de la cola por recorrido
+LOCK_ID = 0x58425253  # Bloqueo consultivo de la tabla en PostgreSQL
+
+# Señal que se envía cuando la actualización incremental reescribe listas
+# de vecinos. Argumentos: `user_ids` (usuarios cuya lista ha cambiado)
+neighbors_changed = Signal()
+
+
+def is_enabled() -> bool:
+    """
+    Indica si la tabla de vecinos está activada (`XBRECS_NEIGHBOR_TABLE`).
+
+    ## Retorno:
+    - `True` si está activada.
+    """
+    return getattr(settings, 'XBRECS_NEIGHBOR_TABLE', False)
+
+
+def table_size() -> int:
+    """
+    Vecinos por usuario de la tabla (`XBRECS_NEIGHBOR_TABLE_K`).
+
+    ## Retorno:
+    - Número de vecinos.
+    """
+    return getattr(settings, 'XBRECS_NEIGHBOR_TABLE_K', 50)
+
+
+def _user_vectors() -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Obtiene los embeddings normalizados de todos los usuarios, como los
+    recorre `recommend.k_nearest`.
+
+    ## Retorno:
+    - Tupla (IDs ordenados, matriz float32 normalizada).
+    """
+    ids, matrix = embedding_matrix(User.objects.all())
+    return ids, normalize(matrix) if len(ids) else matrix
+
+
+def _rows(
+    user_id: int, neighbor_ids: np.ndarray, sims: np.ndarray
+) -> List[UserNeighbor]:
+    """
+    Crea las filas de la lista de vecinos de un usuario.
+
+    ## Argumentos:
+    - `user_id`: ID del usuario.
+    - `neighbor_ids`: IDs de los vecinos, del más al menos próximo.
+    - `sims`: Similitudes.
+
+    ## Retorno:
+    - Filas de `UserNeighbor`.
+    """
+    return [
+        UserNeighbor(user_id=user_id, neighbor_id=neighbor_id,
+                     similarity=sim, rank=rank)
+        for rank, (neighbor_id, sim) in enumerate(
+            zip(neighbor_ids.tolist(), sims.tolist())
+        )
+    ]
+
+
+def rebuild_user_neighbors(k: Optional[int] = None) -> int:
+    """
+    Construye la tabla de vecinos de todos los usuarios con la búsqueda
+    exacta por lotes. Vacía la cola de actualizaciones marcadas antes de
+    leer los embeddings e incrementa `ratings_version` de todos los
+    usuarios (ver `invalidate_users`).
+
+    ## Argumentos:
+    - `k`: Vecinos por usuario. Por defecto, `XBRECS_NEIGHBOR_TABLE_K`.
+
+    ## Retorno:
+    - Número de filas guardadas.
+    """
+    k = table_size() if k is None else k
+    total = 0
+    with transaction.atomic():
+        _lock_table()
+        started = timezone.now()
+        ids, users = _user_vectors()
+        k = min(k, max(len(ids) - 1, 0))
+        PendingNeighborUpdate.objects.filter(marked_at__lte=started).delete()
+        UserNeighbor.objects.all().delete()
+        for start in range(0, len(ids), BATCH_SIZE):
+            rows = np.arange(start, min(start + BATCH_SIZE, len(ids)))
+            neighbors, sims = exact_search(users[rows], users, k, rows)
+            entries = [
+                entry for i, row in enumerate(rows.tolist())
+                for entry in _rows(ids[row], ids[neighbors[i]], sims[i])
+            ]
+            UserNeighbor.objects.bulk_create(entries, batch_size=1000)
+            total += len(entries)
+        # Pueden cambiar los vecinos de todos los usuarios
+        User.objects.update(ratings_version=F('ratings_version') + 1)
+    return total
+
+
+def nearest_from_table(
+    user: User, n: int
+) -> Optional[List[Tuple[User, float]]]:
+    """
+    Obtiene los `n` vecinos más próximos de un usuario de la tabla con
+    una sola consulta.
+
+    ## Argumentos:
+    - `user`: Usuario.
+    - `n`: Número de vecinos.
+
+    ## Retorno:
+    - Lista de tuplas (`User`, similitud) o `None` si la tabla no tiene
+    la lista del usuario, es más corta que `n` o el usuario tiene una
+    actualización pendiente.
+    """
+    if n > table_size():
+        return None
+    rows = list(UserNeighbor.objects.filter(
+        user=user, rank__lt=n,
+        user__pending_neighbor_update__isnull=True
+    ).select_related('neighbor').order_by('rank'))
+    if not rows:
+        return None
+    return [(row.neighbor, row.similarity) for row in rows]
+
+
+def nearest_many_from_table(
+    users: List[User], n: int
+) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+    """
+    Obtiene los `n` vecinos más próximos de un lote de usuarios de la
+    tabla con una sola consulta (como `nearest_from_table`).
+
+    ## Argumentos:
+    - `users`: Lote de usuarios.
+    - `n`: Número de vecinos.
+
+    ## Retorno:
+    - Tupla (IDs de los vecinos, similitudes), lote x n (-1 y `-inf` si
+    no hay suficientes), o `None` si la tabla es más corta que `n` o no
+    tiene la lista de algún usuario al día.
+    """
+    if n > table_size():
+        return None
+    rows = {u.id: i for i, u in enumerate(users)}
+    neighbor_ids = np.full((len(users), n), -1, dtype=np.int64)
+    sims = np.full((len(users), n), -np.inf, dtype=np.float32)
+    for user_id, neighbor_id, sim, rank in UserNeighbor.objects.filter(
+        user_id__in=list(rows), rank__lt=n,
+        user__pending_neighbor_update__isnull=True
+    ).values_list('user_id', 'neighbor_id', 'similarity', 'rank'):
+        neighbor_ids[rows[user_id], rank] = neighbor_id
+        sims[rows[user_id], rank] = sim
+    if (neighbor_ids[:, 0] < 0).any():
+        return None
+    return neighbor_ids, sims
+
+
+def _insert(
+    neighbor_ids: np.ndarray, sims: np.ndarray, positions: np.ndarray,
+    new_id: int, new_sim: float, new_position: int, k: int
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Inserta un vecino en una lista ordenada y la recorta a `k`. Los empates
+    se resuelven por fila en la matriz, como en la búsqueda exacta.
+
+    ## Argumentos:
+    - `neighbor_ids`: IDs de los vecinos de la lista.
+    - `sims`: Similitudes de la lista.
+    - `positions`: Filas de los vecinos en la matriz.
+    - `new_id`: ID del vecino a insertar.
+    - `new_sim`: Su similitud.
+    - `new_position`: Su fila en la matriz.
+    - `k`: Tamaño máximo de la lista.
+
+    ## Retorno:
+    - Tupla (IDs, similitudes) de la nueva lista.
+    """
+    neighbor_ids = np.append(neighbor_ids, new_id)
+    sims = np.append(sims, new_sim)
+    order = np.lexsort((np.append(positions, new_position), -sims))[:k]
+    return neighbor_ids[order], sims[order]
+
+
+def _update_user(
+    user_id: int, ids: np.ndarray, users: np.ndarray
+) -> List[int]:
+    """
+    Actualiza la tabla tras cambiar el embedding de un usuario: recalcula
+    su lista y lo inserta o lo quita de las listas de los demás sólo donde
+    su nueva similitud cruza el umbral (el `k`-ésimo vecino) de cada una.
+    Las listas de las que sale se rellenan con una búsqueda exacta por
+    lotes sobre la misma matriz. Debe ejecutarse dentro de la transacción
+    de `process_pending_updates`, con la tabla bloqueada.
+
+    ## Argumentos:
+    - `user_id`: ID del usuario.
+    - `ids`: IDs ordenados de todos los usuarios.
+    - `users`: Matriz normalizada de sus embeddings.
+
+    ## Retorno:
+    - IDs de los usuarios cuya lista se ha reescrito.
+    """
+    pos = int(np.searchsorted(ids, user_id))
+    if pos >= len(ids) or ids[pos] != user_id:
+        return []
+    k = min(table_size(), len(ids) - 1)
+    sims = (users[pos:pos + 1] @ users.T)[0]
+
+    # Primera y última fila de cada lista: quién tiene lista y su umbral
+    has_list = np.zeros(len(ids), dtype=bool)
+    thresholds = np.full(len(ids), -np.inf, dtype=np.float32)
+    for holder, rank, sim in UserNeighbor.objects.filter(
+        rank__in=[0, k - 1]
+    ).values_list('user_id', 'rank', 'similarity'):
+        row = np.searchsorted(ids, holder)
+        if row < len(ids) and ids[row] == holder:
+            has_list[row] = True
+            if rank == k - 1:
+                thresholds[row] = sim
+    holders = np.searchsorted(ids, list(UserNeighbor.objects.filter(
+        neighbor_id=user_id
+    ).values_list('user_id', flat=True)))
+    is_holder = np.zeros(len(ids), dtype=bool)
+    is_holder[holders[holders < len(ids)]] = True
+    entering = has_list & ~is_holder & (sims > thresholds)
+    entering[pos] = False
+    affected = np.flatnonzero(entering | is_holder)
+
+    lists: Dict[int, List[Tuple[int, float]]] = defaultdict(list)
+    for holder, neighbor_id, sim in UserNeighbor.objects.filter(
+        user_id__in=ids[affected].tolist()
+    ).order_by('user_id', 'rank').values_list(
+        'user_id', 'neighbor_id', 'similarity'
+    ):
+        lists[holder].append((neighbor_id, sim))
+
+    entries: List[UserNeighbor] = []
+    refill: List[int] = []
+    for row in affected.tolist():
+        holder = int(ids[row])
+        current = [(n, s) for n, s in lists[holder] if n != user_id]
+        neighbor_ids = np.array([n for n, _ in current], dtype=np.int64)
+        neighbor_sims = np.array([s for _, s in current], dtype=np.float32)
+        # Los que no están en una lista llena tienen como mucho su umbral:
+        # si baja de él, el nuevo k-ésimo puede ser cualquiera de ellos
+        if is_holder[row] and len(lists[holder]) >= k and \
+                sims[row] < thresholds[row]:
+            refill.append(row)
+            continue
+        neighbor_ids, neighbor_sims = _insert(
+            neighbor_ids, neighbor_sims, np.searchsorted(ids, neighbor_ids),
+            user_id, sims[row], pos, k
+        )
+        entries += _rows(holder, neighbor_ids, neighbor_sims)
+    rows = np.array([pos] + refill, dtype=np.int64)
+    neighbors, neighbor_sims = exact_search(users[rows], users, k, rows)
+    for i, row in enumerate(rows.tolist()):
+        entries += _rows(int(ids[row]), ids[neighbors[i]], neighbor_sims[i])
+
+    changed = [user_id] + ids[affected].tolist()
+    UserNeighbor.objects.filter(user_id__in=changed).delete()
+    UserNeighbor.objects.bulk_create(entries, batch_size=1000)
+    return changed
+
+
+def _lock_table() -> None:
+    """
+    Serializa las escrituras de la tabla hasta el final de la transacción
+    actual, para que dos actualizaciones no pierdan las listas que
+    reescribe la otra. En PostgreSQL con un bloqueo consultivo; en SQLite
+    la propia escritura bloquea la base de datos.
+    """
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_advisory_xact_lock(%s)', [LOCK_ID])
+
+
+def invalidate_users(user_ids: List[int]) -> None:
+    """
+    Incrementa `ratings_version` de usuarios cuyas recomendaciones cambian
+    sin que cambien sus propias valoraciones (han cambiado sus vecinos o
+    las valoraciones positivas de estos). Así cambia el ETag de la API y
+    dejan de servirse sus listas guardadas.
+
+    ## Argumentos:
+    - `user_ids`: IDs de los usuarios.
+    """
+    if user_ids:
+        User.objects.filter(id__in=user_ids).update(
+            ratings_version=F('ratings_version') + 1
+        )
+
+
+def mark_pending(user_ids: List[int]) -> None:
+    """
+    Encola usuarios cuyo embedding ha cambiado. Si ya estaban, se
+    actualiza la fecha de la marca.
+
+    ## Argumentos:
+    - `user_ids`: IDs de los usuarios.
+    """
+    now = timezone.now()
+    PendingNeighborUpdate.objects.bulk_create(
+        [PendingNeighborUpdate(user_id=user_id, marked_at=now)
+         for user_id in user_ids],
+        update_conflicts=True, unique_fields=['user'],
+        update_fields=['marked_at']
+    )
+
+
+def process_pending_updates(batch_size: int = PENDING_BATCH_SIZE) -> Dict:
+    """
+    Aplica a la tabla las actualizaciones de un lote de usuarios de la
+    cola con un solo recorrido de los embeddings, dentro de una
+    transacción con la tabla bloqueada. Los usuarios que se vuelven a
+    marcar mientras tanto siguen en la cola. Invalida a los usuarios con
+    la lista reescrita (`invalidate_users`) y, al terminar, envía
+    `neighbors_changed` con ellos.
+
+    ## Argumentos:
+    - `batch_size`: Usuarios por lote.
+
+    ## Retorno:
+    - Diccionario con los usuarios procesados (`users`), las listas
+    reescritas (`lists`) y la cola que queda (`pending`).
+    """
+    marks = dict(PendingNeighborUpdate.objects.order_by(
+        'marked_at', 'user_id'
+    ).values_list('user_id', 'marked_at')[:batch_size])
+    if not marks:
+        return {'users': 0, 'lists': 0, 'pending': 0}
+    changed = set()
+    with transaction.atomic():
+        _lock_table()
+        ids, users = _user_vectors()
+        for user_id in marks:
+            changed.update(_update_user(user_id, ids, users))
+        current = dict(PendingNeighborUpdate.objects.filter(
+            user_id__in=list(marks)
+        ).values_list('user_id', 'marked_at'))
+        PendingNeighborUpdate.objects.filter(user_id__in=[
+            user_id for user_id, marked_at in marks.items()
+            if current.get(user_id) == marked_at
+        ]).delete()
+        invalidate_users(sorted(changed))
+    if changed:
+        neighbors_changed.send(sender=UserNeighbor, user_ids=sorted(changed))
+    return {
+        'users': len(marks), 'lists': len(changed),
+        'pending': PendingNeighborUpdate.objects.count(),
+    }
+
+
+@receiver(rating_changed)
+def update_neighbors_after_rating(
+    sender, user: User, previous: Optional[float], new: Optional[float],
+    **kwargs
+) -> None:
+    """
+    Encola al usuario cuando una valoración cambia su embedding (si la
+    anterior o la nueva son positivas), sin recorrer los embeddings en la
+    petición: la tabla se actualiza en `process_pending_updates`. Además
+    invalida a los usuarios que lo tienen como vecino, cuyas predicciones
+    usan sus valoraciones positivas.
+
+    ## Argumentos:
+    - `sender`: Modelo que envía la señal.
+    - `user`: Usuario.
+    - `previous`: Valoración anterior (`None` si es nueva).
+    - `new`: Valoración nueva (`None` si se ha eliminado).
+    - `kwargs`: Argumentos adicionales.
+    """
+    if not is_enabled():
+        return
+    liked_before = previous is not None and previous >= LIKES
+    liked_now = new is not None and new >= LIKES
+    if liked_before or liked_now:
+        # Las predicciones de quienes lo tienen como vecino usan sus
+        # valoraciones positivas
+        User.objects.filter(id__in=UserNeighbor.objects.filter(
+            neighbor_id=user.id
+        ).values('user_id')).update(ratings_version=F('ratings_version') + 1)
+        mark_pending([user.id])
@@ -0,0 +1,441 @@
+import os
+import threading
+import numpy as np
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, Optional, Tuple
+
+from django.conf import settings
+
+from .matrices import top_n_indices, normalize_rows
+
+EXACT = 'exact'
+QUANTIZED = 'quantized'
+PCA = 'pca'
+MODES = [EXACT, QUANTIZED, PCA]
+USERS = 'users'
+BOOKS = 'books'
+INT8 = 'int8'
+FLOAT16 = 'float16'
+QUANTIZATIONS = [INT8, FLOAT16]
+DEFAULT_CANDIDATES = 300  # Candidatos que se reordenan con float32
+BLOCK_SIZE = 4096  # Filas que se recorren a la vez
+
+# Hilos de la búsqueda exacta por bloques (uno por proceso y número de
+# hilos: los hilos no sobreviven a un fork)
+_executors: Dict[Tuple[int, int], ThreadPoolExecutor] = dict()
+_executors_lock = threading.Lock()
+
+
+def quantize(
+    matrix: np.ndarray, dtype: str = INT8
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Cuantiza una matriz de embeddings normalizados.
+
+    En int8 cada fila se escala por separado (simétrico, [-127, 127]);
+    en float16 la escala es siempre 1.
+
+    ## Argumentos:
+    - `matrix`: Embeddings normalizados (float32).
+    - `dtype`: Tipo de la cuantización (`'int8'` o `'float16'`).
+
+    ## Retorno:
+    - Tupla (matriz cuantizada, escala float32 de cada fila).
+    """
+    if dtype == FLOAT16:
+        return (matrix.astype(np.float16),
+                np.ones(len(matrix), dtype=np.float32))
+    if dtype != INT8:
+        raise ValueError(f"Cuantización desconocida: {dtype}")
+    scale = np.abs(matrix).max(axis=1) / 127 if matrix.size \
+        else np.zeros(len(matrix))
+    scale = np.where(scale > 0, scale, 1).astype(np.float32)
+    quantized = np.rint(matrix / scale[:, None]).astype(np.int8)
+    return quantized, scale
+
+
+def quantized_scores(
+    quantized: np.ndarray, scale: np.ndarray, vectors: np.ndarray
+) -> np.ndarray:
+    """
+    Calcula las similitudes aproximadas entre unos vectores y una matriz
+    cuantizada. La matriz se convierte a float32 por bloques para acotar
+    la memoria y aprovechar BLAS.
+
+    ## Argumentos:
+    - `quantized`: Matriz cuantizada (filas x dimensión).
+    - `scale`: Escala de cada fila.
+    - `vectors`: Vectores normalizados (lote x dimensión).
+
+    ## Retorno:
+    - Similitudes aproximadas (lote x filas).
+    """
+    scores = np.empty((len(vectors), len(quantized)), dtype=np.float32)
+    for start in range(0, len(quantized), BLOCK_SIZE):
+        block = np.asarray(
+            quantized[start:start + BLOCK_SIZE], dtype=np.float32
+        )
+        scores[:, start:start + len(block)] = (vectors @ block.T) * \
+            scale[start:start + len(block)]
+    return scores
+
+
+def fit_pca(
+    books: np.ndarray, dim: int
+) -> Tuple[np.ndarray, np.ndarray, float]:
+    """
+    Ajusta una proyección PCA (SVD) sobre los embeddings de los libros.
+
+    ## Argumentos:
+    - `books`: Embeddings normalizados de los libros.
+    - `dim`: Dimensión reducida.
+
+    ## Retorno:
+    - Tupla (media, componentes dim x dimensión original, proporción de
+    varianza explicada).
+    """
+    books = np.asarray(books, dtype=np.float32)
+    mean = books.mean(axis=0)
+    _, singular, components = np.linalg.svd(
+        books - mean, full_matrices=False
+    )
+    dim = min(dim, len(components))
+    variance = singular ** 2
+    explained = float(variance[:dim].sum() / variance.sum()) \
+        if variance.sum() > 0 else 1.0
+    return mean, components[:dim].astype(np.float32), explained
+
+
+def project(
+    matrix: np.ndarray, mean: np.ndarray, components: np.ndarray
+) -> np.ndarray:
+    """
+    Proyecta unos embeddings en el espacio reducido y normaliza las filas
+    (la similitud en ese espacio también es el coseno).
+
+    ## Argumentos:
+    - `matrix`: Embeddings (filas x dimensión original).
+    - `mean`: Media de la proyección.
+    - `components`: Componentes de la proyección.
+
+    ## Retorno:
+    - Embeddings reducidos y normalizados (float32).
+    """
+    return normalize_rows(
+        (np.asarray(matrix, dtype=np.float32) - mean) @ components.T
+    )
+
+
+def rerank(
+    exact: np.ndarray,
+    vectors: np.ndarray,
+    candidates: np.ndarray,
+    k: int
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Reordena unos candidatos con la similitud exacta en float32.
+
+    ## Argumentos:
+    - `exact`: Matriz float32 normalizada (puede estar en mmap: sólo se
+    leen las filas de los candidatos).
+    - `vectors`: Vectores normalizados (lote x dimensión).
+    - `candidates`: Filas candidatas de cada vector (lote x candidatos,
+    -1 si no hay).
+    - `k`: Número de vecinos.
+
+    ## Retorno:
+    - Tupla (filas de los vecinos, similitudes exactas), lote x k.
+    """
+    valid = candidates >= 0
+    rows = np.where(valid, candidates, 0)
+    sims = np.einsum(
+        'bcd,bd->bc', np.asarray(exact[rows.ravel()]).reshape(
+            rows.shape + (exact.shape[1],)
+        ), vectors
+    )
+    sims = np.where(valid, sims, -np.inf).astype(np.float32)
+    best = top_n_indices(sims, k)
+    return (np.take_along_axis(candidates, best, axis=1),
+            np.take_along_axis(sims, best, axis=1))
+
+
+def search_threads() -> int:
+    """
+    Hilos configurados para la búsqueda exacta por bloques
+    (`XBRECS_NEIGHBOR_THREADS`).
+
+    ## Retorno:
+    - Número de hilos (al menos 1).
+    """
+    return max(1, getattr(settings, 'XBRECS_NEIGHBOR_THREADS', 1))
+
+
+def _executor(threads: int) -> ThreadPoolExecutor:
+    """
+    Obtiene el pool de hilos del proceso actual. Si el proceso viene de
+    un fork, crea uno nuevo.
+
+    ## Argumentos:
+    - `threads`: Número de hilos.
+
+    ## Retorno:
+    - Pool de hilos.
+    """
+    key = (os.getpid(), threads)
+    with _executors_lock:
+        if key not in _executors:
+            _executors[key] = ThreadPoolExecutor(
+                threads, thread_name_prefix='neighbors'
+            )
+        return _executors[key]
+
+
+def block_top_k(
+    sims: np.ndarray, k: int, offset: int
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Obtiene los `k` mejores de cada fila de un bloque de similitudes.
+    Ante empates en el límite se quedan los de menor posición, como en
+    una ordenación estable de todo el conjunto.
+
+    ## Argumentos:
+    - `sims`: Similitudes del lote con las filas del bloque.
+    - `k`: Número de vecinos.
+    - `offset`: Posición de la primera fila del bloque.
+
+    ## Retorno:
+    - Tupla (posiciones globales, similitudes), lote x min(k, bloque),
+    sin ordenar.
+    """
+    k = min(k, sims.shape[1])
+    if k < sims.shape[1]:
+        best = np.argpartition(-sims, k - 1, axis=1)[:, :k]
+        # argpartition elige cualquiera de los empatados en el límite
+        kth = np.take_along_axis(sims, best, axis=1).min(axis=1)
+        for row in np.flatnonzero(
+            np.count_nonzero(sims >= kth[:, None], axis=1) > k
+        ):
+            best[row] = np.argsort(-sims[row], kind='stable')[:k]
+    else:
+        best = np.tile(np.arange(k), (sims.shape[0], 1))
+    return best + offset, np.take_along_axis(sims, best, axis=1)
+
+
+def merge_top_k(
+    positions: np.ndarray, sims: np.ndarray, k: int
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Ordena unos candidatos de mayor a menor similitud (y de menor a mayor
+    posición ante empates) y se queda con los `k` primeros.
+
+    ## Argumentos:
+    - `positions`: Posiciones de los candidatos (lote x candidatos).
+    - `sims`: Similitudes de los candidatos.
+    - `k`: Número de vecinos.
+
+    ## Retorno:
+    - Tupla (posiciones, similitudes), lote x min(k, candidatos).
+    """
+    order = np.lexsort((positions, -sims), axis=1)[:, :k]
+    return (np.take_along_axis(positions, order, axis=1),
+            np.take_along_axis(sims, order, axis=1))
+
+
+def blocked_search(
+    vectors: np.ndarray,
+    blocks: Iterable[np.ndarray],
+    k: int,
+    exclude: np.ndarray,
+    threads: Optional[int] = None
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Busca de forma exacta los `k` vecinos más próximos recorriendo los
+    candidatos por bloques. Los bloques se reparten entre varios hilos
+    (BLAS libera el GIL) y cada uno se reduce a sus `k` mejores antes de
+    combinarlo con el resultado acumulado, así que la memoria depende del
+    tamaño del bloque y no del número de candidatos.
+
+    ## Argumentos:
+    - `vectors`: Vectores normalizados (lote x dimensión).
+    - `blocks`: Bloques consecutivos de candidatos normalizados (puede ser
+    un generador: sólo se leen unos pocos bloques por delante).
+    - `k`: Número de vecinos.
+    - `exclude`: Posición global de cada vector entre los candidatos (no
+    es vecino de sí mismo) o -1.
+    - `threads`: Número de hilos. Por defecto, `XBRECS_NEIGHBOR_THREADS`.
+
+    ## Retorno:
+    - Tupla (posiciones de los vecinos, similitudes), lote x
+    min(k, candidatos), ordenadas de mayor a menor similitud.
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    threads = threads or search_threads()
+
+    def score(block: np.ndarray, offset: int):
+        sims = vectors @ np.asarray(block, dtype=np.float32).T
+        local = exclude - offset
+        rows = np.flatnonzero((local >= 0) & (local < len(block)))
+        sims[rows, local[rows]] = -np.inf
+        return block_top_k(sims, k, offset)
+
+    best = (np.zeros((len(vectors), 0), dtype=np.int64),
+            np.zeros((len(vectors), 0), dtype=np.float32))
+
+    def merge(result) -> None:
+        nonlocal best
+        best = merge_top_k(np.hstack([best[0], result[0]]),
+                           np.hstack([best[1], result[1]]), k)
+
+    offset = 0
+    if threads == 1:
+        for block in blocks:
+            merge(score(block, offset))
+            offset += len(block)
+        return best
+
+    executor = _executor(threads)
+    pending = deque()
+    for block in blocks:
+        pending.append(executor.submit(score, block, offset))
+        offset += len(block)
+        # Como mucho dos bloques por hilo en memoria a la vez
+        if len(pending) >= 2 * threads:
+            merge(pending.popleft().result())
+    while pending:
+        merge(pending.popleft().result())
+    return best
+
+
+def exact_search(
+    vectors: np.ndarray,
+    matrix: np.ndarray,
+    k: int,
+    exclude: np.ndarray,
+    threads: Optional[int] = None
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Búsqueda exacta por bloques en una matriz normalizada (puede estar en
+    mmap).
+
+    ## Argumentos:
+    - `vectors`: Vectores normalizados (lote x dimensión).
+    - `matrix`: Candidatos normalizados.
+    - `k`: Número de vecinos.
+    - `exclude`: Fila de cada vector en la matriz o -1.
+    - `threads`: Número de hilos. Por defecto, `XBRECS_NEIGHBOR_THREADS`.
+
+    ## Retorno:
+    - Tupla (filas de los vecinos, similitudes), ordenadas de mayor a
+    menor similitud.
+    """
+    blocks = (matrix[start:start + BLOCK_SIZE]
+              for start in range(0, len(matrix), BLOCK_SIZE))
+    return blocked_search(vectors, blocks, k, exclude, threads)
+
+
+def search_mode() -> str:
+    """
+    Modo de búsqueda de vecinos configurado (`XBRECS_NEIGHBOR_SEARCH`).
+
+    ## Retorno:
+    - `'exact'`, `'quantized'` o `'pca'`.
+    """
+    return getattr(settings, 'XBRECS_NEIGHBOR_SEARCH', EXACT)
+
+
+def candidate_scores(
+    snapshot, vectors: np.ndarray, mode: str, kind: str
+) -> Optional[np.ndarray]:
+    """
+    Calcula las similitudes aproximadas con las que se eligen los
+    candidatos.
+
+    ## Argumentos:
+    - `snapshot`: Snapshot del modelo.
+    - `vectors`: Vectores normalizados (lote x dimensión).
+    - `mode`: Modo de búsqueda.
+    - `kind`: Matriz en la que se busca (`'users'` o `'books'`).
+
+    ## Retorno:
+    - Similitudes aproximadas o `None` si el snapshot no tiene la matriz
+    que necesita el modo (la búsqueda será exacta).
+    """
+    if mode == QUANTIZED and kind == USERS and snapshot.users_q is not None:
+        return quantized_scores(snapshot.users_q, snapshot.users_scale,
+                                vectors)
+    reduced = getattr(snapshot, f"{kind}_pca", None)
+    if mode == PCA and reduced is not None:
+        projected = project(
+            vectors, snapshot.pca_mean, snapshot.pca_components
+        )
+        return projected @ np.asarray(reduced).T
+    return None
+
+
+def search(
+    snapshot,
+    vectors: np.ndarray,
+    k: int,
+    exclude: np.ndarray,
+    mode: Optional[str] = None,
+    candidates: Optional[int] = None,
+    kind: str = USERS
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Busca los `k` usuarios (o libros) más próximos en un snapshot. En los
+    modos aproximados, los candidatos se obtienen con la matriz cuantizada
+    o proyectada con PCA y se reordenan con la similitud exacta; si el
+    snapshot no tiene esa matriz, la búsqueda es exacta.
+
+    ## Argumentos:
+    - `snapshot`: Snapshot del modelo.
+    - `vectors`: Vectores normalizados (lote x dimensión).
+    - `k`: Número de vecinos.
+    - `exclude`: Fila de cada vector en la matriz (no es vecino de sí
+    mismo) o -1.
+    - `mode`: Modo de búsqueda. Por defecto, el configurado.
+    - `candidates`: Candidatos que se reordenan. Por defecto,
+    `XBRECS_NEIGHBOR_CANDIDATES`.
+    - `kind`: Matriz en la que se busca (`'users'` o `'books'`).
+
+    ## Retorno:
+    - Tupla (filas de los vecinos, similitudes), lote x k, ordenadas de
+    mayor a menor similitud.
+    """
+    mode = mode or search_mode()
+    vectors = np.asarray(vectors, dtype=np.float32)
+    exact = getattr(snapshot, kind)
+    scores = candidate_scores(snapshot, vectors, mode, kind)
+    if scores is None:
+        return exact_search(vectors, exact, k, exclude)
+
+    candidates = max(candidates or getattr(
+        settings, 'XBRECS_NEIGHBOR_CANDIDATES', DEFAULT_CANDIDATES
+    ), k)
+    rows = np.flatnonzero(exclude >= 0)
+    scores[rows, exclude[rows]] = -np.inf
+    best = top_n_indices(scores, candidates)
+    best = np.where(
+        np.isfinite(np.take_along_axis(scores, best, axis=1)), best, -1
+    )
+    return rerank(exact, vectors, best, k)
+
+
+def recall(exact: np.ndarray, approximate: np.ndarray) -> float:
+    """
+    Proporción de los vecinos exactos que encuentra la búsqueda
+    aproximada.
+
+    ## Argumentos:
+    - `exact`: Filas de los vecinos exactos (lote x k).
+    - `approximate`: Filas de los vecinos aproximados (lote x k).
+
+    ## Retorno:
+    - Recall medio.
+    """
+    if not exact.size:
+        return 1.0
+    hits = [len(np.intersect1d(e[e >= 0], a[a >= 0]))
+            for e, a in zip(exact, approximate)]
+    return float(np.sum(hits) / np.count_nonzero(exact >= 0))
@@ -0,0 +1,201 @@
+from typing import Dict, List, Optional, Tuple
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F, Count, Sum, Q, QuerySet, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import (
+    Book, BookStats, Rating, User, LIKES, trending_exponent
+)
+
+POPULAR = 'popular'  # Más valoraciones positivas
+TRENDING = 'trending'  # Más actividad reciente
+TOP_RATED = 'rating'  # Mejor valoración media (suavizada)
+TITLE = 'title'
+SORT_LABELS = {
+    POPULAR: 'Populares',
+    TRENDING: 'Tendencia',
+    TOP_RATED: 'Mejor valorados',
+    TITLE: 'Título',
+}
+LIST_SIZE = 100  # Libros de cada lista precalculada
+CACHE_PREFIX = 'xbrecs:popularity:'
+CACHE_TIMEOUT = 300  # Segundos hasta recalcular las listas
+# Media suavizada: cada libro parte de PRIOR_COUNT valoraciones ficticias
+# de valor PRIOR_MEAN, para que no dominen los libros con una sola
+PRIOR_COUNT = 5
+PRIOR_MEAN = 0.5
+# Perfil con poca señal: la suma de sus valoraciones positivas no llega a
+# la de dos libros que le gustan
+MIN_PROFILE_SUM = 2 * LIKES
+
+
+def sorted_books(sort: str, queryset: Optional[QuerySet] = None) -> QuerySet:
+    """
+    Ordena los libros con los agregados de `BookStats`, sin agrupar las
+    valoraciones.
+
+    ## Argumentos:
+    - `sort`: Criterio (`'popular'`, `'trending'`, `'rating'` o `'title'`).
+    - `queryset`: Libros a ordenar. Por defecto, todos.
+
+    ## Retorno:
+    - Libros ordenados (los que no tienen valoraciones, al final).
+    """
+    books = Book.objects.all() if queryset is None else queryset
+    if sort == TITLE:
+        return books.order_by('title', 'id')
+    if sort == TOP_RATED:
+        books = books.annotate(score=(
+            F('stats__rating_sum') + PRIOR_COUNT * PRIOR_MEAN
+        ) / (F('stats__rating_count') + PRIOR_COUNT))
+    elif sort == TRENDING:
+        books = books.annotate(score=F('stats__trending'))
+    else:
+        books = books.annotate(score=F('stats__like_count'))
+    return books.order_by(
+        F('score').desc(nulls_last=True),
+        F('stats__like_count').desc(nulls_last=True), 'id'
+    )
+
+
+def _list_score(sort: str, stats: Optional[BookStats]) -> float:
+    """
+    Puntuación de un libro en una lista precalculada.
+
+    ## Argumentos:
+    - `sort`: Criterio de la lista.
+    - `stats`: Agregados del libro.
+
+    ## Retorno:
+    - Valoraciones positivas, media suavizada o actividad reciente (en
+    valoraciones positivas equivalentes a las de ahora).
+    """
+    if stats is None:
+        return 0.0
+    if sort == TOP_RATED:
+        return (stats.rating_sum + PRIOR_COUNT * PRIOR_MEAN) / \
+            (stats.rating_count + PRIOR_COUNT)
+    if sort == TRENDING:
+        return 2.0 ** (stats.trending - trending_exponent(timezone.now()))
+    return float(stats.like_count)
+
+
+def build_popularity_list(sort: str = POPULAR) -> List[Tuple[Book, float]]:
+    """
+    Calcula una lista de libros populares con una sola consulta sobre los
+    agregados.
+
+    ## Argumentos:
+    - `sort`: Criterio de la lista.
+
+    ## Retorno:
+    - Lista de tuplas (`Book`, puntuación) de como mucho `LIST_SIZE`
+    libros.
+    """
+    books = sorted_books(sort).select_related('stats')[:LIST_SIZE]
+    return [
+        (book, _list_score(sort, getattr(book, 'stats', None)))
+        for book in books
+    ]
+
+
+def popularity_list(sort: str = POPULAR) -> List[Tuple[Book, float]]:
+    """
+    Obtiene una lista de libros populares de la caché (se recalcula como
+    mucho cada `CACHE_TIMEOUT` segundos).
+
+    ## Argumentos:
+    - `sort`: Criterio de la lista.
+
+    ## Retorno:
+    - Lista de tuplas (`Book`, puntuación).
+    """
+    key = CACHE_PREFIX + sort
+    books = cache.get(key)
+    if books is None:
+        books = build_popularity_list(sort)
+        cache.set(key, books, CACHE_TIMEOUT)
+    return books
+
+
+def refresh_popularity() -> Dict[str, int]:
+    """
+    Recalcula y guarda en la caché todas las listas de libros populares.
+
+    ## Retorno:
+    - Número de libros de cada lista.
+    """
+    sizes = dict()
+    for sort in (POPULAR, TRENDING, TOP_RATED):
+        books = build_popularity_list(sort)
+        cache.set(CACHE_PREFIX + sort, books, CACHE_TIMEOUT)
+        sizes[sort] = len(books)
+    return sizes
+
+
+def is_cold_start(user: User) -> bool:
+    """
+    Indica si el perfil de un usuario tiene muy poca señal para buscar
+    vecinos (usuario nuevo con el embedding a cero o casi sin valoraciones
+    positivas). No hace ninguna consulta.
+
+    ## Argumentos:
+    - `user`: Usuario.
+
+    ## Retorno:
+    - `True` si el perfil no tiene señal suficiente.
+    """
+    return user.sum_ratings < MIN_PROFILE_SUM
+
+
+def cold_start_books(
+    user: User, k: int, sort: str = POPULAR
+) -> List[Tuple[Book, float]]:
+    """
+    Recomienda los libros populares que el usuario no ha valorado.
+
+    ## Argumentos:
+    - `user`: Usuario.
+    - `k`: Número de libros.
+    - `sort`: Criterio de la lista.
+
+    ## Retorno:
+    - Lista de tuplas (`Book`, puntuación) con los `k` libros.
+    """
+    rated = set(
+        Rating.objects.filter(user=user).values_list('book_id', flat=True)
+    )
+    return [
+        (book, score) for book, score in popularity_list(sort)
+        if book.id not in rated
+    ][:k]
+
+
+def rebuild_book_stats() -> int:
+    """
+    Recalcula los agregados de todos los libros a partir de las
+    valoraciones (tras cargas masivas que no disparan las señales). Las
+    valoraciones no tienen fecha, así que la actividad reciente empieza
+    de cero.
+
+    ## Retorno:
+    - Número de libros con agregados.
+    """
+    # En una transacción para que las vistas no vean la tabla vacía ni a
+    # medio cargar
+    with transaction.atomic():
+        rows = list(Book.objects.annotate(
+            n=Count('rating'),
+            total=Coalesce(Sum('rating__rating'), Value(0.0)),
+            likes=Count('rating', filter=Q(rating__rating__gte=LIKES)),
+        ).values_list('id', 'n', 'total', 'likes'))
+        BookStats.objects.all().delete()
+        BookStats.objects.bulk_create([
+            BookStats(book_id=pk, rating_count=n, rating_sum=total,
+                      like_count=likes)
+            for pk, n, total, likes in rows
+        ], batch_size=1000)
+    return BookStats.objects.count()
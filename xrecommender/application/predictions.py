@@ -0,0 +1,478 @@
+import multiprocessing
+import os
+import numpy as np
+from scipy.sparse import csr_matrix
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from django.db import connections
+
+from .matrices import (
+    user_matrix, book_matrix, normalize_rows, rating_matrix, likes_matrix,
+    top_n_indices, nearest_neighbors
+)
+from .models import LIKES
+from .recommend import neighbor_scores
+
+CF = 'cf'  # Usuario-usuario (vecinos más próximos)
+CB = 'cb'  # Usuario-libro (contenido)
+II = 'ii'  # Libro-libro
+DEFAULT_TOP = 50
+DEFAULT_BATCH_SIZE = 256
+SEMANTIC_WEIGHT = 100  # Peso (%) del contenido semántico en el nombre
+
+
+class PredictionData:
+    """
+    Matrices necesarias para calcular predicciones por lotes: embeddings
+    normalizados de usuarios y libros y valoraciones.
+    """
+
+    def __init__(
+        self,
+        user_ids: np.ndarray,
+        users: np.ndarray,
+        book_ids: np.ndarray,
+        books: np.ndarray,
+        ratings: csr_matrix
+    ) -> None:
+        self.user_ids = user_ids
+        self.users = normalize_rows(users)
+        self.book_ids = book_ids
+        self.books = normalize_rows(books)
+        self.ratings = ratings
+        self.likes = likes_matrix(ratings, LIKES)
+        self._likes = {LIKES: self.likes}
+
+    @classmethod
+    def from_database(cls) -> 'PredictionData':
+        """
+        Carga las matrices de la base de datos (usuarios con alguna
+        valoración y todos los libros).
+
+        ## Retorno:
+        - Datos para las predicciones.
+        """
+        user_ids, users = user_matrix()
+        book_ids, books = book_matrix()
+        return cls(
+            user_ids, users, book_ids, books,
+            rating_matrix(user_ids, book_ids)
+        )
+
+    def likes_at(self, threshold: float) -> csr_matrix:
+        """
+        Obtiene las valoraciones positivas para un umbral (se guardan para
+        no recalcularlas en cada lote).
+
+        ## Argumentos:
+        - `threshold`: Umbral de valoración positiva.
+
+        ## Retorno:
+        - Matriz de valoraciones positivas.
+        """
+        if threshold not in self._likes:
+            self._likes[threshold] = likes_matrix(self.ratings, threshold)
+        return self._likes[threshold]
+
+    def rated_mask(self, rows: np.ndarray, matrix: csr_matrix) -> np.ndarray:
+        """
+        Obtiene la máscara de libros presentes en una matriz de
+        valoraciones para un lote de usuarios.
+
+        ## Argumentos:
+        - `rows`: Posiciones de los usuarios del lote.
+        - `matrix`: Valoraciones o valoraciones positivas.
+
+        ## Retorno:
+        - Máscara booleana lote x libros.
+        """
+        return matrix[rows].toarray() != 0
+
+
+def score_cf(
+    data: PredictionData, rows: np.ndarray, neighbors: int
+) -> np.ndarray:
+    """
+    Puntuaciones usuario-usuario: suma de las valoraciones positivas de
+    los `neighbors` usuarios más próximos por la similitud, sin los libros
+    que ya ha valorado el usuario.
+
+    ## Argumentos:
+    - `data`: Datos para las predicciones.
+    - `rows`: Posiciones de los usuarios del lote.
+    - `neighbors`: Número de vecinos.
+
+    ## Retorno:
+    - Puntuaciones lote x libros (`-inf` en los libros descartados).
+    """
+    nearest, sims = nearest_neighbors(
+        data.users[rows], data.users, neighbors, rows
+    )
+    scores, support = neighbor_scores(nearest, sims, data.likes)
+    scores[~support | data.rated_mask(rows, data.ratings)] = -np.inf
+    return scores
+
+
+def score_cb(
+    data: PredictionData, rows: np.ndarray, neighbors: int
+) -> np.ndarray:
+    """
+    Puntuaciones usuario-libro: similitud coseno entre el perfil del
+    usuario y cada libro, sin los libros que le gustaron.
+
+    ## Argumentos:
+    - `data`: Datos para las predicciones.
+    - `rows`: Posiciones de los usuarios del lote.
+    - `neighbors`: Sin uso (el motor no tiene vecinos).
+
+    ## Retorno:
+    - Puntuaciones lote x libros (`-inf` en los libros descartados).
+    """
+    scores = data.users[rows] @ data.books.T
+    scores[data.rated_mask(rows, data.likes)] = -np.inf
+    return scores
+
+
+def score_ii(
+    data: PredictionData, rows: np.ndarray, neighbors: int
+) -> np.ndarray:
+    """
+    Puntuaciones libro-libro: suma de las similitudes de cada libro con
+    los libros que le gustaron al usuario, ponderadas por su valoración,
+    sin los libros que le gustaron. Como la similitud es un producto
+    escalar, la suma se calcula sin construir la matriz libro-libro.
+
+    ## Argumentos:
+    - `data`: Datos para las predicciones.
+    - `rows`: Posiciones de los usuarios del lote.
+    - `neighbors`: Sin uso (el motor no tiene vecinos).
+
+    ## Retorno:
+    - Puntuaciones lote x libros (`-inf` en los libros descartados).
+    """
+    likes = data.likes[rows]
+    scores = np.asarray(likes @ data.books) @ data.books.T
+    scores[likes.toarray() != 0] = -np.inf
+    scores[likes.getnnz(axis=1) == 0] = -np.inf
+    return scores
+
+
+ENGINES: Dict[str, Callable[[PredictionData, np.ndarray, int], np.ndarray]] = {
+    CF: score_cf,
+    CB: score_cb,
+    II: score_ii,
+}
+
+
+def prediction_filename(engine: str, neighbors: int = 0) -> str:
+    """
+    Nombre del fichero de predicciones que espera la configuración de
+    Elliot (`predictions_{motor}_{peso semántico}_{vecinos}.tsv`).
+
+    ## Argumentos:
+    - `engine`: Motor de recomendación.
+    - `neighbors`: Número de vecinos (0 si el motor no tiene).
+
+    ## Retorno:
+    - Nombre del fichero.
+    """
+    return f"predictions_{engine}_{SEMANTIC_WEIGHT}_{neighbors}.tsv"
+
+
+def format_predictions(
+    data: PredictionData, rows: np.ndarray, scores: np.ndarray, top: int
+) -> str:
+    """
+    Formatea las `top` mejores predicciones de un lote de usuarios.
+
+    ## Argumentos:
+    - `data`: Datos para las predicciones.
+    - `rows`: Posiciones de los usuarios del lote.
+    - `scores`: Puntuaciones lote x libros (`-inf` en los descartados).
+    - `top`: Número de predicciones por usuario.
+
+    ## Retorno:
+    - Líneas TSV (usuario, libro, predicción) del lote.
+    """
+    best = top_n_indices(scores, top)
+    values = np.take_along_axis(scores, best, axis=1)
+    lines = []
+    for row, books, preds in zip(rows, best, values):
+        user_id = data.user_ids[row]
+        lines.extend(
+            f"{user_id}\t{data.book_ids[b]}\t{p:.6f}\n"
+            for b, p in zip(books, preds) if np.isfinite(p)
+        )
+    return ''.join(lines)
+
+
+def predict_batch(
+    data: PredictionData, rows: np.ndarray, engine: str, neighbors: int,
+    top: int
+) -> str:
+    """
+    Calcula las `top` predicciones de un lote de usuarios.
+
+    ## Argumentos:
+    - `data`: Datos para las predicciones.
+    - `rows`: Posiciones de los usuarios del lote.
+    - `engine`: Motor de recomendación.
+    - `neighbors`: Número de vecinos.
+    - `top`: Número de predicciones por usuario.
+
+    ## Retorno:
+    - Líneas TSV (usuario, libro, predicción) del lote.
+    """
+    scores = ENGINES[engine](data, rows, neighbors)
+    return format_predictions(data, rows, scores, top)
+
+
+def sweep_batch(
+    data: PredictionData,
+    rows: np.ndarray,
+    ks: List[int],
+    thresholds: List[float],
+    top: int
+) -> Dict[Tuple[float, int], str]:
+    """
+    Calcula las predicciones usuario-usuario de un lote para varios
+    números de vecinos y umbrales de valoración positiva. Las similitudes
+    se calculan una sola vez: se obtienen los max(ks) vecinos ordenados y
+    las puntuaciones de cada k se acumulan sobre las del k anterior con
+    los vecinos que añade.
+
+    ## Argumentos:
+    - `data`: Datos para las predicciones.
+    - `rows`: Posiciones de los usuarios del lote.
+    - `ks`: Números de vecinos, en orden creciente.
+    - `thresholds`: Umbrales de valoración positiva.
+    - `top`: Número de predicciones por usuario.
+
+    ## Retorno:
+    - Diccionario (umbral, k) -> líneas TSV del lote.
+    """
+    nearest, sims = nearest_neighbors(
+        data.users[rows], data.users, ks[-1], rows
+    )
+    rated = data.rated_mask(rows, data.ratings)
+    blocks = dict()
+    for threshold in thresholds:
+        likes = data.likes_at(threshold)
+        scores = np.zeros((len(rows), len(data.book_ids)), dtype=np.float32)
+        support = np.zeros(scores.shape, dtype=bool)
+        previous = 0
+        for k in ks:
+            added, added_support = neighbor_scores(
+                nearest[:, previous:k], sims[:, previous:k], likes
+            )
+            scores += added
+            support |= added_support
+            previous = k
+            blocks[(threshold, k)] = format_predictions(
+                data, rows, np.where(support & ~rated, scores, -np.inf), top
+            )
+    return blocks
+
+
+# Datos compartidos con los procesos del pool (se heredan con fork)
+_data: Optional[PredictionData] = None
+
+
+def _run_chunk(args: Tuple[Callable, int, int, tuple]):
+    """Ejecuta una función sobre un lote de usuarios en el pool."""
+    fn, start, end, fn_args = args
+    return fn(_data, np.arange(start, end), *fn_args)
+
+
+def map_batches(
+    data: PredictionData,
+    fn: Callable,
+    fn_args: tuple,
+    workers: int = 1,
+    batch_size: int = DEFAULT_BATCH_SIZE
+) -> Iterator:
+    """
+    Aplica una función a todos los usuarios por lotes, en orden de
+    usuario. Con varios procesos, los lotes se reparten en un pool que
+    hereda las matrices por fork (sin copiarlas ni serializarlas).
+
+    ## Argumentos:
+    - `data`: Datos para las predicciones.
+    - `fn`: Función de módulo `fn(data, rows, *fn_args)`.
+    - `fn_args`: Argumentos adicionales de la función.
+    - `workers`: Número de procesos.
+    - `batch_size`: Usuarios por lote.
+
+    ## Retorno:
+    - Iterador con el resultado de cada lote.
+    """
+    global _data
+    chunks = [
+        (fn, start, min(start + batch_size, len(data.user_ids)), fn_args)
+        for start in range(0, len(data.user_ids), batch_size)
+    ]
+    if workers <= 1 or len(chunks) <= 1 or \
+            'fork' not in multiprocessing.get_all_start_methods():
+        _data = data
+        try:
+            yield from map(_run_chunk, chunks)
+        finally:
+            _data = None
+        return
+
+    # Las conexiones abiertas no deben compartirse con los procesos hijos
+    connections.close_all()
+    _data = data
+    try:
+        with multiprocessing.get_context('fork').Pool(workers) as pool:
+            yield from pool.imap(_run_chunk, chunks)
+    finally:
+        _data = None
+
+
+def iter_predictions(
+    data: PredictionData,
+    engine: str,
+    neighbors: int = 0,
+    top: int = DEFAULT_TOP,
+    workers: int = 1,
+    batch_size: int = DEFAULT_BATCH_SIZE
+) -> Iterator[str]:
+    """
+    Genera las predicciones de todos los usuarios por lotes.
+
+    ## Argumentos:
+    - `data`: Datos para las predicciones.
+    - `engine`: Motor de recomendación.
+    - `neighbors`: Número de vecinos (motor usuario-usuario).
+    - `top`: Número de predicciones por usuario.
+    - `workers`: Número de procesos.
+    - `batch_size`: Usuarios por lote.
+
+    ## Retorno:
+    - Iterador de bloques de líneas TSV, uno por lote.
+    """
+    if engine not in ENGINES:
+        raise ValueError(f"Motor desconocido: {engine}")
+    return map_batches(
+        data, predict_batch, (engine, neighbors, top), workers, batch_size
+    )
+
+
+def export_predictions(
+    path: str,
+    engine: str,
+    neighbors: int = 0,
+    top: int = DEFAULT_TOP,
+    workers: int = 1,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    data: Optional[PredictionData] = None
+) -> int:
+    """
+    Escribe las predicciones de todos los usuarios en un fichero TSV sin
+    cabecera (usuario, libro, predicción), el formato que lee el
+    `ProxyRecommender` de Elliot. Las líneas se escriben lote a lote.
+
+    ## Argumentos:
+    - `path`: Ruta del fichero o directorio (en ese caso se usa
+    `prediction_filename`).
+    - `engine`: Motor de recomendación.
+    - `neighbors`: Número de vecinos (motor usuario-usuario).
+    - `top`: Número de predicciones por usuario.
+    - `workers`: Número de procesos.
+    - `batch_size`: Usuarios por lote.
+    - `data`: Datos para las predicciones. Por defecto se cargan de la
+    base de datos.
+
+    ## Retorno:
+    - Número de líneas escritas.
+    """
+    if data is None:
+        data = PredictionData.from_database()
+    if os.path.isdir(path):
+        path = os.path.join(path, prediction_filename(engine, neighbors))
+    tmp_path = path + '.tmp'
+    lines = 0
+    with open(tmp_path, 'w') as f:
+        for block in iter_predictions(
+            data, engine, neighbors, top, workers, batch_size
+        ):
+            f.write(block)
+            lines += block.count('\n')
+    os.replace(tmp_path, path)
+    return lines
+
+
+def sweep_predictions(
+    output: str,
+    ks: List[int],
+    thresholds: Iterable[float] = (LIKES,),
+    top: int = DEFAULT_TOP,
+    workers: int = 1,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    data: Optional[PredictionData] = None
+) -> Dict[Tuple[float, int], str]:
+    """
+    Genera los ficheros de predicciones usuario-usuario de un barrido de
+    números de vecinos y umbrales de valoración positiva en una sola
+    pasada (ver `sweep_batch`). Cada umbral distinto de `LIKES` se escribe
+    en su propia carpeta (`likes_{umbral}`, ver `sweep_folder`).
+
+    ## Argumentos:
+    - `output`: Carpeta de salida.
+    - `ks`: Números de vecinos.
+    - `thresholds`: Umbrales de valoración positiva.
+    - `top`: Número de predicciones por usuario.
+    - `workers`: Número de procesos.
+    - `batch_size`: Usuarios por lote.
+    - `data`: Datos para las predicciones. Por defecto se cargan de la
+    base de datos.
+
+    ## Retorno:
+    - Diccionario (umbral, k) -> ruta del fichero de predicciones.
+    """
+    if data is None:
+        data = PredictionData.from_database()
+    ks = sorted(set(ks))
+    thresholds = sorted(set(thresholds))
+    for threshold in thresholds:
+        # Se calculan antes del fork para que los procesos las hereden
+        data.likes_at(threshold)
+
+    paths = dict()
+    for threshold in thresholds:
+        folder = sweep_folder(output, threshold)
+        os.makedirs(folder, exist_ok=True)
+        for k in ks:
+            paths[(threshold, k)] = os.path.join(
+                folder, prediction_filename(CF, k)
+            )
+    files = {key: open(path + '.tmp', 'w') for key, path in paths.items()}
+    try:
+        for blocks in map_batches(
+            data, sweep_batch, (ks, thresholds, top), workers, batch_size
+        ):
+            for key, block in blocks.items():
+                files[key].write(block)
+    finally:
+        for f in files.values():
+            f.close()
+    for path in paths.values():
+        os.replace(path + '.tmp', path)
+    return paths
+
+
+def sweep_folder(output: str, threshold: float) -> str:
+    """
+    Carpeta de los resultados de un umbral de valoración positiva.
+
+    ## Argumentos:
+    - `output`: Carpeta de salida del barrido.
+    - `threshold`: Umbral de valoración positiva.
+
+    ## Retorno:
+    - `output` para `LIKES` o `output/likes_{umbral}` para el resto.
+    """
+    if threshold == LIKES:
+        return output
+    return os.path.join(output, f"likes_{threshold:g}")
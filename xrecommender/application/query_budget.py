@@ -0,0 +1,159 @@
+import logging
+import os
+import traceback
+from collections import Counter
+from typing import Callable, List, Optional
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+OFF = 'off'
+WARN = 'warn'
+RAISE = 'raise'
+STACK_LIMIT = 12  # Marcos de la pila que se muestran
+TOP_STATEMENTS = 3  # Consultas más repetidas que se muestran
+
+
+class QueryBudgetExceeded(Exception):
+    """Excepción lanzada cuando una vista supera su presupuesto."""
+
+
+def query_budget(max_queries: int) -> Callable:
+    """
+    Decorador que declara el número máximo de consultas a la base de datos
+    de una vista basada en función. Las vistas basadas en clase lo declaran
+    con el atributo `query_budget`.
+
+    ## Argumentos:
+    - `max_queries`: Número máximo de consultas de la petición completa
+    (incluidas las de sesión y autenticación).
+
+    ## Retorno:
+    - Decorador.
+    """
+    def decorator(view: Callable) -> Callable:
+        view.query_budget = max_queries
+        return view
+    return decorator
+
+
+def get_view_budget(view: Callable) -> Optional[int]:
+    """
+    Obtiene el presupuesto de consultas declarado para una vista.
+
+    ## Argumentos:
+    - `view`: Vista (función o resultado de `as_view()`).
+
+    ## Retorno:
+    - Presupuesto o `None` si la vista no lo declara.
+    """
+    budget = getattr(view, 'query_budget', None)
+    if budget is None:
+        budget = getattr(getattr(view, 'view_class', None),
+                         'query_budget', None)
+    return budget
+
+
+def _project_stack() -> List[str]:
+    """
+    Obtiene la pila de llamadas actual restringida al código del proyecto.
+
+    ## Retorno:
+    - Líneas formateadas de la pila, de la más externa a la más interna.
+    """
+    base_dir = str(settings.BASE_DIR)
+    frames = [
+        frame for frame in traceback.extract_stack()[:-2]
+        if frame.filename.startswith(base_dir) and
+        'site-packages' not in frame.filename and
+        not frame.filename.endswith(os.path.join('application',
+                                                 'query_budget.py'))
+    ]
+    return traceback.format_list(frames[-STACK_LIMIT:])
+
+
+class QueryCounter:
+    """
+    Envoltorio de ejecución de consultas que las cuenta y, al superar el
+    presupuesto, guarda la pila de la primera consulta que lo excede.
+    """
+
+    def __init__(self, budget: Optional[int] = None) -> None:
+        self.budget = budget
+        self.count = 0
+        self.statements: Counter = Counter()
+        self.offending_stack: Optional[List[str]] = None
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        self.statements[sql] += 1
+        if self.budget is not None and self.count == self.budget + 1:
+            self.offending_stack = _project_stack()
+        return execute(sql, params, many, context)
+
+    @property
+    def exceeded(self) -> bool:
+        """Indica si se ha superado el presupuesto."""
+        return self.budget is not None and self.count > self.budget
+
+    def report(self, name: str) -> str:
+        """
+        Genera el informe de un presupuesto superado.
+
+        ## Argumentos:
+        - `name`: Nombre de la vista.
+
+        ## Retorno:
+        - Texto con las consultas más repetidas y la pila de la primera
+        consulta fuera de presupuesto.
+        """
+        lines = [
+            f"{name}: {self.count} consultas (presupuesto {self.budget})",
+            "Consultas más repetidas:",
+        ]
+        lines += [
+            f"  {n} x {sql[:200]}"
+            for sql, n in self.statements.most_common(TOP_STATEMENTS)
+        ]
+        if self.offending_stack:
+            lines.append("Primera consulta fuera de presupuesto:")
+            lines += [line.rstrip() for line in self.offending_stack]
+        return "\n".join(lines)
+
+
+class QueryBudgetMiddleware:
+    """
+    Middleware que comprueba el presupuesto de consultas de cada vista.
+
+    Con `XBRECS_QUERY_BUDGET = 'warn'` escribe un aviso en el log con las
+    consultas más repetidas y la pila de la primera consulta que excede el
+    presupuesto; con `'raise'` (pensado para pruebas) lanza
+    `QueryBudgetExceeded`. Con `'off'` Django lo descarta al arrancar.
+    """
+
+    def __init__(self, get_response) -> None:
+        self.mode = getattr(settings, 'XBRECS_QUERY_BUDGET', OFF)
+        if self.mode == OFF:
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+
+    def __call__(self, request):
+        counter = QueryCounter()
+        request.query_counter = counter
+        with connections['default'].execute_wrapper(counter):
+            response = self.get_response(request)
+        if counter.exceeded:
+            match = request.resolver_match
+            report = counter.report(match.view_name if match else
+                                    request.path)
+            if self.mode == RAISE:
+                raise QueryBudgetExceeded(report)
+            logger.warning(report)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        """Fija el presupuesto de la vista resuelta para la petición."""
+        request.query_counter.budget = get_view_budget(view_func)
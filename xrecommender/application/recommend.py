@@ -1,12 +1,29 @@
 import numpy as np
-from sklearn.metrics.pairwise import cosine_similarity
-from typing import Dict, List, Tuple
+from scipy.sparse import csr_matrix
+from sklearn.preprocessing import normalize
+from typing import Dict, List, Optional, Sequence, Tuple
 
+from . import neighbor_table, refresh
+from .matrices import iter_embedding_blocks, ratings_to_csr, top_n_indices
 from .models import User, Book, Rating, LIKES
+from .neighbors import BLOCK_SIZE, blocked_search, search
+from .popularity import is_cold_start, cold_start_books
+from .singleflight import coalesce
+from .snapshot import get_snapshot
+from .timing import timed
+
+BATCH_SIZE = 256  # Usuarios por lote en `recommend_books_many`
+CONTRIBUTORS = 3  # Vecinos que más aportan guardados por libro
+
+# Procedencia de la predicción de cada libro recomendado: ID del libro ->
+# (número de vecinos que lo valoran positivamente, lista de tuplas (ID del
+# vecino, similitud, similitud x valoración) de los que más aportan)
+Provenance = Dict[int, Tuple[int, List[Tuple[int, float, float]]]]
 
 # TODO: Función k_nearest más general con Union[User, Book]
 
 
+@timed('neighbors')
 def k_nearest(user: User, k: int) -> List[Tuple[User, float]]:
     """
     Calcula los k usuarios más próximos a un usuario.
@@ -20,23 +37,78 @@ def k_nearest(user: User, k: int) -> List[Tuple[User, float]]:
     - k tuplas (`User`, similitud) con los `k` usuarios más próximos
     al usuario.
     """
-    # Embedding del usuario
-    user_embedding = user.get_embedding().reshape(1, -1)
-    # Obtenemos todos los usuarios menos el usuario actual
+    # Con la tabla de vecinos activada, se leen de ella con una consulta
+    if neighbor_table.is_enabled():
+        nearest = neighbor_table.nearest_from_table(user, k)
+        if nearest is not None:
+            return nearest
+    # Si hay un snapshot activo, los vecinos se buscan en sus matrices
+    snapshot = get_snapshot()
+    if snapshot is not None:
+        return _k_nearest_snapshot(user, k, snapshot)
+
+    # Embedding del usuario (normalizado como en `cosine_similarity`)
+    user_embedding = normalize(
+        user.get_embedding().reshape(1, -1).astype(np.float32)
+    )
+    # Recorremos los demás usuarios por bloques: cada bloque se normaliza
+    # y se reduce a sus k mejores, así que no se cargan todos en memoria
     users = User.objects.exclude(id=user.id)
-    users_embeddings = np.array([u.get_embedding() for u in users])
-    # Similitudes (coseno) entre el usuario y todos los demás
-    similarities = cosine_similarity(
-        user_embedding, users_embeddings
-    ).flatten()
-    users_sim = list(zip(users, similarities))
-    # Obtenemos los k vecinos más próximos
-    users_sim.sort(key=lambda x: x[1], reverse=True)
-    return users_sim[:k]
+    ids: List[np.ndarray] = []
+
+    def blocks():
+        for block_ids, block in iter_embedding_blocks(users, BLOCK_SIZE):
+            ids.append(block_ids)
+            yield normalize(block)
 
+    positions, sims = blocked_search(
+        user_embedding, blocks(), k, np.array([-1])
+    )
+    # Los empates se resuelven por orden en el queryset, como al ordenar
+    # de forma estable la lista completa
+    nearest_ids = np.concatenate(ids)[positions[0]] if ids else []
+    nearest = User.objects.in_bulk([int(i) for i in nearest_ids])
+    return [
+        (nearest[i], s) for i, s in zip(nearest_ids, sims[0])
+    ]
 
+
+def _k_nearest_snapshot(
+    user: User, k: int, snapshot
+) -> List[Tuple[User, float]]:
+    """
+    Calcula los k usuarios más próximos a un usuario con las matrices del
+    snapshot activo. Si el embedding del usuario no ha cambiado desde que
+    se generó, se leen de su tabla de vecinos precalculada; si no, se
+    buscan con el embedding actual entre los del snapshot (los usuarios
+    posteriores no son candidatos hasta la siguiente generación).
+
+    ## Parámetros:
+    - `user`: Objeto `User` del usuario.
+    - `k`: Número de vecinos más próximos que queremos obtener.
+    - `snapshot`: Snapshot activo.
+
+    ## Retorna:
+    - k tuplas (`User`, similitud) con los `k` usuarios más próximos
+    al usuario.
+    """
+    embedding = user.get_embedding()
+    position = np.array([snapshot.user_position(user.id)])
+    vector = normalize(embedding.reshape(1, -1).astype(np.float32))
+    if snapshot.table_rows(position, vector, k)[0]:
+        ids, sims = snapshot.neighbor_table(user.id, k)
+    else:
+        ids, sims = snapshot.nearest_users(embedding, k, user.id)
+    users = User.objects.in_bulk([int(i) for i in ids])
+    return [
+        (users[i], float(s)) for i, s in zip(ids, sims) if i in users
+    ]
+
+
+@timed('scoring')
 def top_k_books(
-    user: User, nearest_users_sim: List[Tuple[User, float]], k: int
+    user: User, nearest_users_sim: List[Tuple[User, float]], k: int,
+    provenance: Optional[Provenance] = None
 ) -> List[Tuple[Book, float]]:
     """
     Obtiene los libros mejor valorados por los usuarios más próximos
@@ -47,19 +119,32 @@ def top_k_books(
     - `nearest_users_sim`: Lista de tuplas (`User`, similitud) con los usuarios
     más próximos al usuario.
     - `k`: Número de libros que queremos obtener.
+    - `provenance`: Si se indica, se rellena con los vecinos que más
+    aportan a la predicción de cada libro devuelto (ver `Provenance`), con
+    las valoraciones ya leídas y sin más consultas.
 
     ## Retorna:
     - Lista de tuplas (`Book`, predicción) con los `k` libros con mejor
     valoración por los usuarios más próximos.
     """
+    # Con un snapshot activo, las valoraciones de los vecinos se leen de su
+    # matriz dispersa (las del momento en que se generó)
+    snapshot = get_snapshot()
+    if snapshot is not None:
+        top_books = _top_k_books_snapshot(
+            user, nearest_users_sim, k, snapshot, provenance
+        )
+        if top_books is not None:
+            return top_books
+
     # Obtenemos los k usuarios más próximos y sus similitudes
     nearest_users = [u for u, _ in nearest_users_sim]
-    nearest_sims = [s for _, s in nearest_users_sim]
+    nearest_sims = {u.id: s for u, s in nearest_users_sim}
 
     # Obtenemos los ratings positivos de los k usuarios más próximos
     nearest_ratings = Rating.objects.filter(
         user__in=nearest_users
-    ).filter(rating__gte=LIKES)
+    ).filter(rating__gte=LIKES).select_related('book')
 
     # Obtenemos los ratings de libros que no ha valorado el usuario
     user_ratings = Rating.objects.filter(user=user)
@@ -70,21 +155,100 @@ def top_k_books(
     # Calculamos la predicción de los libros, que será la suma agregada
     # de las valoraciones multiplicadas por la similitud entre usuarios
     book_pred: Dict[Book, float] = dict()
+    contributions: Dict[int, List[Tuple[int, float, float]]] = dict()
     for rating in not_read_nearest_ratings:
         book = rating.book
         if book not in book_pred:
             book_pred[book] = 0.0
-        book_pred[book] += rating.rating * \
-            nearest_sims[nearest_users.index(rating.user)]
+        sim = nearest_sims[rating.user_id]
+        book_pred[book] += rating.rating * sim
+        if provenance is not None:
+            contributions.setdefault(book.id, []).append(
+                (rating.user_id, sim, rating.rating * sim)
+            )
 
     # Obtenemos los k libros mejor valorados
     top_books = list(book_pred.items())
     top_books.sort(key=lambda x: x[1], reverse=True)
-    return top_books[:k]
+    top_books = top_books[:k]
+    if provenance is not None:
+        for book, _ in top_books:
+            entries = contributions[book.id]
+            entries.sort(key=lambda c: c[2], reverse=True)
+            provenance[book.id] = (len(entries), entries[:CONTRIBUTORS])
+    return top_books
+
+
+def _top_k_books_snapshot(
+    user: User, nearest_users_sim: List[Tuple[User, float]], k: int,
+    snapshot, provenance: Optional[Provenance] = None
+) -> Optional[List[Tuple[Book, float]]]:
+    """
+    Obtiene los libros mejor valorados por los usuarios más próximos con
+    las valoraciones positivas de la matriz dispersa del snapshot activo
+    (como `top_k_books`). Solo se consultan en la base de datos los libros
+    que ha valorado el usuario y los libros devueltos.
+
+    ## Parámetros:
+    - `user`: Objeto `User` del usuario.
+    - `nearest_users_sim`: Lista de tuplas (`User`, similitud) con los
+    usuarios más próximos al usuario.
+    - `k`: Número de libros que queremos obtener.
+    - `snapshot`: Snapshot activo.
+    - `provenance`: Como en `top_k_books`.
+
+    ## Retorna:
+    - Lista de tuplas (`Book`, predicción), o `None` si algún vecino no
+    está en el snapshot.
+    """
+    if not nearest_users_sim:
+        return []
+    ids = np.array([u.id for u, _ in nearest_users_sim], dtype=np.int64)
+    sims = np.array(
+        [[s for _, s in nearest_users_sim]], dtype=np.float64
+    )
+    likes = snapshot.liked_rows(ids)
+    if likes is None:
+        return None
+
+    scores, support = neighbor_scores(
+        np.arange(len(ids)).reshape(1, -1), sims, likes
+    )
+    scores, support = scores[0], support[0]
+    book_ids = np.asarray(snapshot.book_ids)
+    rated = np.array(list(Rating.objects.filter(
+        user=user
+    ).values_list('book_id', flat=True)), dtype=np.int64)
+    columns = np.minimum(
+        np.searchsorted(book_ids, rated), max(len(book_ids) - 1, 0)
+    )
+    own = columns[book_ids[columns] == rated] if len(book_ids) else columns
+    support[own] = False
+    scores[~support] = -np.inf
+
+    best = top_n_indices(scores.reshape(1, -1), k)[0]
+    best = best[np.isfinite(scores[best])]
+    books = Book.objects.in_bulk(book_ids[best].tolist())
+    best = best[[int(book_ids[j]) in books for j in best]]
+    if provenance is not None:
+        ratings = likes[:, best].toarray()
+        for column, j in enumerate(best):
+            contributors = np.flatnonzero(ratings[:, column])
+            entries = [
+                (int(ids[i]), float(sims[0, i]),
+                 float(ratings[i, column] * sims[0, i]))
+                for i in contributors
+            ]
+            entries.sort(key=lambda c: c[2], reverse=True)
+            provenance[int(book_ids[j])] = (
+                len(entries), entries[:CONTRIBUTORS]
+            )
+    return [(books[int(book_ids[j])], float(scores[j])) for j in best]
 
 
 def recommend_books(
-    user: User, n: int = 35, k: int = 5
+    user: User, n: int = 35, k: int = 5,
+    provenance: Optional[Provenance] = None
 ) -> List[Tuple[Book, float]]:
     """
     Recomienda libros a un usuario basándose en los `k` libros mejor valorados
@@ -95,10 +259,267 @@ def recommend_books(
     - `n`: Número de usuarios más próximos para los que se obtendrán
     los libros mejor valorados. Por defecto su valor es 35.
     - `k`: Número de libros que queremos obtener. Por defecto su valor es 5.
+    - `provenance`: Si se indica, se rellena con los vecinos que más
+    aportan a cada libro (ver `top_k_books`). Queda vacío para los libros
+    populares.
 
     ## Retorna:
     - Lista de tuplas (`Book`, predicción) con los `k` libros que
-    se recomiendan al usuario.
+    se recomiendan al usuario. Si el perfil del usuario no tiene señal
+    suficiente, los libros populares que no ha valorado.
+    """
+    # Lista guardada por el recálculo en segundo plano, si está al día
+    # (no guarda la procedencia)
+    if refresh.is_enabled() and provenance is None:
+        stored = refresh.stored_recommendations(user, n, k)
+        if stored is not None:
+            return stored
+    # Las peticiones simultáneas para el mismo usuario (varias pestañas,
+    # reintentos) esperan a un único cálculo y comparten su resultado
+    snapshot = get_snapshot()
+    generation = snapshot.generation if snapshot is not None else 'db'
+    explain = provenance is not None
+    key = (f"rec:{user.id}:{user.ratings_version}:{generation}:{n}:{k}:"
+           f"{int(explain)}")
+    recs, sources = coalesce(
+        key, lambda: _recommend_books(user, n, k, explain)
+    )
+    if explain:
+        provenance.update(sources)
+    return list(recs)
+
+
+def _recommend_books(
+    user: User, n: int, k: int, explain: bool = False
+) -> Tuple[List[Tuple[Book, float]], Provenance]:
+    """
+    Calcula las recomendaciones de un usuario (ver `recommend_books`).
+
+    ## Parámetros:
+    - `user`: Usuario.
+    - `n`: Número de usuarios más próximos.
+    - `k`: Número de libros.
+    - `explain`: Indica si se guarda la procedencia de las predicciones.
+
+    ## Retorna:
+    - Tupla (lista de tuplas (`Book`, predicción), procedencia).
     """
+    provenance: Provenance = dict()
+    if is_cold_start(user):
+        return cold_start_books(user, k), provenance
     # Obtenemos los k libros mejor valorados por los n usuarios más próximos
-    return top_k_books(user, k_nearest(user, n), k)
+    return top_k_books(
+        user, k_nearest(user, n), k, provenance if explain else None
+    ), provenance
+
+
+def recommend_books_many(
+    users: Sequence[User], n: int = 35, k: int = 5,
+    batch_size: int = BATCH_SIZE
+) -> List[List[Tuple[Book, float]]]:
+    """
+    Recomienda libros a varios usuarios a la vez, como `recommend_books`
+    pero por lotes: las similitudes de cada lote con todos los usuarios se
+    calculan con un producto de matrices y las predicciones con un
+    producto disperso, con unas pocas consultas por lote.
+
+    ## Parámetros:
+    - `users`: Usuarios a los que queremos recomendar libros.
+    - `n`: Número de usuarios más próximos. Por defecto su valor es 35.
+    - `k`: Número de libros por usuario. Por defecto su valor es 5.
+    - `batch_size`: Usuarios por lote.
+
+    ## Retorna:
+    - Lista con los `k` libros recomendados (tuplas (`Book`, predicción))
+    de cada usuario, en el mismo orden que `users`. Los usuarios sin señal
+    suficiente reciben los libros populares, como en `recommend_books`.
+    """
+    users = list(users)
+    recs: Dict[int, List[Tuple[Book, float]]] = {
+        i: cold_start_books(u, k)
+        for i, u in enumerate(users) if is_cold_start(u)
+    }
+    positions = [i for i in range(len(users)) if i not in recs]
+    for start in range(0, len(positions), batch_size):
+        rows = positions[start:start + batch_size]
+        batch = [users[i] for i in rows]
+        neighbor_ids, neighbor_sims = _nearest_many(batch, n)
+        recs.update(zip(rows, _top_k_books_many(
+            batch, neighbor_ids, neighbor_sims, k
+        )))
+    return [recs[i] for i in range(len(users))]
+
+
+def _nearest_many(
+    users: List[User], n: int
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Calcula los `n` usuarios más próximos de un lote de usuarios (en el
+    snapshot activo o en la base de datos, como `k_nearest`).
+
+    ## Parámetros:
+    - `users`: Lote de usuarios.
+    - `n`: Número de vecinos.
+
+    ## Retorna:
+    - Tupla (IDs de los vecinos, similitudes), lote x n, ordenadas de
+    mayor a menor similitud (-1 y `-inf` si no hay suficientes).
+    """
+    # Con la tabla de vecinos activada, se leen de ella como en k_nearest
+    if neighbor_table.is_enabled():
+        nearest = neighbor_table.nearest_many_from_table(users, n)
+        if nearest is not None:
+            return nearest
+
+    vectors = normalize(np.vstack(
+        [u.get_embedding() for u in users]
+    ).astype(np.float32))
+
+    snapshot = get_snapshot()
+    if snapshot is not None:
+        exclude = np.array([snapshot.user_position(u.id) for u in users])
+        # Los usuarios sin cambios desde el snapshot leen su tabla de
+        # vecinos; el resto se buscan con el embedding actual
+        table = snapshot.table_rows(exclude, vectors, n)
+        positions = np.zeros((len(users), n), dtype=np.int64)
+        sims = np.full((len(users), n), -np.inf, dtype=np.float32)
+        if table.any():
+            positions[table] = snapshot.neighbors[exclude[table], :n]
+            sims[table] = snapshot.neighbor_sims[exclude[table], :n]
+        if not table.all():
+            found, found_sims = search(
+                snapshot, vectors[~table], n, exclude[~table]
+            )
+            width = found.shape[1]
+            positions[~table, :width] = found
+            sims[~table, :width] = found_sims
+        ids = snapshot.user_ids
+    else:
+        # Se busca un vecino más y se descarta el propio usuario, porque
+        # su posición en el queryset no se conoce hasta recorrerlo
+        blocks_ids: List[np.ndarray] = []
+
+        def blocks():
+            for block_ids, block in iter_embedding_blocks(
+                User.objects.all(), BLOCK_SIZE
+            ):
+                blocks_ids.append(block_ids)
+                yield normalize(block)
+
+        positions, sims = blocked_search(
+            vectors, blocks(), n + 1, np.full(len(users), -1)
+        )
+        ids = np.concatenate(blocks_ids) if blocks_ids \
+            else np.zeros(0, dtype=np.int64)
+        own = ids[positions] == np.array([[u.id] for u in users])
+        sims = np.where(own, -np.inf, sims)
+        # El propio usuario pasa al final (orden estable del resto)
+        order = np.argsort(own, axis=1, kind='stable')[:, :n]
+        positions = np.take_along_axis(positions, order, axis=1)
+        sims = np.take_along_axis(sims, order, axis=1)
+
+    neighbor_ids = np.where(np.isfinite(sims), ids[positions], -1)
+    return neighbor_ids, sims
+
+
+def _top_k_books_many(
+    users: List[User],
+    neighbor_ids: np.ndarray,
+    neighbor_sims: np.ndarray,
+    k: int
+) -> List[List[Tuple[Book, float]]]:
+    """
+    Obtiene los `k` libros mejor valorados por los vecinos de un lote de
+    usuarios (como `top_k_books`).
+
+    ## Parámetros:
+    - `users`: Lote de usuarios.
+    - `neighbor_ids`: IDs de los vecinos de cada usuario (-1 si no hay).
+    - `neighbor_sims`: Similitud con cada vecino.
+    - `k`: Número de libros por usuario.
+
+    ## Retorna:
+    - Lista con los `k` libros (tuplas (`Book`, predicción)) de cada
+    usuario.
+    """
+    # Valoraciones positivas de los vecinos: de la matriz dispersa del
+    # snapshot activo si están todos en él, o de la base de datos
+    neighbors = np.unique(neighbor_ids[neighbor_ids >= 0])
+    snapshot = get_snapshot()
+    likes = snapshot.liked_rows(neighbors) if snapshot is not None \
+        else None
+    if likes is not None:
+        book_ids = np.asarray(snapshot.book_ids)
+    else:
+        liked = np.array(list(Rating.objects.filter(
+            user_id__in=neighbors.tolist(), rating__gte=LIKES
+        ).values_list('user_id', 'book_id', 'rating')),
+            dtype=np.float64).reshape(-1, 3)
+        book_ids = np.unique(liked[:, 1].astype(np.int64))
+        likes = ratings_to_csr(
+            liked[:, 0].astype(np.int64), liked[:, 1].astype(np.int64),
+            liked[:, 2], neighbors, book_ids
+        )
+    # Valoraciones del lote
+    batch_ids = np.array([u.id for u in users], dtype=np.int64)
+    rated = np.array(list(Rating.objects.filter(
+        user_id__in=batch_ids.tolist()
+    ).values_list('user_id', 'book_id')), dtype=np.int64).reshape(-1, 2)
+    rows = np.searchsorted(neighbors, np.maximum(neighbor_ids, 0))
+    rows = np.minimum(rows, max(len(neighbors) - 1, 0))
+    scores, support = neighbor_scores(rows, neighbor_sims, likes)
+    unique_ids, batch_rows = np.unique(batch_ids, return_inverse=True)
+    own = ratings_to_csr(
+        rated[:, 0], rated[:, 1], np.ones(len(rated)), unique_ids, book_ids
+    )[batch_rows].toarray() != 0
+    scores[~support | own] = -np.inf
+
+    best = top_n_indices(scores, k)
+    books = Book.objects.in_bulk(book_ids[best].ravel().tolist())
+    return [
+        [(books[int(book_ids[j])], float(scores[i, j]))
+         for j in best[i]
+         if np.isfinite(scores[i, j]) and int(book_ids[j]) in books]
+        for i in range(len(users))
+    ]
+
+
+# Primitivas vectorizadas: operan sobre lotes de usuarios representados
+# como matrices (ver `matrices.py`) en lugar de objetos del ORM.
+
+
+def neighbor_scores(
+    neighbors: np.ndarray, neighbor_sims: np.ndarray, likes: csr_matrix
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Calcula la predicción de cada libro para un lote de usuarios como la
+    suma de las valoraciones positivas de sus vecinos multiplicadas por
+    la similitud (como `top_k_books`).
+
+    ## Parámetros:
+    - `neighbors`: Índices de los vecinos de cada usuario del lote.
+    - `neighbor_sims`: Similitud con cada vecino.
+    - `likes`: Valoraciones positivas (usuarios x libros).
+
+    ## Retorna:
+    - Tupla (predicciones, máscara de libros valorados positivamente por
+    algún vecino), ambas de tamaño lote x libros.
+    """
+    batch, n = neighbors.shape
+    rows = np.repeat(np.arange(batch), n)
+    valid = np.isfinite(neighbor_sims).ravel()
+    weights = csr_matrix(
+        (neighbor_sims.ravel()[valid], (rows[valid],
+                                        neighbors.ravel()[valid])),
+        shape=(batch, likes.shape[0])
+    )
+    pattern = csr_matrix(
+        (np.ones(valid.sum(), dtype=np.float32),
+         (rows[valid], neighbors.ravel()[valid])),
+        shape=(batch, likes.shape[0])
+    )
+    liked = likes.copy()
+    liked.data = np.ones_like(liked.data)
+    scores = (weights @ likes).toarray()
+    support = (pattern @ liked).toarray() > 0
+    return scores, support
@@ -0,0 +1,329 @@
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .models import (
+    User, Book, DirtyUser, UserNeighbor, UserRecommendation, LIKES,
+    rating_changed
+)
+from . import neighbor_table
+from .neighbor_table import neighbors_changed
+from .popularity import is_cold_start
+from .snapshot import get_snapshot
+
+NEAREST_USERS = 35  # Vecinos de las listas guardadas (como recommend_books)
+BATCH_SIZE = 256  # Usuarios por lote del recálculo
+MARK_BATCH_SIZE = 2048  # Usuarios por lote al marcarlos todos
+
+_refreshed = 0  # Usuarios recalculados en el proceso
+
+
+def is_requested() -> bool:
+    """
+    Indica si se han pedido las listas de recomendaciones guardadas
+    (`XBRECS_STORED_RECOMMENDATIONS`).
+
+    ## Retorno:
+    - `True` si se han pedido.
+    """
+    return getattr(settings, 'XBRECS_STORED_RECOMMENDATIONS', False)
+
+
+def is_enabled() -> bool:
+    """
+    Indica si las listas de recomendaciones guardadas están activadas. Sólo
+    lo están con la tabla de vecinos (`XBRECS_NEIGHBOR_TABLE`): sin ella no
+    se sabe a quién afecta una valoración y las listas quedarían
+    desfasadas.
+
+    ## Retorno:
+    - `True` si están activadas.
+    """
+    return is_requested() and neighbor_table.is_enabled()
+
+
+def _generation() -> str:
+    """
+    Generación con la que se calculan las recomendaciones.
+
+    ## Retorno:
+    - Generación del snapshot activo o `'db'` si no hay ninguno.
+    """
+    snapshot = get_snapshot()
+    return snapshot.generation if snapshot is not None else 'db'
+
+
+def stored_size() -> int:
+    """
+    Libros por lista guardada (`XBRECS_STORED_RECOMMENDATIONS_K`).
+
+    ## Retorno:
+    - Número de libros.
+    """
+    return getattr(settings, 'XBRECS_STORED_RECOMMENDATIONS_K', 50)
+
+
+def mark_dirty(user_ids: Iterable[int]) -> int:
+    """
+    Marca usuarios como pendientes de recalcular y borra sus listas
+    guardadas, que dejan de estar al día. Si ya estaban marcados, se
+    actualiza la fecha de la marca.
+
+    ## Argumentos:
+    - `user_ids`: IDs de los usuarios.
+
+    ## Retorno:
+    - Número de usuarios marcados.
+    """
+    user_ids = sorted(set(user_ids))
+    if not user_ids:
+        return 0
+    now = timezone.now()
+    # Dentro de la transacción de una valoración no hace falta un punto
+    # de guardado: si falla, se deshace todo
+    with transaction.atomic(savepoint=False):
+        DirtyUser.objects.bulk_create(
+            [DirtyUser(user_id=user_id, marked_at=now)
+             for user_id in user_ids],
+            update_conflicts=True, unique_fields=['user'],
+            update_fields=['marked_at'], batch_size=1000
+        )
+        UserRecommendation.objects.filter(user_id__in=user_ids).delete()
+    return len(user_ids)
+
+
+def mark_all_dirty() -> int:
+    """
+    Marca todos los usuarios como pendientes (tras cargar datos sin
+    señales, reconstruir los embeddings o cambiar de snapshot).
+
+    ## Retorno:
+    - Número de usuarios marcados.
+    """
+    user_ids = list(User.objects.order_by('id').values_list('id', flat=True))
+    for start in range(0, len(user_ids), MARK_BATCH_SIZE):
+        mark_dirty(user_ids[start:start + MARK_BATCH_SIZE])
+    return len(user_ids)
+
+
+def stored_recommendations(
+    user: User, n: int, k: int
+) -> Optional[List[Tuple[Book, float]]]:
+    """
+    Obtiene la lista de recomendaciones guardada de un usuario con una
+    sola consulta, si se calculó con la generación activa y la versión
+    actual de sus valoraciones.
+
+    ## Argumentos:
+    - `user`: Usuario.
+    - `n`: Número de usuarios más próximos pedido.
+    - `k`: Número de libros pedido.
+
+    ## Retorno:
+    - Lista de tuplas (`Book`, predicción) o `None` si no hay una lista
+    al día para esos parámetros.
+    """
+    if n != NEAREST_USERS or k > stored_size():
+        return None
+    rows = list(UserRecommendation.objects.filter(
+        user=user, rank__lt=k, generation=_generation(),
+        ratings_version=user.ratings_version
+    ).select_related('book').order_by('rank'))
+    if not rows:
+        return None
+    return [(row.book, row.score) for row in rows]
+
+
+def _next_batch(size: int) -> List[Tuple[int, object]]:
+    """
+    Obtiene los siguientes usuarios pendientes: primero los que han
+    entrado más recientemente (`last_login`) y, entre ellos, los marcados
+    hace más tiempo.
+
+    ## Argumentos:
+    - `size`: Número de usuarios.
+
+    ## Retorno:
+    - Lista de tuplas (ID del usuario, fecha de la marca).
+    """
+    return list(DirtyUser.objects.order_by(
+        F('user__last_login').desc(nulls_last=True), 'marked_at', 'user_id'
+    ).values_list('user_id', 'marked_at')[:size])
+
+
+def _store(
+    users: List[User], recs: List[List[Tuple[Book, float]]],
+    marks: Dict[int, object], generation: str
+) -> List[int]:
+    """
+    Guarda las listas de un lote y saca a sus usuarios de la cola, salvo
+    los que se han vuelto a marcar mientras se calculaban.
+
+    ## Argumentos:
+    - `users`: Usuarios del lote con lista calculada.
+    - `recs`: Lista de cada usuario.
+    - `marks`: Fecha de la marca de cada usuario al empezar el lote.
+    - `generation`: Generación con la que se han calculado.
+
+    ## Retorno:
+    - IDs de los usuarios que salen de la cola.
+    """
+    with transaction.atomic():
+        current = dict(DirtyUser.objects.select_for_update().filter(
+            user_id__in=list(marks)
+        ).values_list('user_id', 'marked_at'))
+        done = [
+            user_id for user_id, marked_at in marks.items()
+            if current.get(user_id) == marked_at
+        ]
+        done_set = set(done)
+        UserRecommendation.objects.filter(user_id__in=done).delete()
+        UserRecommendation.objects.bulk_create([
+            UserRecommendation(
+                user=user, book=book, score=score, rank=rank,
+                generation=generation, ratings_version=user.ratings_version
+            )
+            for user, books in zip(users, recs) if user.id in done_set
+            for rank, (book, score) in enumerate(books)
+        ], batch_size=1000)
+        DirtyUser.objects.filter(user_id__in=done).delete()
+    return done
+
+
+def refresh_dirty_users(
+    batch_size: int = BATCH_SIZE, max_users: Optional[int] = None,
+    rate: Optional[float] = None
+) -> Dict:
+    """
+    Recalcula por lotes, con `recommend_books_many`, las listas de los
+    usuarios pendientes, empezando por los más activos, y las guarda.
+    Antes de cada lote aplica las actualizaciones pendientes de la tabla
+    de vecinos.
+    Los usuarios sin señal suficiente salen de la cola sin lista (sus
+    libros populares se calculan al momento).
+
+    ## Argumentos:
+    - `batch_size`: Usuarios por lote.
+    - `max_users`: Máximo de usuarios a recalcular (`None` hasta vaciar
+    la cola).
+    - `rate`: Máximo de usuarios por segundo (`None` sin límite).
+
+    ## Retorno:
+    - Diccionario con los usuarios guardados, los que se han vuelto a
+    marcar durante el cálculo, los que no tienen señal, los lotes, el
+    tiempo y la cola que queda.
+    """
+    from .recommend import recommend_books_many
+
+    global _refreshed
+    report = {'refreshed': 0, 'remarked': 0, 'cold_start': 0, 'batches': 0}
+    start = time.perf_counter()
+    processed = 0
+    while max_users is None or processed < max_users:
+        size = batch_size if max_users is None \
+            else min(batch_size, max_users - processed)
+        # Primero se aplican a la tabla los embeddings cambiados, que marcan
+        # a los usuarios cuya lista de vecinos cambia
+        pending = neighbor_table.process_pending_updates(batch_size)
+        marks = dict(_next_batch(size))
+        if not marks:
+            if pending['users']:
+                continue
+            break
+        users = list(User.objects.filter(
+            id__in=list(marks)
+        ).order_by('id'))
+        warm = [u for u in users if not is_cold_start(u)]
+        generation = _generation()
+        recs = recommend_books_many(
+            warm, NEAREST_USERS, stored_size(), batch_size
+        ) if warm else []
+        done = set(_store(warm, recs, marks, generation))
+        refreshed = sum(1 for u in warm if u.id in done)
+        report['refreshed'] += refreshed
+        report['cold_start'] += len(done) - refreshed
+        report['remarked'] += len(marks) - len(done)
+        report['batches'] += 1
+        _refreshed += refreshed
+        processed += len(marks)
+        # Límite de usuarios por segundo para no competir con las vistas
+        if rate:
+            wait = processed / rate - (time.perf_counter() - start)
+            if wait > 0:
+                time.sleep(wait)
+    report['seconds'] = time.perf_counter() - start
+    report['backlog'] = backlog()
+    return report
+
+
+def backlog() -> int:
+    """
+    Obtiene el número de usuarios pendientes de recalcular.
+
+    ## Retorno:
+    - Tamaño de la cola.
+    """
+    return DirtyUser.objects.count()
+
+
+def stats() -> Dict[str, int]:
+    """
+    Obtiene la cola de usuarios pendientes y los recalculados en el
+    proceso.
+
+    ## Retorno:
+    - Diccionario con el tamaño de la cola (`backlog`) y los usuarios
+    recalculados (`refreshed`).
+    """
+    return {'backlog': backlog(), 'refreshed': _refreshed}
+
+
+@receiver(rating_changed)
+def mark_user_after_rating(
+    sender, user: User, previous: Optional[float], new: Optional[float],
+    **kwargs
+) -> None:
+    """
+    Marca al usuario que valora un libro: sus recomendaciones excluyen
+    los libros valorados y dependen de sus vecinos. Si cambian sus
+    valoraciones positivas, marca también a los usuarios que lo tienen
+    como vecino, cuyas predicciones las usan (aunque su lista de vecinos
+    no cambie hasta que se procese la cola de la tabla).
+
+    ## Argumentos:
+    - `sender`: Modelo que envía la señal.
+    - `user`: Usuario.
+    - `previous`: Valoración anterior (`None` si es nueva).
+    - `new`: Valoración nueva (`None` si se ha eliminado).
+    - `kwargs`: Argumentos adicionales.
+    """
+    if not is_enabled():
+        return
+    user_ids = [user.id]
+    liked_before = previous is not None and previous >= LIKES
+    liked_now = new is not None and new >= LIKES
+    if liked_before or liked_now:
+        user_ids += UserNeighbor.objects.filter(
+            neighbor_id=user.id
+        ).values_list('user_id', flat=True)
+    mark_dirty(user_ids)
+
+
+@receiver(neighbors_changed)
+def mark_users_after_neighbors(sender, user_ids: List[int], **kwargs) -> None:
+    """
+    Marca a los usuarios cuya lista de vecinos ha cambiado (entre ellos,
+    los que tienen como vecino al usuario que ha valorado).
+
+    ## Argumentos:
+    - `sender`: Modelo que envía la señal.
+    - `user_ids`: IDs de los usuarios.
+    - `kwargs`: Argumentos adicionales.
+    """
+    if is_enabled():
+        mark_dirty(user_ids)
@@ -0,0 +1,202 @@
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, Optional
+
+from django.conf import settings
+from django.core.cache import caches, BaseCache
+from django.core.cache.backends.redis import RedisCache
+
+CACHE_PREFIX = 'xbrecs:singleflight:'
+POLL_INTERVAL = 0.05  # Segundos entre comprobaciones del resultado
+# Margen (segundos) antes de la caducidad del bloqueo a partir del cual
+# ya no se borra: podría haber caducado y ser de otro proceso
+RELEASE_MARGIN = 1.0
+# Borrado atómico del bloqueo en Redis sólo si sigue guardando el token
+RELEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+_MISSING = object()
+
+
+class _Call:
+    """Cálculo en curso de una clave y su resultado."""
+
+    __slots__ = ('event', 'result', 'error')
+
+    def __init__(self) -> None:
+        self.event = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    """
+    Agrupa las llamadas concurrentes con la misma clave: la primera
+    ejecuta la función y las demás esperan y comparten su resultado (o su
+    excepción). Cuando termina, la siguiente llamada vuelve a calcular.
+    """
+
+    def __init__(self) -> None:
+        self._calls: Dict[str, _Call] = dict()
+        self._lock = threading.Lock()
+        self.leaders = 0  # Llamadas que han calculado
+        self.shared = 0  # Llamadas que han esperado a otra
+
+    def do(self, key: str, fn: Callable[[], Any]) -> Any:
+        """
+        Ejecuta la función una sola vez por clave entre las llamadas
+        concurrentes del proceso.
+
+        ## Argumentos:
+        - `key`: Clave del cálculo.
+        - `fn`: Función sin argumentos que calcula el resultado.
+
+        ## Retorno:
+        - Resultado de la función.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.leaders += 1
+            else:
+                self.shared += 1
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+        return call.result
+
+
+def _cache_alias() -> Optional[str]:
+    """
+    Caché compartida entre procesos para el bloqueo
+    (`XBRECS_SINGLEFLIGHT_CACHE`).
+
+    ## Retorno:
+    - Alias de la caché o `None` si sólo se agrupa dentro del proceso.
+    """
+    return getattr(settings, 'XBRECS_SINGLEFLIGHT_CACHE', None) or None
+
+
+def _release(
+    cache: BaseCache, lock_key: str, token: int, acquired: float,
+    timeout: float
+) -> None:
+    """
+    Libera el bloqueo entre procesos sin borrar el de otro proceso. En
+    Redis, se comprueba el token y se borra de forma atómica con un script
+    Lua. En las demás cachés no hay esa operación, así que sólo se borra
+    si no ha podido caducar todavía (queda más de `RELEASE_MARGIN` para el
+    `XBRECS_SINGLEFLIGHT_TIMEOUT`); si no, se deja caducar. Por eso ese
+    tiempo debe ser mayor que el peor cálculo: si caduca antes, otro
+    proceso puede repetir el cálculo a la vez.
+
+    ## Argumentos:
+    - `cache`: Caché compartida.
+    - `lock_key`: Clave del bloqueo.
+    - `token`: Token guardado al conseguir el bloqueo.
+    - `acquired`: Momento (`time.monotonic`) anterior a conseguirlo.
+    - `timeout`: Caducidad del bloqueo en segundos.
+    """
+    if isinstance(cache, RedisCache):
+        key = cache.make_and_validate_key(lock_key)
+        client = cache._cache.get_client(key, write=True)
+        client.eval(RELEASE_SCRIPT, 1, key, str(token))
+    elif time.monotonic() - acquired < timeout - RELEASE_MARGIN:
+        cache.delete(lock_key)
+
+
+def _shared(key: str, fn: Callable[[], Any], alias: str) -> Any:
+    """
+    Agrupa el cálculo entre procesos con un bloqueo en la caché: el
+    proceso que lo consigue calcula y guarda el resultado durante
+    `XBRECS_SINGLEFLIGHT_TTL` segundos; los demás esperan a que aparezca.
+    Si el bloqueo desaparece sin resultado (error o caducidad), calculan
+    por su cuenta. El bloqueo se libera sin borrar el de otro proceso (ver
+    `_release`).
+
+    ## Argumentos:
+    - `key`: Clave del cálculo.
+    - `fn`: Función sin argumentos que calcula el resultado.
+    - `alias`: Alias de la caché compartida.
+
+    ## Retorno:
+    - Resultado de la función.
+    """
+    cache = caches[alias]
+    lock_key = f"{CACHE_PREFIX}lock:{key}"
+    result_key = f"{CACHE_PREFIX}result:{key}"
+    timeout = getattr(settings, 'XBRECS_SINGLEFLIGHT_TIMEOUT', 30)
+    result = cache.get(result_key, _MISSING)
+    if result is not _MISSING:
+        return result
+    # Token entero: Redis lo guarda sin serializar y el script lo compara
+    token = uuid.uuid4().int
+    acquired = time.monotonic()
+    if cache.add(lock_key, token, timeout):
+        try:
+            result = fn()
+            cache.set(result_key, result,
+                      getattr(settings, 'XBRECS_SINGLEFLIGHT_TTL', 10))
+            return result
+        finally:
+            _release(cache, lock_key, token, acquired, timeout)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        time.sleep(POLL_INTERVAL)
+        result = cache.get(result_key, _MISSING)
+        if result is not _MISSING:
+            return result
+        if cache.get(lock_key) is None:
+            break
+    return fn()
+
+
+_flight = SingleFlight()
+
+
+def coalesce(key: str, fn: Callable[[], Any]) -> Any:
+    """
+    Ejecuta un cálculo costoso una sola vez para todas las llamadas
+    concurrentes con la misma clave: dentro del proceso con un bloqueo por
+    clave y, si se configura `XBRECS_SINGLEFLIGHT_CACHE`, también entre
+    procesos con un bloqueo en esa caché.
+
+    ## Argumentos:
+    - `key`: Clave del cálculo (debe cambiar cuando cambian sus datos).
+    - `fn`: Función sin argumentos que calcula el resultado.
+
+    ## Retorno:
+    - Resultado de la función, compartido entre las llamadas agrupadas.
+    """
+    alias = _cache_alias()
+    if alias is None:
+        return _flight.do(key, fn)
+    return _flight.do(key, lambda: _shared(key, fn, alias))
+
+
+def stats() -> Dict[str, int]:
+    """
+    Obtiene los contadores del proceso.
+
+    ## Retorno:
+    - Diccionario con las llamadas que han calculado (`leaders`) y las
+    que han compartido el resultado de otra (`shared`).
+    """
+    return {'leaders': _flight.leaders, 'shared': _flight.shared}
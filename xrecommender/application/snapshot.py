@@ -0,0 +1,419 @@
+import json
+import os
+import shutil
+import threading
+import time
+import numpy as np
+from datetime import datetime, timezone
+from scipy.sparse import csr_matrix
+from typing import Dict, Optional, Tuple
+
+from django.conf import settings
+
+from .matrices import (
+    embedding_matrix, normalize_rows, rating_matrix
+)
+from .models import User, Book, LIKES
+from .neighbors import (
+    quantize as quantize_matrix, fit_pca, project, search, exact_search
+)
+
+FORMAT_VERSION = 1
+CURRENT = 'CURRENT'  # Fichero con el nombre de la generación activa
+GENERATIONS = 'generations'
+META = 'meta.json'
+DEFAULT_NEIGHBORS = 50
+DEFAULT_KEEP = 2
+BATCH_SIZE = 1024
+CHECK_INTERVAL = 5.0  # Segundos entre comprobaciones del puntero
+# Diferencia máxima con el embedding del snapshot para usar la tabla
+TABLE_TOLERANCE = 1e-5
+
+# Matrices de cada generación (nombre del fichero .npy sin extensión)
+ARRAYS = [
+    'user_ids', 'users', 'book_ids', 'books',
+    'ratings_indptr', 'ratings_indices', 'ratings_data',
+    'neighbors', 'neighbor_sims',
+]
+# Matrices opcionales (sólo si se generaron con la opción correspondiente)
+OPTIONAL_ARRAYS = [
+    'users_q', 'users_scale',
+    'pca_mean', 'pca_components', 'users_pca',
+]
+
+
+class Snapshot:
+    """
+    Generación del snapshot del modelo abierta en modo solo lectura.
+
+    Las matrices se abren con `np.load(mmap_mode='r')`, de modo que todos
+    los procesos de un servidor comparten una única copia en la caché de
+    páginas del sistema operativo.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        with open(os.path.join(path, META)) as f:
+            self.meta = json.load(f)
+        if self.meta.get('format') != FORMAT_VERSION:
+            raise ValueError(
+                f"Formato de snapshot no soportado: {self.meta.get('format')}"
+            )
+        self.generation = self.meta['generation']
+        for name in ARRAYS:
+            setattr(self, name, np.load(
+                os.path.join(path, f"{name}.npy"), mmap_mode='r'
+            ))
+        for name in OPTIONAL_ARRAYS:
+            array_path = os.path.join(path, f"{name}.npy")
+            setattr(self, name, np.load(array_path, mmap_mode='r')
+                    if os.path.exists(array_path) else None)
+        self.ratings = csr_matrix(
+            (self.ratings_data, self.ratings_indices, self.ratings_indptr),
+            shape=(len(self.user_ids), len(self.book_ids)), copy=False
+        )
+
+    def user_position(self, user_id: int) -> int:
+        """
+        Obtiene la fila de un usuario en las matrices del snapshot.
+
+        ## Argumentos:
+        - `user_id`: ID del usuario.
+
+        ## Retorno:
+        - Fila del usuario o -1 si no está en el snapshot.
+        """
+        pos = int(np.searchsorted(self.user_ids, user_id))
+        if pos < len(self.user_ids) and self.user_ids[pos] == user_id:
+            return pos
+        return -1
+
+    def nearest_users(
+        self, embedding: np.ndarray, k: int, exclude_id: int
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Calcula los `k` usuarios del snapshot más próximos a un embedding.
+
+        ## Argumentos:
+        - `embedding`: Embedding (actual) del usuario.
+        - `k`: Número de vecinos.
+        - `exclude_id`: ID del usuario, que no es vecino de sí mismo.
+
+        ## Retorno:
+        - Tupla (IDs de los vecinos, similitudes), de mayor a menor
+        similitud. La búsqueda es exacta o cuantizada según
+        `XBRECS_NEIGHBOR_SEARCH` (ver `neighbors.search`).
+        """
+        vector = normalize_rows(embedding.reshape(1, -1))
+        neighbors, sims = search(
+            self, vector, k, np.array([self.user_position(exclude_id)])
+        )
+        valid = np.isfinite(sims[0])
+        return self.user_ids[neighbors[0][valid]], sims[0][valid]
+
+    def table_rows(
+        self, positions: np.ndarray, vectors: np.ndarray, k: int
+    ) -> np.ndarray:
+        """
+        Indica qué usuarios pueden leer sus vecinos de la tabla
+        precalculada: los que están en el snapshot con el mismo embedding
+        (sus valoraciones positivas no han cambiado desde que se generó),
+        si la tabla tiene al menos `k` vecinos.
+
+        ## Argumentos:
+        - `positions`: Filas de los usuarios en el snapshot (-1 si no
+        están).
+        - `vectors`: Embeddings actuales normalizados de los usuarios.
+        - `k`: Número de vecinos.
+
+        ## Retorno:
+        - Máscara de los usuarios que pueden usar la tabla.
+        """
+        usable = positions >= 0
+        if k > self.neighbors.shape[1] or not usable.any():
+            return np.zeros(len(positions), dtype=bool)
+        deviation = np.abs(
+            np.asarray(self.users[positions[usable]]) - vectors[usable]
+        ).max(axis=1)
+        usable[usable] = deviation <= TABLE_TOLERANCE
+        return usable
+
+    def liked_rows(self, user_ids: np.ndarray) -> Optional[csr_matrix]:
+        """
+        Obtiene las valoraciones positivas (`LIKES`) de unos usuarios de la
+        matriz dispersa del snapshot.
+
+        ## Argumentos:
+        - `user_ids`: IDs de los usuarios.
+
+        ## Retorno:
+        - Matriz CSR (usuarios x libros del snapshot), con las filas en el
+        orden de `user_ids`, o `None` si alguno no está en el snapshot.
+        """
+        positions = np.searchsorted(self.user_ids, user_ids)
+        if len(user_ids) and (
+            (positions >= len(self.user_ids)).any() or
+            (self.user_ids[np.minimum(positions, len(self.user_ids) - 1)]
+             != user_ids).any()
+        ):
+            return None
+        likes = self.ratings[positions]
+        likes.data[likes.data < LIKES] = 0.0
+        likes.eliminate_zeros()
+        return likes
+
+    def neighbor_table(
+        self, user_id: int, k: int
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Obtiene los `k` vecinos precalculados de un usuario (con los
+        embeddings del momento en que se generó el snapshot).
+
+        ## Argumentos:
+        - `user_id`: ID del usuario.
+        - `k`: Número de vecinos (como máximo el de la tabla).
+
+        ## Retorno:
+        - Tupla (IDs de los vecinos, similitudes). Vacía si el usuario no
+        está en el snapshot.
+        """
+        pos = self.user_position(user_id)
+        if pos < 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        neighbors = self.neighbors[pos, :k]
+        sims = self.neighbor_sims[pos, :k]
+        valid = neighbors >= 0
+        return self.user_ids[neighbors[valid]], np.asarray(sims[valid])
+
+
+def snapshot_root() -> Optional[str]:
+    """
+    Obtiene la carpeta de snapshots configurada (`XBRECS_SNAPSHOT_DIR`).
+
+    ## Retorno:
+    - Ruta de la carpeta o `None` si los snapshots están desactivados.
+    """
+    return getattr(settings, 'XBRECS_SNAPSHOT_DIR', None)
+
+
+def current_generation(root: str) -> Optional[str]:
+    """
+    Lee el puntero a la generación activa.
+
+    ## Argumentos:
+    - `root`: Carpeta de snapshots.
+
+    ## Retorno:
+    - Nombre de la generación o `None` si no hay ninguna.
+    """
+    try:
+        with open(os.path.join(root, CURRENT)) as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def write_snapshot(
+    root: str,
+    neighbors: int = DEFAULT_NEIGHBORS,
+    keep: int = DEFAULT_KEEP,
+    activate: bool = True,
+    quantize: Optional[str] = None,
+    pca_dim: Optional[int] = None
+) -> str:
+    """
+    Escribe una nueva generación del snapshot a partir de la base de datos
+    y, opcionalmente, la activa cambiando el puntero de forma atómica.
+
+    ## Argumentos:
+    - `root`: Carpeta de snapshots.
+    - `neighbors`: Vecinos por usuario de la tabla precalculada.
+    - `keep`: Generaciones que se conservan (incluida la nueva).
+    - `activate`: Si es `True`, la nueva generación pasa a ser la activa.
+    - `quantize`: Si se indica (`'int8'` o `'float16'`), se guarda también
+    la matriz de usuarios cuantizada para la búsqueda de candidatos.
+    - `pca_dim`: Si se indica, se ajusta una proyección PCA sobre los
+    libros y se guarda la matriz de usuarios reducida (la búsqueda
+    usuario-libro no se sirve; `check_neighbor_recall --kind books` ajusta
+    su proyección al vuelo).
+
+    ## Retorno:
+    - Ruta de la nueva generación.
+    """
+    user_ids, users = embedding_matrix(User.objects.all())
+    book_ids, books = embedding_matrix(Book.objects.all())
+    users = normalize_rows(users)
+    books = normalize_rows(books)
+    ratings = rating_matrix(user_ids, book_ids)
+    ratings.sort_indices()
+    table, table_sims = neighbor_table(users, neighbors)
+
+    generation = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S%fZ')
+    generations = os.path.join(root, GENERATIONS)
+    path = os.path.join(generations, generation)
+    tmp_path = path + '.tmp'
+    os.makedirs(tmp_path)
+    arrays: Dict[str, np.ndarray] = {
+        'user_ids': user_ids,
+        'users': users,
+        'book_ids': book_ids,
+        'books': books,
+        'ratings_indptr': ratings.indptr.astype(np.int64),
+        'ratings_indices': ratings.indices.astype(np.int32),
+        'ratings_data': ratings.data.astype(np.float32),
+        'neighbors': table,
+        'neighbor_sims': table_sims,
+    }
+    if quantize:
+        arrays['users_q'], arrays['users_scale'] = quantize_matrix(
+            users, quantize
+        )
+    explained = None
+    if pca_dim:
+        mean, components, explained = fit_pca(books, pca_dim)
+        arrays['pca_mean'] = mean
+        arrays['pca_components'] = components
+        arrays['users_pca'] = project(users, mean, components)
+    for name, array in arrays.items():
+        np.save(os.path.join(tmp_path, f"{name}.npy"), array)
+    with open(os.path.join(tmp_path, META), 'w') as f:
+        json.dump({
+            'format': FORMAT_VERSION,
+            'generation': generation,
+            'created': datetime.now(timezone.utc).isoformat(),
+            'users': len(user_ids),
+            'books': len(book_ids),
+            'ratings': int(ratings.nnz),
+            'dim': int(users.shape[1]) if users.size else 0,
+            'neighbors': int(table.shape[1]),
+            'quantize': quantize,
+            'pca_dim': len(arrays['pca_components']) if pca_dim else None,
+            'pca_explained_variance': explained,
+        }, f, indent=2)
+    os.rename(tmp_path, path)
+
+    if activate:
+        activate_generation(root, generation)
+    prune_generations(root, keep)
+    return path
+
+
+def neighbor_table(
+    users: np.ndarray, k: int
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Calcula la tabla de los `k` vecinos más próximos de cada usuario.
+
+    ## Argumentos:
+    - `users`: Embeddings normalizados de los usuarios.
+    - `k`: Número de vecinos.
+
+    ## Retorno:
+    - Tupla (filas de los vecinos, similitudes), ordenadas de mayor a
+    menor similitud (-1 y `-inf` si no hay suficientes usuarios).
+    """
+    n = len(users)
+    k = min(k, max(n - 1, 0))
+    table = np.full((n, k), -1, dtype=np.int32)
+    sims = np.full((n, k), -np.inf, dtype=np.float32)
+    for start in range(0, n, BATCH_SIZE):
+        rows = np.arange(start, min(start + BATCH_SIZE, n))
+        batch_neighbors, batch_sims = exact_search(
+            users[rows], users, k, rows
+        )
+        table[rows, :batch_neighbors.shape[1]] = batch_neighbors
+        sims[rows, :batch_sims.shape[1]] = batch_sims
+    return table, sims
+
+
+def activate_generation(root: str, generation: str) -> None:
+    """
+    Cambia de forma atómica el puntero a la generación activa. Los
+    procesos en marcha la abren en su siguiente comprobación.
+
+    ## Argumentos:
+    - `root`: Carpeta de snapshots.
+    - `generation`: Nombre de la generación.
+    """
+    if not os.path.isdir(os.path.join(root, GENERATIONS, generation)):
+        raise ValueError(f"No existe la generación {generation}")
+    tmp_path = os.path.join(root, f"{CURRENT}.tmp")
+    with open(tmp_path, 'w') as f:
+        f.write(generation + '\n')
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, os.path.join(root, CURRENT))
+
+
+def prune_generations(root: str, keep: int) -> None:
+    """
+    Borra las generaciones más antiguas, salvo la activa. Los procesos
+    que aún tengan abierta una generación borrada siguen leyéndola hasta
+    que cambien a la nueva.
+
+    ## Argumentos:
+    - `root`: Carpeta de snapshots.
+    - `keep`: Generaciones que se conservan.
+    """
+    generations = os.path.join(root, GENERATIONS)
+    current = current_generation(root)
+    names = sorted(
+        name for name in os.listdir(generations)
+        if not name.endswith('.tmp')
+    )
+    for name in names[:max(len(names) - keep, 0)]:
+        if name != current:
+            shutil.rmtree(os.path.join(generations, name),
+                          ignore_errors=True)
+
+
+def open_generation(
+    root: str, generation: Optional[str] = None
+) -> Optional[Snapshot]:
+    """
+    Abre una generación del snapshot.
+
+    ## Argumentos:
+    - `root`: Carpeta de snapshots.
+    - `generation`: Nombre de la generación. Por defecto, la activa.
+
+    ## Retorno:
+    - Snapshot o `None` si no hay generación activa.
+    """
+    generation = generation or current_generation(root)
+    if generation is None:
+        return None
+    return Snapshot(os.path.join(root, GENERATIONS, generation))
+
+
+_snapshot: Optional[Snapshot] = None
+_checked = 0.0
+_lock = threading.Lock()
+
+
+def get_snapshot() -> Optional[Snapshot]:
+    """
+    Obtiene la generación activa del snapshot. El puntero se comprueba
+    como mucho cada `CHECK_INTERVAL` segundos; si ha cambiado, se abre la
+    nueva generación sin reiniciar el servidor.
+
+    ## Retorno:
+    - Snapshot activo o `None` si no hay ninguno.
+    """
+    global _snapshot, _checked
+    root = snapshot_root()
+    if root is None:
+        return None
+    now = time.monotonic()
+    if now - _checked < CHECK_INTERVAL:
+        return _snapshot
+    with _lock:
+        if now - _checked < CHECK_INTERVAL:
+            return _snapshot
+        generation = current_generation(root)
+        if generation is None:
+            _snapshot = None
+        elif _snapshot is None or _snapshot.generation != generation:
+            _snapshot = open_generation(root, generation)
+        _checked = now
+    return _snapshot
@@ -1,7 +1,8 @@
 $(document).ready(function() {
-    $('#search-form').on('submit', function(event) {
-        event.preventDefault();
-        var query = $('#search-input').val();
+    var suggestTimer = null;
+
+    function search(query) {
+        $('#search-suggestions').empty();
         $.ajax({
             url: searchUrl,
             data: {
@@ -14,5 +15,51 @@ $(document).ready(function() {
                 console.error('Error:', error);
             }
         });
+    }
+
+    $('#search-form').on('submit', function(event) {
+        event.preventDefault();
+        search($('#search-input').val());
+    });
+
+    // Sugerencias de autocompletado mientras se escribe
+    $('#search-input').on('input', function() {
+        var query = $(this).val();
+        clearTimeout(suggestTimer);
+        if (!query.trim()) {
+            $('#search-suggestions').empty();
+            return;
+        }
+        suggestTimer = setTimeout(function() {
+            $.ajax({
+                url: autocompleteUrl,
+                data: {
+                    'q': query
+                },
+                success: function(data) {
+                    var list = $('#search-suggestions').empty();
+                    data.suggestions.forEach(function(s) {
+                        var item = $('<a href="#" class="list-group-item list-group-item-action"></a>');
+                        item.text(s.label);
+                        if (s.type === 'book') {
+                            item.attr('href', bookDetailUrl.replace('/0/', '/' + s.id + '/'));
+                        } else {
+                            item.prepend($('<small class="text-muted me-2"></small>').text(
+                                s.type === 'author' ? 'Autor' : 'Palabra clave'
+                            ));
+                            item.on('click', function(event) {
+                                event.preventDefault();
+                                $('#search-input').val(s.label);
+                                search(s.label);
+                            });
+                        }
+                        list.append(item);
+                    });
+                },
+                error: function(error) {
+                    console.error('Error:', error);
+                }
+            });
+        }, 100);
     });
-});
\ No newline at end of file
+});
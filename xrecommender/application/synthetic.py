@@ -0,0 +1,184 @@
+import io
+import os
+import json
+import tempfile
+import numpy as np
+import pandas as pd
+from contextlib import contextmanager, redirect_stdout
+from typing import Dict, Iterator, List
+
+from django.core.management import call_command
+from django.db import connection
+
+from .models import LIKES, EMBEDDING_DIM
+
+RATING_VALUES = np.array([0.0, 0.25, 0.5, 0.75, 1.0])
+NUM_TOPICS = 16
+TOPIC_NOISE = 0.6  # Dispersión de los libros respecto al centro del tema
+TOPIC_AFFINITY = 0.8  # Probabilidad de valorar un libro de un tema favorito
+
+
+def generate_dataset(
+    output_path: str,
+    users: int = 200,
+    books: int = 500,
+    density: float = 0.05,
+    keywords: int = 300,
+    keywords_per_book: int = 8,
+    dim: int = EMBEDDING_DIM,
+    seed: int = 42
+) -> Dict[str, str]:
+    """
+    Genera un dataset sintético y determinista con la misma estructura de
+    ficheros que espera el comando `populate` (GoodBooks10k extendido).
+
+    Los libros se agrupan en temas: cada tema tiene un centro en el espacio
+    de embeddings y un vocabulario de palabras clave propio, y cada usuario
+    prefiere unos pocos temas, a cuyos libros da mejores valoraciones.
+    Así los vecinos, las recomendaciones y las explicaciones por palabras
+    clave se comportan de forma parecida a los datos reales.
+
+    ## Argumentos:
+    - `output_path`: Carpeta donde se escribirá el dataset.
+    - `users`: Número de usuarios.
+    - `books`: Número de libros.
+    - `density`: Proporción de libros valorados por cada usuario.
+    - `keywords`: Tamaño del vocabulario de palabras clave.
+    - `keywords_per_book`: Número de palabras clave por libro.
+    - `dim`: Dimensión de los embeddings.
+    - `seed`: Semilla del generador aleatorio.
+
+    ## Retorno:
+    - Diccionario con las rutas que deben pasarse a `populate`
+    (`dataset_path`, `model_path` y `keywords_file`).
+    """
+    rng = np.random.default_rng(seed)
+    dataset_path = os.path.join(output_path, "datasets")
+    model_path = os.path.join(output_path, "models")
+    keywords_file = os.path.join(output_path, "keyword_books.json")
+    for folder in ["training", "goodbooks_ext", "raw"]:
+        os.makedirs(os.path.join(dataset_path, folder), exist_ok=True)
+    os.makedirs(model_path, exist_ok=True)
+
+    # Libros agrupados por temas
+    book_ids = np.arange(1, books + 1)
+    centers = rng.standard_normal((NUM_TOPICS, dim))
+    book_topics = rng.integers(0, NUM_TOPICS, books)
+    book_embeddings = centers[book_topics] + TOPIC_NOISE * \
+        rng.standard_normal((books, dim))
+    book_embeddings /= np.linalg.norm(book_embeddings, axis=1, keepdims=True)
+    book_embeddings = book_embeddings.astype(np.float32)
+
+    # Palabras clave: cada tema usa sobre todo una parte del vocabulario
+    vocabulary = [f"keyword_{i}" for i in range(keywords)]
+    topic_vocab = np.array_split(rng.permutation(keywords), NUM_TOPICS)
+    books_keywords: Dict[str, List[str]] = dict()
+    for i, book_id in enumerate(book_ids):
+        own = topic_vocab[book_topics[i]]
+        n_own = min(len(own), int(np.ceil(keywords_per_book * 0.75)))
+        chosen = set(rng.choice(own, n_own, replace=False).tolist())
+        while len(chosen) < min(keywords_per_book, keywords):
+            chosen.add(int(rng.integers(0, keywords)))
+        books_keywords[str(book_id)] = [vocabulary[k] for k in chosen]
+
+    authors = [f"Author {i}" for i in range(max(1, books // 3))]
+    books_df = pd.DataFrame({
+        'book_id': book_ids,
+        'title': [f"Book {i} {vocabulary[i % keywords]}" for i in book_ids],
+        'original_publication_year': rng.integers(1900, 2020, books),
+        'isbn13': 9780000000000 + book_ids,
+        'image_url': [f"https://example.com/{i}.jpg" for i in book_ids],
+        'description': [f"Description of book {i}" for i in book_ids],
+        'authors': [
+            str([authors[j] for j in rng.choice(
+                len(authors), rng.integers(1, 3), replace=False
+            )])
+            for _ in book_ids
+        ],
+        'genres': [str([f"genre_{t}"]) for t in book_topics],
+    })
+    books_df.to_csv(
+        os.path.join(dataset_path, "goodbooks_ext", "books_enriched.csv")
+    )
+    pd.DataFrame({
+        'book_id': book_ids,
+        'semantic_sbert': list(book_embeddings),
+    }).to_pickle(os.path.join(dataset_path, "raw", "books_raw.pkl"))
+
+    # Valoraciones: más probables y más altas en los temas favoritos
+    ratings_per_user = max(1, int(round(density * books)))
+    topic_books = [np.flatnonzero(book_topics == t) for t in range(NUM_TOPICS)]
+    rows = []
+    for user_id in range(1, users + 1):
+        favourite = set(rng.choice(NUM_TOPICS, 3, replace=False).tolist())
+        fav_books = np.concatenate([topic_books[t] for t in favourite])
+        n_fav = min(len(fav_books), int(ratings_per_user * TOPIC_AFFINITY))
+        rated = set(rng.choice(fav_books, n_fav, replace=False).tolist())
+        while len(rated) < ratings_per_user:
+            rated.add(int(rng.integers(0, books)))
+        for b in sorted(rated):
+            high = book_topics[b] in favourite
+            p = [0.02, 0.08, 0.2, 0.4, 0.3] if high else \
+                [0.2, 0.3, 0.3, 0.15, 0.05]
+            rating = rng.choice(RATING_VALUES, p=p)
+            rows.append((user_id, int(book_ids[b]), rating))
+    train_df = pd.DataFrame(rows, columns=['user_id', 'book_id', 'rating'])
+    train_df.to_csv(
+        os.path.join(dataset_path, "training", "train_reduced.tsv"),
+        sep='\t', header=None, index=False
+    )
+
+    # Perfiles de usuario: media ponderada y normalizada de los libros que
+    # le gustan (igual que en el notebook del recomendador user-user)
+    likes = train_df[train_df['rating'] >= LIKES]
+    profiles = np.zeros((users, dim), dtype=np.float32)
+    np.add.at(
+        profiles,
+        likes['user_id'].values - 1,
+        likes['rating'].values.reshape(-1, 1).astype(np.float32) *
+        book_embeddings[likes['book_id'].values - 1]
+    )
+    norms = np.linalg.norm(profiles, axis=1, keepdims=True)
+    profiles = np.divide(
+        profiles, norms, out=np.zeros_like(profiles), where=norms != 0
+    )
+    pd.DataFrame({
+        'user_id': np.arange(1, users + 1),
+        'semantic_sbert': list(profiles),
+    }).to_pickle(os.path.join(model_path, "user_profiles.pkl"))
+
+    with open(keywords_file, "w") as jsonfile:
+        json.dump(books_keywords, jsonfile)
+
+    return {
+        'dataset_path': dataset_path,
+        'model_path': model_path,
+        'keywords_file': keywords_file,
+    }
+
+
+@contextmanager
+def synthetic_database(populate: bool = True, **options) -> Iterator[Dict]:
+    """
+    Crea una base de datos de pruebas temporal (en memoria con SQLite) y
+    genera un dataset sintético para ella. Al salir se destruye.
+
+    ## Argumentos:
+    - `populate`: Si es `True`, carga el dataset con el comando `populate`.
+    - `options`: Configuración del dataset (ver `generate_dataset`).
+
+    ## Retorno:
+    - Rutas del dataset sintético (argumentos de `populate`).
+    """
+    with tempfile.TemporaryDirectory() as tmp_path:
+        paths = generate_dataset(tmp_path, **options)
+        old_name = connection.creation.create_test_db(
+            verbosity=0, autoclobber=True, serialize=False
+        )
+        try:
+            if populate:
+                with redirect_stdout(io.StringIO()):
+                    call_command('populate', **paths)
+            yield paths
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
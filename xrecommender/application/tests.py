@@ -0,0 +1,114 @@
+import io
+import numpy as np
+from contextlib import redirect_stdout
+from typing import Dict, List, Tuple
+
+from django.test import TestCase, override_settings
+
+from .models import (
+    User, Book, Rating, UserNeighbor, PendingNeighborUpdate, EMBEDDING_DIM,
+    upsert_rating
+)
+from . import neighbor_table
+
+USERS = 30
+BOOKS = 40
+RATINGS_PER_USER = 4
+CHANGES = 80
+TABLE_K = 5
+RATING_VALUES = [0.0, 0.25, 0.5, 0.75, 1.0]
+
+
+def _table() -> Dict[int, List[Tuple[int, float]]]:
+    """
+    Lee la tabla de vecinos.
+
+    ## Retorno:
+    - Diccionario {ID del usuario: lista de tuplas (ID del vecino,
+    similitud) por posición}.
+    """
+    table: Dict[int, List[Tuple[int, float]]] = dict()
+    for user_id, neighbor_id, sim in UserNeighbor.objects.order_by(
+        'user_id', 'rank'
+    ).values_list('user_id', 'neighbor_id', 'similarity'):
+        table.setdefault(user_id, []).append((neighbor_id, sim))
+    return table
+
+
+@override_settings(XBRECS_NEIGHBOR_TABLE=True,
+                   XBRECS_NEIGHBOR_TABLE_K=TABLE_K)
+class NeighborTableTests(TestCase):
+    """
+    Pruebas de la actualización incremental de la tabla de vecinos.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        rng = np.random.default_rng(7)
+        Book.objects.bulk_create([
+            Book(title=f'Libro {i}', year=2000, isbn='', cover='',
+                 description='')
+            for i in range(BOOKS)
+        ])
+        for book in Book.objects.all():
+            book.set_embedding(rng.normal(size=EMBEDDING_DIM))
+            book.save(update_fields=['embedding'])
+        User.objects.bulk_create([
+            User(username=f'usuario{i}') for i in range(USERS)
+        ])
+
+    def setUp(self):
+        self.rng = np.random.default_rng(11)
+        self.users = list(User.objects.order_by('id'))
+        self.books = list(Book.objects.order_by('id'))
+
+    def rate(self, user: User, book: Book, value: float) -> None:
+        with redirect_stdout(io.StringIO()):
+            upsert_rating(user, book, value)
+
+    def random_change(self) -> None:
+        """
+        Aplica una valoración aleatoria (nueva, modificada o borrada).
+        """
+        user = User.objects.get(id=self.rng.choice(self.users).id)
+        ratings = Rating.objects.filter(user=user)
+        if ratings.exists() and self.rng.random() < 0.25:
+            with redirect_stdout(io.StringIO()):
+                ratings.order_by('?').first().delete()
+            return
+        book = self.books[self.rng.integers(len(self.books))]
+        self.rate(user, book, float(self.rng.choice(RATING_VALUES)))
+
+    def test_pending_updates_match_rebuild(self):
+        """
+        Tras procesar la cola, la tabla coincide con la reconstrucción
+        completa.
+        """
+        # Embeddings iniciales: cada usuario valora bien algunos libros
+        for user in self.users:
+            for i in self.rng.choice(BOOKS, RATINGS_PER_USER, replace=False):
+                self.rate(user, self.books[i], 1.0)
+        neighbor_table.rebuild_user_neighbors()
+        self.assertFalse(PendingNeighborUpdate.objects.exists())
+
+        for _ in range(CHANGES):
+            self.random_change()
+        self.assertTrue(PendingNeighborUpdate.objects.exists())
+        result = neighbor_table.process_pending_updates(batch_size=7)
+        while result['pending']:
+            result = neighbor_table.process_pending_updates(batch_size=7)
+        incremental = _table()
+
+        neighbor_table.rebuild_user_neighbors()
+        rebuilt = _table()
+        self.assertEqual(set(incremental), set(rebuilt))
+        for user_id, neighbors in rebuilt.items():
+            self.assertEqual(
+                [n for n, _ in incremental[user_id]],
+                [n for n, _ in neighbors],
+                f'Vecinos distintos del usuario {user_id}'
+            )
+            np.testing.assert_allclose(
+                [s for _, s in incremental[user_id]],
+                [s for _, s in neighbors], atol=1e-5
+            )
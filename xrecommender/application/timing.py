@@ -0,0 +1,281 @@
+import json
+import logging
+import threading
+import time
+from bisect import bisect_left
+from contextlib import nullcontext
+from contextvars import ContextVar
+from functools import wraps
+from typing import Callable, Dict, List, Optional
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+# Límites superiores (ms) de los buckets de los histogramas
+BUCKETS_MS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000]
+TOTAL = 'total'
+DB = 'db'
+
+_NULL_SPAN = nullcontext()
+
+
+class RequestTimings:
+    """Tiempos y consultas a la base de datos de cada tramo de una petición."""
+
+    def __init__(self) -> None:
+        self.queries = 0
+        self.query_time = 0.0
+        # Nombre del tramo -> [duración, consultas, tiempo en consultas]
+        self.spans: Dict[str, List[float]] = dict()
+
+    def add(
+        self, name: str, duration: float, queries: int, query_time: float
+    ) -> None:
+        """
+        Acumula la medida de un tramo (un mismo tramo puede repetirse).
+
+        ## Argumentos:
+        - `name`: Nombre del tramo.
+        - `duration`: Duración en segundos.
+        - `queries`: Consultas realizadas durante el tramo.
+        - `query_time`: Tiempo en segundos dedicado a las consultas.
+        """
+        span = self.spans.setdefault(name, [0.0, 0, 0.0])
+        span[0] += duration
+        span[1] += queries
+        span[2] += query_time
+
+    def __call__(self, execute, sql, params, many, context):
+        """Envoltorio de ejecución de consultas que las cuenta y cronometra."""
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.query_time += time.perf_counter() - start
+
+
+_current: ContextVar[Optional[RequestTimings]] = ContextVar(
+    'xbrecs_timings', default=None
+)
+
+
+class _Span:
+    """Gestor de contexto que mide un tramo de la petición actual."""
+
+    __slots__ = ('name', 'timings', 'start', 'queries', 'query_time')
+
+    def __init__(self, name: str, timings: RequestTimings) -> None:
+        self.name = name
+        self.timings = timings
+
+    def __enter__(self) -> '_Span':
+        self.queries = self.timings.queries
+        self.query_time = self.timings.query_time
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.timings.add(
+            self.name,
+            time.perf_counter() - self.start,
+            self.timings.queries - self.queries,
+            self.timings.query_time - self.query_time
+        )
+
+
+def span(name: str):
+    """
+    Mide un tramo de la petición en curso. Si la instrumentación está
+    desactivada (o no hay petición instrumentada) no hace nada.
+
+    ## Argumentos:
+    - `name`: Nombre del tramo.
+
+    ## Retorno:
+    - Gestor de contexto.
+    """
+    timings = _current.get()
+    if timings is None:
+        return _NULL_SPAN
+    return _Span(name, timings)
+
+
+def timed(name: str) -> Callable:
+    """
+    Decorador que mide cada llamada a una función como un tramo.
+
+    ## Argumentos:
+    - `name`: Nombre del tramo.
+
+    ## Retorno:
+    - Decorador.
+    """
+    def decorator(fn: Callable) -> Callable:
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            timings = _current.get()
+            if timings is None:
+                return fn(*args, **kwargs)
+            with _Span(name, timings):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class Histogram:
+    """Histograma de duraciones acumulado en el proceso."""
+
+    def __init__(self) -> None:
+        self.counts = [0] * (len(BUCKETS_MS) + 1)
+        self.count = 0
+        self.sum_ms = 0.0
+        self.queries = 0
+        self._lock = threading.Lock()
+
+    def observe(self, duration_ms: float, queries: int = 0) -> None:
+        """
+        Registra una observación.
+
+        ## Argumentos:
+        - `duration_ms`: Duración en milisegundos.
+        - `queries`: Consultas realizadas.
+        """
+        with self._lock:
+            self.counts[bisect_left(BUCKETS_MS, duration_ms)] += 1
+            self.count += 1
+            self.sum_ms += duration_ms
+            self.queries += queries
+
+    def as_dict(self) -> Dict:
+        """
+        Representación del histograma para el endpoint de métricas.
+
+        ## Retorno:
+        - Diccionario con los buckets y los totales.
+        """
+        with self._lock:
+            return {
+                'buckets_ms': BUCKETS_MS + ['+Inf'],
+                'counts': list(self.counts),
+                'count': self.count,
+                'sum_ms': self.sum_ms,
+                'queries': self.queries,
+            }
+
+
+_histograms: Dict[str, Histogram] = dict()
+_histograms_lock = threading.Lock()
+
+
+def observe(name: str, duration_ms: float, queries: int = 0) -> None:
+    """
+    Registra una duración en el histograma de su tramo.
+
+    ## Argumentos:
+    - `name`: Nombre del histograma (ruta y tramo).
+    - `duration_ms`: Duración en milisegundos.
+    - `queries`: Consultas realizadas.
+    """
+    histogram = _histograms.get(name)
+    if histogram is None:
+        with _histograms_lock:
+            histogram = _histograms.setdefault(name, Histogram())
+    histogram.observe(duration_ms, queries)
+
+
+def metrics() -> Dict[str, Dict]:
+    """
+    Obtiene los histogramas acumulados en el proceso.
+
+    ## Retorno:
+    - Diccionario nombre -> histograma.
+    """
+    return {name: h.as_dict() for name, h in sorted(_histograms.items())}
+
+
+def server_timing_header(timings: RequestTimings) -> str:
+    """
+    Genera el valor de la cabecera `Server-Timing`.
+
+    ## Argumentos:
+    - `timings`: Medidas de la petición.
+
+    ## Retorno:
+    - Valor de la cabecera.
+    """
+    parts = [
+        f'{name};dur={1000 * dur:.1f};desc="{queries} q"'
+        for name, (dur, queries, _) in timings.spans.items()
+    ]
+    parts.append(
+        f'{DB};dur={1000 * timings.query_time:.1f};'
+        f'desc="{timings.queries} q"'
+    )
+    return ', '.join(parts)
+
+
+class TimingMiddleware:
+    """
+    Middleware que instrumenta las peticiones: mide los tramos declarados
+    con `span`/`timed` y las consultas a la base de datos, los devuelve en
+    la cabecera `Server-Timing`, opcionalmente los escribe en el log como
+    una línea JSON y los acumula en histogramas del proceso.
+
+    Se activa con `XBRECS_TIMING`; si está desactivado Django lo descarta
+    al arrancar y no añade ningún coste.
+    """
+
+    def __init__(self, get_response) -> None:
+        if not getattr(settings, 'XBRECS_TIMING', False):
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+        self.log = getattr(settings, 'XBRECS_TIMING_LOG', False)
+
+    def __call__(self, request):
+        timings = RequestTimings()
+        token = _current.set(timings)
+        start = time.perf_counter()
+        try:
+            with connections['default'].execute_wrapper(timings):
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        timings.add(TOTAL, time.perf_counter() - start, timings.queries,
+                    timings.query_time)
+
+        match = getattr(request, 'resolver_match', None)
+        route = match.url_name if match and match.url_name else 'other'
+        for name, (dur, queries, _) in timings.spans.items():
+            observe(f'{route}.{name}', 1000 * dur, queries)
+        response['Server-Timing'] = server_timing_header(timings)
+        if self.log:
+            logger.info(json.dumps({
+                'route': route,
+                'path': request.path,
+                'status': response.status_code,
+                'spans': {
+                    name: {
+                        'ms': round(1000 * dur, 3),
+                        'queries': queries,
+                        'db_ms': round(1000 * query_time, 3),
+                    }
+                    for name, (dur, queries, query_time)
+                    in timings.spans.items()
+                },
+            }))
+        return response
+
+    def process_template_response(self, request, response):
+        """
+        Mide el renderizado de las respuestas con plantilla, que Django
+        realiza después de ejecutar la vista.
+        """
+        timings = _current.get()
+        if timings is not None:
+            render = _Span('render', timings).__enter__()
+            response.add_post_render_callback(lambda r: render.__exit__())
+        return response
@@ -1,20 +1,36 @@
+from django.conf import settings
 from django.urls import path
 from .views import (
-    SignupView, HomeView, BookSearchView, DiscoverView,
-    book_rate, book_rate_remove,
+    SignupView, HomeView, BookSearchView, DiscoverView, autocomplete,
+    book_rate, book_rate_remove, metrics, ready, recommend_api,
     BookDetailView,
-    RecommendView, ProfileView
+    RecommendView, ProfileView,
+    recommend_async, recommend_api_async, book_rate_async,
+    book_rate_remove_async
 )
 
+if getattr(settings, 'XBRECS_ASYNC_VIEWS', False):
+    # Despliegue ASGI: vistas asíncronas en las mismas rutas
+    recommend_view = recommend_async
+    recommend_api_view = recommend_api_async
+    book_rate_view = book_rate_async
+    book_rate_remove_view = book_rate_remove_async
+else:
+    recommend_view = RecommendView.as_view()
+    recommend_api_view = recommend_api
+    book_rate_view = book_rate
+    book_rate_remove_view = book_rate_remove
+
 urlpatterns = [
     path('signup/', SignupView.as_view(), name='signup'),
     path('', HomeView.as_view(), name='home'),
     path('search/', BookSearchView.as_view(), name='search'),
     path('discover/', DiscoverView.as_view(), name='discover'),
-    path('book-rate/<int:book_id>/', book_rate, name='book-rate'),
+    path('autocomplete/', autocomplete, name='autocomplete'),
+    path('book-rate/<int:book_id>/', book_rate_view, name='book-rate'),
     path(
         'book-rate-remove/<int:book_id>/',
-        book_rate_remove,
+        book_rate_remove_view,
         name='book-rate-remove'
     ),
     path(
@@ -22,6 +38,10 @@ urlpatterns = [
         BookDetailView.as_view(),
         name='book-detail'
     ),
-    path('recommend/<int:count>', RecommendView.as_view(), name='recommend'),
+    path('recommend/<int:count>', recommend_view, name='recommend'),
+    path('api/recommend/<int:count>', recommend_api_view,
+         name='api-recommend'),
     path('profile/', ProfileView.as_view(), name='profile'),
+    path('metrics/', metrics, name='metrics'),
+    path('ready/', ready, name='ready'),
 ]
@@ -1,24 +1,48 @@
+import asyncio
+from typing import Dict
+
 from django.views import generic
 from django.shortcuts import render, redirect
 from django.contrib.auth import login, authenticate
+from django.contrib.auth.decorators import login_required, user_passes_test
 from django.contrib.auth.mixins import LoginRequiredMixin
+from django.contrib.auth.views import redirect_to_login
 from django.shortcuts import get_object_or_404
-from django.http import JsonResponse
-from django.views.decorators.http import require_POST
+from django.db.models import prefetch_related_objects
+from django.http import Http404, JsonResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import require_GET, require_POST, condition
 
 from haystack import generic_views
 from haystack.query import SearchQuerySet
 
-from .models import Book, Rating
+from .executor import run_in_worker
+from .keyword_index import get_keyword_index
+from .models import Book, Rating, User, LIKES, upsert_rating
 from .forms import SignUpForm
+from .autocomplete import suggest, DEFAULT_LIMIT
+from .timing import metrics as timing_metrics
+from .warmup import status as warmup_status
+from .query_budget import query_budget
+from .refresh import stats as refresh_stats
+from .singleflight import stats as singleflight_stats
+from .popularity import sorted_books, SORT_LABELS, POPULAR
 from .recommend import recommend_books
+from .snapshot import get_snapshot
 from .xai import (
+    neighbor_explanation,
     xai_explanation_dict,
     sort_rec_books_by_keyword_count,
     pyvis_graph_html
 )
 
 
+MAX_API_COUNT = 100  # Máximo de libros de la API de recomendaciones
+DISCOVER_BOOKS = 24  # Libros de la página de descubrir
+
+
 class HomeView(generic.TemplateView):
     """Vista basada en clase para la página principal."""
 
@@ -77,6 +101,7 @@ class BookSearchView(LoginRequiredMixin, generic_views.SearchView):
     template_name = 'search/results.html'
     form_class = generic_views.ModelSearchForm
     context_object_name = 'book_results'
+    query_budget = 7
 
     def get_queryset(self):
         """
@@ -86,15 +111,17 @@ class BookSearchView(LoginRequiredMixin, generic_views.SearchView):
         Author: Álvaro Rodero
         """
         query = self.request.GET.get('q', '')
+        # Carga de los libros de la página en una sola consulta
         if query:
-            return SearchQuerySet().auto_query(query)
-        return SearchQuerySet().all()
+            return SearchQuerySet().auto_query(query).load_all()
+        return SearchQuerySet().all().load_all()
 
 
 class DiscoverView(LoginRequiredMixin, generic.TemplateView):
     """Vista basada en clase para descubrir libros."""
 
     template_name = 'recommender/discover.html'
+    query_budget = 3
 
     def get_context_data(self, **kwargs):
         """
@@ -103,10 +130,201 @@ class DiscoverView(LoginRequiredMixin, generic.TemplateView):
         Author: Álvaro Rodero
         """
         context = super().get_context_data(**kwargs)
-        context['books'] = Book.objects.all()
+        # Orden con los agregados de los libros (sin agrupar valoraciones)
+        sort = self.request.GET.get('sort', POPULAR)
+        if sort not in SORT_LABELS:
+            sort = POPULAR
+        context['sort'] = sort
+        context['sorts'] = SORT_LABELS
+        context['books'] = sorted_books(sort)[:DISCOVER_BOOKS]
         return context
 
 
+@login_required
+@require_GET
+def autocomplete(request):
+    """
+    Vista para obtener sugerencias de autocompletado de títulos, autores y
+    palabras clave a partir del índice de prefijos en memoria.
+
+    ## Argumentos:
+    - `request`: Petición HTTP.
+
+    ## Retorna:
+    - `JsonResponse`: Sugerencias ordenadas.
+    """
+    query = request.GET.get('q', '')
+    try:
+        limit = min(int(request.GET.get('limit', DEFAULT_LIMIT)), 50)
+    except ValueError:
+        limit = DEFAULT_LIMIT
+    return JsonResponse({'suggestions': suggest(query, limit)})
+
+
+@user_passes_test(lambda u: u.is_staff)
+@require_GET
+def metrics(request):
+    """
+    Vista interna con los histogramas de tiempos por tramo acumulados
+    en el proceso, los contadores de cálculos de recomendaciones
+    agrupados y la cola de usuarios pendientes de recalcular. Sólo
+    accesible para el personal del sitio.
+
+    ## Argumentos:
+    - `request`: Petición HTTP.
+
+    ## Retorna:
+    - `JsonResponse`: Histogramas por ruta y tramo, contadores y cola.
+    """
+    return JsonResponse({
+        'timings': timing_metrics(),
+        'singleflight': singleflight_stats(),
+        'refresh': refresh_stats(),
+    })
+
+
+@require_GET
+def ready(request):
+    """
+    Vista de preparación para el balanceador o el orquestador: indica si
+    el proceso ha terminado el calentamiento (`XBRECS_WARMUP`).
+
+    ## Argumentos:
+    - `request`: Petición HTTP.
+
+    ## Retorna:
+    - `JsonResponse`: Estado de preparación, con código 503 mientras el
+    calentamiento no haya terminado.
+    """
+    state = warmup_status()
+    return JsonResponse(state, status=200 if state['ready'] else 503)
+
+
+def _explain_requested(request) -> bool:
+    """
+    Indica si la petición a la API pide la explicación (`?explain=1`).
+
+    ## Argumentos:
+    - `request`: Petición HTTP.
+
+    ## Retorna:
+    - `True` si se pide la explicación.
+    """
+    return request.GET.get('explain', '0').lower() in ['true', 't', '1']
+
+
+def _user_etag(user: User, request, count: int) -> str:
+    """
+    Calcula el ETag de las recomendaciones de un usuario autenticado.
+
+    ## Argumentos:
+    - `user`: Usuario.
+    - `request`: Petición HTTP.
+    - `count`: Número de libros pedidos.
+
+    ## Retorna:
+    - ETag (sin comillas).
+    """
+    snapshot = get_snapshot()
+    generation = snapshot.generation if snapshot is not None else 'db'
+    # Con la tabla de vecinos, los cambios de los vecinos del usuario (y de
+    # sus valoraciones) también incrementan `ratings_version`
+    return (f"{user.id}-{user.ratings_version}-{generation}-"
+            f"{min(count, MAX_API_COUNT)}-{int(_explain_requested(request))}")
+
+
+def recommendations_etag(request, count: int):
+    """
+    Calcula el ETag de las recomendaciones de un usuario a partir de la
+    versión de sus valoraciones y de la generación activa del snapshot,
+    sin calcular ninguna recomendación.
+
+    ## Argumentos:
+    - `request`: Petición HTTP.
+    - `count`: Número de libros pedidos.
+
+    ## Retorna:
+    - ETag o `None` si el usuario no ha iniciado sesión.
+    """
+    user = request.user
+    if not user.is_authenticated:
+        return None
+    return _user_etag(user, request, count)
+
+
+def _recommendations_payload(user: User, count: int, explain: bool) -> Dict:
+    """
+    Calcula la respuesta de la API de recomendaciones.
+
+    ## Argumentos:
+    - `user`: Usuario.
+    - `count`: Número de libros (como mucho `MAX_API_COUNT`).
+    - `explain`: Indica si se añaden las palabras clave y los vecinos
+    que explican cada libro.
+
+    ## Retorna:
+    - Diccionario con el número de libros y sus datos.
+    """
+    provenance = dict() if explain else None
+    recs = recommend_books(
+        user, k=min(count, MAX_API_COUNT), provenance=provenance
+    )
+    books = [
+        {
+            'id': book.id,
+            'title': book.title,
+            'cover': book.cover,
+            'score': round(float(score), 6),
+        }
+        for book, score in recs
+    ]
+    if explain:
+        explain_info_dict = xai_explanation_dict(user, [b for b, _ in recs])
+        # Palabras clave de cada libro del índice, sin más consultas
+        index = get_keyword_index()
+        explained = {kw.id: kw for kw in explain_info_dict}
+        for data, (book, _) in zip(books, recs):
+            keywords = [
+                explained[kw] for kw in index.keywords_of(book.id).tolist()
+                if kw in explained
+            ]
+            keywords.sort(key=lambda kw: len(explain_info_dict[kw]),
+                          reverse=True)
+            data['keywords'] = [kw.word for kw in keywords]
+        neighbors = neighbor_explanation(recs, provenance)
+        for data, (book, _) in zip(books, recs):
+            if book.id in neighbors:
+                data['neighbors'] = neighbors[book.id]
+    return {'count': len(books), 'books': books}
+
+
+@query_budget(15)
+@login_required
+@require_GET
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=recommendations_etag)
+def recommend_api(request, count):
+    """
+    API JSON de recomendaciones: libros ordenados por predicción y, con
+    `?explain=1`, las palabras clave del perfil del usuario y los vecinos
+    que explican cada uno. Si el ETag de la petición (`If-None-Match`)
+    coincide, responde `304 Not Modified` sin calcular las
+    recomendaciones.
+
+    ## Argumentos:
+    - `request`: Petición HTTP.
+    - `count`: Número de libros (como mucho `MAX_API_COUNT`).
+
+    ## Retorna:
+    - `JsonResponse`: Libros recomendados (id, título, portada y
+    predicción).
+    """
+    return JsonResponse(_recommendations_payload(
+        request.user, count, _explain_requested(request)
+    ))
+
+
+@query_budget(13)
 @require_POST
 def book_rate(request, book_id):
     """
@@ -126,15 +344,8 @@ def book_rate(request, book_id):
 
         rating_value = float((rating_value - 1) / 4)
 
-        # Comprobar si el usuario ya ha valorado el libro
-        try:
-            rating = Rating.objects.get(user=user, book=book)
-        except Rating.DoesNotExist:
-            rating = Rating(user=user, book=book)
-
-        # Actualizar la valoración
-        rating.rating = rating_value
-        rating.save()
+        # Crear o actualizar la valoración en una sola escritura
+        upsert_rating(user, book, rating_value)
 
         return JsonResponse({'message': 'Valoración guardadada.'})
 
@@ -177,6 +388,7 @@ class BookDetailView(LoginRequiredMixin, generic.DetailView):
     model = Book
     template_name = 'recommender/book-detail.html'
     pk_url_kwarg = 'book_id'
+    query_budget = 6
 
     def get_context_data(self, **kwargs):
         """
@@ -185,7 +397,7 @@ class BookDetailView(LoginRequiredMixin, generic.DetailView):
         Author: Álvaro Rodero
         """
         context = super().get_context_data(**kwargs)
-        book = self.get_object()
+        book = self.object
         context['book'] = book
         # Número de estrellas dada al libro por el usuario
         user = self.request.user
@@ -203,6 +415,7 @@ class ProfileView(LoginRequiredMixin, generic.TemplateView):
     """Vista basada en clase para mostrar el perfil de usuario."""
 
     template_name = 'registration/user-profile.html'
+    query_budget = 5
 
     def get_context_data(self, **kwargs):
         """
@@ -214,10 +427,12 @@ class ProfileView(LoginRequiredMixin, generic.TemplateView):
         user = self.request.user
         context['books'] = user.get_read_books()
         # Obtener las valoraciones de cada libro
-        context['user_ratings'] = {}
-        for book in context['books']:
-            rating = Rating.objects.get(user=user, book=book)
-            context['user_ratings'][book.id] = int(rating.rating * 4 + 1)
+        context['user_ratings'] = {
+            book_id: int(rating * 4 + 1)
+            for book_id, rating in Rating.objects.filter(
+                user=user
+            ).values_list('book_id', 'rating')
+        }
         return context
 
 
@@ -225,6 +440,7 @@ class RecommendView(LoginRequiredMixin, generic.TemplateView):
     """Vista basada en clase para mostrar las recomendaciones."""
 
     template_name = 'recommender/recommend.html'
+    query_budget = 15
 
     def get_context_data(self, **kwargs):
         """
@@ -246,8 +462,178 @@ class RecommendView(LoginRequiredMixin, generic.TemplateView):
         sorted_rec_books = sort_rec_books_by_keyword_count(
             explain_info_dict, rec_books
         )
+        prefetch_related_objects(sorted_rec_books, 'authors')
         context['rec_books'] = sorted_rec_books
         context['net_html'] = pyvis_graph_html(
             user, sorted_rec_books, explain_info_dict
         )
         return context
+
+
+# Variantes asíncronas de las vistas de recomendación y valoración para el
+# despliegue ASGI (`XBRECS_ASYNC_VIEWS`). El cálculo con NumPy y las
+# consultas se ejecutan en el pool acotado de `executor`, y las lecturas
+# independientes se lanzan a la vez
+
+def _liked_ratings(user: User) -> Dict[int, float]:
+    """
+    Obtiene las valoraciones positivas de un usuario.
+
+    ## Parámetros:
+    - `user`: Usuario.
+
+    ## Retorna:
+    - Diccionario {ID de libro: valoración}.
+    """
+    return dict(Rating.objects.filter(
+        user=user, rating__gte=LIKES
+    ).values_list('book_id', 'rating'))
+
+
+async def _authenticated_user(request):
+    """
+    Obtiene el usuario de la petición sin bloquear el bucle de eventos y
+    lo deja en `request.user` para las plantillas.
+
+    ## Parámetros:
+    - `request`: Petición HTTP.
+
+    ## Retorna:
+    - Usuario autenticado o `None`.
+    """
+    user = await request.auser()
+    if not user.is_authenticated:
+        return None
+    request.user = user
+    return user
+
+
+@require_GET
+async def recommend_async(request, count):
+    """
+    Variante asíncrona de `RecommendView`: la explicación, las
+    valoraciones del usuario y los autores de los libros recomendados se
+    leen a la vez, y el grafo se genera sin más consultas.
+
+    ## Parámetros:
+    - `request`: Petición HTTP.
+    - `count`: Número de libros recomendados.
+
+    ## Retorna:
+    - Página de recomendaciones.
+    """
+    user = await _authenticated_user(request)
+    if user is None:
+        return redirect_to_login(request.get_full_path())
+    recs = await run_in_worker(recommend_books, user, k=count)
+    rec_books = [book for book, _ in recs]
+    explain_info_dict, user_ratings, _ = await asyncio.gather(
+        run_in_worker(xai_explanation_dict, user, rec_books),
+        run_in_worker(_liked_ratings, user),
+        run_in_worker(prefetch_related_objects, rec_books, 'authors'),
+    )
+    sorted_rec_books = sort_rec_books_by_keyword_count(
+        explain_info_dict, rec_books
+    )
+    net_html = await run_in_worker(
+        pyvis_graph_html, user, sorted_rec_books, explain_info_dict,
+        user_ratings
+    )
+    return await run_in_worker(render, request, RecommendView.template_name, {
+        'rec_books': sorted_rec_books,
+        'net_html': net_html,
+    })
+
+
+@require_GET
+@cache_control(private=True, no_cache=True)
+async def recommend_api_async(request, count):
+    """
+    Variante asíncrona de `recommend_api`, con la misma revalidación por
+    ETag.
+
+    ## Parámetros:
+    - `request`: Petición HTTP.
+    - `count`: Número de libros (como mucho `MAX_API_COUNT`).
+
+    ## Retorna:
+    - `JsonResponse`: Libros recomendados o `304 Not Modified`.
+    """
+    user = await _authenticated_user(request)
+    if user is None:
+        return redirect_to_login(request.get_full_path())
+    etag = quote_etag(_user_etag(user, request, count))
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = JsonResponse(await run_in_worker(
+            _recommendations_payload, user, count,
+            _explain_requested(request)
+        ))
+    response.headers.setdefault('ETag', etag)
+    return response
+
+
+async def _get_book_or_404(book_id: int) -> Book:
+    """
+    Obtiene un libro o lanza `Http404` si no existe.
+
+    ## Parámetros:
+    - `book_id`: ID del libro.
+
+    ## Retorna:
+    - Libro.
+    """
+    book = await Book.objects.filter(id=book_id).afirst()
+    if book is None:
+        raise Http404("No existe el libro.")
+    return book
+
+
+@require_POST
+async def book_rate_async(request, book_id):
+    """
+    Variante asíncrona de `book_rate`.
+
+    ## Parámetros:
+    - `request`: Petición HTTP.
+    - `book_id`: ID del libro.
+
+    ## Retorna:
+    - `JsonResponse`: Respuesta JSON.
+    """
+    if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
+        rating_value = int(request.POST.get('rating'))
+        book = await _get_book_or_404(book_id)
+        user = await request.auser()
+        rating_value = float((rating_value - 1) / 4)
+        # La escritura y sus señales se ejecutan juntas en un hilo
+        await run_in_worker(upsert_rating, user, book, rating_value)
+        return JsonResponse({'message': 'Valoración guardadada.'})
+
+    return JsonResponse({'error': 'Invalid request.'}, status=400)
+
+
+@require_POST
+async def book_rate_remove_async(request, book_id):
+    """
+    Variante asíncrona de `book_rate_remove`.
+
+    ## Parámetros:
+    - `request`: Petición HTTP.
+    - `book_id`: ID del libro.
+
+    ## Retorna:
+    - `JsonResponse`: Respuesta JSON.
+    """
+    if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
+        book = await _get_book_or_404(book_id)
+        user = await request.auser()
+        rating = await Rating.objects.filter(user=user, book=book).afirst()
+        if rating is None:
+            return JsonResponse(
+                {'error': 'No se ha encontrado la valoración.'}
+            )
+        await run_in_worker(rating.delete)
+        return JsonResponse({'message': 'Valoración eliminada.'})
+
+    return JsonResponse({'error': 'Invalid request.'}, status=400)
@@ -0,0 +1,209 @@
+import importlib
+import logging
+import os
+import threading
+import time
+import numpy as np
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional, Tuple
+
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+# Módulos con importaciones costosas que se cargan en el calentamiento
+MODULES = ['sklearn.metrics.pairwise', 'scipy.sparse', 'application.xai']
+NEAREST_USERS = 35
+REC_BOOKS = 5
+
+# Pasos del calentamiento, en orden de registro
+_steps: List[Tuple[str, Callable[[], None]]] = []
+_state: Dict = {
+    'ready': False,
+    'started': None,
+    'finished': None,
+    'pid': None,
+    'steps': dict(),
+}
+_lock = threading.Lock()
+_thread: Optional[threading.Thread] = None
+
+
+def warmup_step(name: str) -> Callable:
+    """
+    Decorador que registra una función como paso del calentamiento. Los
+    pasos se ejecutan en orden de registro y un error en uno de ellos no
+    impide ejecutar los siguientes.
+
+    ## Argumentos:
+    - `name`: Nombre del paso en el estado de preparación.
+
+    ## Retorno:
+    - Decorador.
+    """
+    def decorator(fn: Callable[[], None]) -> Callable[[], None]:
+        _steps.append((name, fn))
+        return fn
+    return decorator
+
+
+def is_enabled() -> bool:
+    """
+    Indica si el calentamiento está activado (`XBRECS_WARMUP`).
+
+    ## Retorno:
+    - `True` si está activado.
+    """
+    return getattr(settings, 'XBRECS_WARMUP', False)
+
+
+def start_warmup(background: bool = False) -> bool:
+    """
+    Ejecuta el calentamiento, si está activado. Se llama desde los puntos
+    de entrada del servidor, así que no se ejecuta en los comandos de
+    gestión:
+    - `wsgi.py` (gunicorn y `runserver`) lo ejecuta antes de devolver la
+    aplicación. Con `gunicorn --preload` lo hace el proceso maestro antes
+    del fork: los procesos hijos heredan la memoria calentada
+    copy-on-write y no reciben peticiones hasta que termina.
+    - `asgi.py` (uvicorn, que arranca cada proceso por separado) lo lanza
+    en un hilo en segundo plano y el proceso responde a `/ready/` con 503
+    mientras dura.
+
+    ## Argumentos:
+    - `background`: Si es `True`, se ejecuta en un hilo.
+
+    ## Retorno:
+    - `True` si se ha ejecutado o lanzado.
+    """
+    global _thread
+    if not is_enabled() or _thread is not None or _state['started']:
+        return False
+    if not background:
+        run_warmup()
+        return True
+    _thread = threading.Thread(
+        target=run_warmup, name='xbrecs-warmup', daemon=True
+    )
+    _thread.start()
+    return True
+
+
+def run_warmup() -> Dict:
+    """
+    Ejecuta todos los pasos del calentamiento y marca el proceso como
+    preparado. Al terminar cierra las conexiones a la base de datos, de
+    modo que es seguro ejecutarlo antes del fork de un servidor pre-fork:
+    los procesos hijos abren sus propias conexiones.
+
+    ## Retorno:
+    - Estado de preparación.
+    """
+    with _lock:
+        _state['started'] = datetime.now(timezone.utc).isoformat()
+        _state['pid'] = os.getpid()
+        start = time.perf_counter()
+        for name, fn in _steps:
+            step_start = time.perf_counter()
+            try:
+                fn()
+                ok = True
+            except Exception:
+                logger.exception("Error en el paso de calentamiento %s",
+                                 name)
+                ok = False
+            _state['steps'][name] = {
+                'ok': ok,
+                'ms': round(1000 * (time.perf_counter() - step_start), 3),
+            }
+        connections.close_all()
+        _state['finished'] = datetime.now(timezone.utc).isoformat()
+        _state['ready'] = True
+        logger.info("Calentamiento completado en %.0f ms",
+                    1000 * (time.perf_counter() - start))
+    return status()
+
+
+def status() -> Dict:
+    """
+    Obtiene el estado de preparación del proceso que responde. Si el
+    calentamiento está desactivado, el proceso se considera preparado.
+
+    ## Retorno:
+    - Diccionario con `ready`, `warmup`, el proceso (`pid`), si el
+    calentamiento se hizo antes del fork en el proceso maestro
+    (`prefork`), las marcas de tiempo y la duración de cada paso.
+    """
+    enabled = is_enabled()
+    return {
+        'ready': _state['ready'] or not enabled,
+        'warmup': enabled,
+        'pid': os.getpid(),
+        'prefork': _state['pid'] not in (None, os.getpid()),
+        'started': _state['started'],
+        'finished': _state['finished'],
+        'steps': dict(_state['steps']),
+    }
+
+
+@warmup_step('imports')
+def _import_modules() -> None:
+    """Carga los módulos con importaciones costosas."""
+    for module in MODULES:
+        importlib.import_module(module)
+
+
+@warmup_step('snapshot')
+def _load_snapshot() -> None:
+    """Abre el snapshot del modelo y lleva sus páginas a memoria."""
+    from .snapshot import get_snapshot, ARRAYS
+    snapshot = get_snapshot()
+    if snapshot is None:
+        return
+    for name in ARRAYS:
+        # Leer las matrices las carga en la caché de páginas compartida
+        np.asarray(getattr(snapshot, name)).sum()
+
+
+@warmup_step('autocomplete')
+def _load_autocomplete() -> None:
+    """Carga el índice de autocompletado."""
+    from .autocomplete import get_index
+    get_index()
+
+
+@warmup_step('keyword_index')
+def _load_keyword_index() -> None:
+    """Carga el índice invertido de palabras clave y libros."""
+    from .keyword_index import get_keyword_index
+    get_keyword_index()
+
+
+@warmup_step('search')
+def _open_search_index() -> None:
+    """Abre el índice de búsqueda y ejecuta una búsqueda."""
+    from haystack import connections as haystack_connections
+    from haystack.query import SearchQuerySet
+    backend = haystack_connections['default'].get_backend()
+    if hasattr(backend, 'setup') and \
+            not getattr(backend, 'setup_complete', True):
+        backend.setup()
+    list(SearchQuerySet().auto_query('a')[:1])
+
+
+@warmup_step('popularity')
+def _load_popularity() -> None:
+    """Calcula las listas de libros populares para el arranque en frío."""
+    from .popularity import refresh_popularity
+    refresh_popularity()
+
+
+@warmup_step('recommendation')
+def _dummy_recommendation() -> None:
+    """Calcula una recomendación para un usuario con valoraciones."""
+    from .models import User, LIKES
+    from .recommend import recommend_books
+    user = User.objects.filter(rating__rating__gte=LIKES).first()
+    if user is not None:
+        recommend_books(user, NEAREST_USERS, REC_BOOKS)
@@ -1,9 +1,13 @@
+import numpy as np
 import seaborn as sns
-from typing import Dict, List, Iterable
+from typing import Dict, List, Iterable, Optional, Tuple
 
 from pyvis.network import Network
 
-from .models import User, Book, Keyword
+from .keyword_index import EMPTY, get_keyword_index
+from .models import User, Book, Keyword, Rating, LIKES
+from .recommend import Provenance
+from .timing import timed
 
 COL = 255
 COL_MULT = 16
@@ -16,9 +20,23 @@ FONT_FACE = "monospace"
 HEIGHT = "750px"
 WIDTH = "100%"
 
-# TODO: Función para mostrar más información sobre la recomendación
-# con las métricas del recomendador user-user y la similitud entre
-# embedding de libro y usuario
+# TODO: Función para mostrar la similitud entre embedding de libro y
+# usuario en la explicación
+
+
+def _liked_book_ids(user: User) -> np.ndarray:
+    """
+    Obtiene los IDs de los libros que le gustan al usuario.
+
+    ## Argumentos:
+    - `user`: Usuario.
+
+    ## Retorno:
+    - Array ordenado de IDs de libros.
+    """
+    return np.unique(np.array(list(Rating.objects.filter(
+        user=user, rating__gte=LIKES
+    ).values_list('book_id', flat=True)), dtype=np.int64))
 
 
 def _get_liked_books_with_certain_keywords(
@@ -36,10 +54,15 @@ def _get_liked_books_with_certain_keywords(
     - Libros que le gustan al usuario y que contienen alguna
     de las palabras clave.
     """
-    liked_books = user.get_liked_books().filter(keywords__in=keywords)
-    return liked_books
+    book_ids = np.intersect1d(
+        _liked_book_ids(user),
+        get_keyword_index().books_with_any(kw.id for kw in keywords),
+        assume_unique=True
+    )
+    return Book.objects.filter(id__in=book_ids.tolist())
 
 
+@timed('explanation')
 def xai_explanation_dict(
     user: User, rec_books: List[Book]
 ) -> Dict[Keyword, List[Book]]:
@@ -57,20 +80,81 @@ def xai_explanation_dict(
     y los libros del perfil de usuario y de los recomendados que contienen
     dichas palabras clave.
     """
-    # Obtener palabras clave comunes entre los libros recomendados y el usuario
-    rec_keywords = Keyword.objects.filter(book__in=rec_books)
-    common_keywords = rec_keywords.intersection(user.get_keywords())
-    liked_books = user.get_liked_books()
-    # Los libros que le gustan al usuario y los recomendados
-    # con las palabras clave
-    liked_rec_books = list(liked_books) + rec_books
+    index = get_keyword_index()
+    liked_ids = _liked_book_ids(user)
+    rec_ids = np.array([book.id for book in rec_books], dtype=np.int64)
+    # Palabras clave de los libros recomendados (en orden de aparición)
+    # que también están en el perfil del usuario (`UserKeyword`)
+    rec_keywords = np.concatenate(
+        [index.keywords_of(book_id) for book_id in rec_ids.tolist()]
+        + [EMPTY]
+    )
+    _, first = np.unique(rec_keywords, return_index=True)
+    rec_keywords = rec_keywords[np.sort(first)]
+    profile = np.fromiter(
+        user.get_keyword_profile(), dtype=np.int64
+    )
+    common_ids = rec_keywords[np.isin(rec_keywords, profile)].tolist()
+    # Libros que le gustan al usuario y recomendados con cada palabra clave
+    liked_with = {
+        kw: np.intersect1d(index.books_of(kw), liked_ids, assume_unique=True)
+        for kw in common_ids
+    }
+    keywords = Keyword.objects.in_bulk(common_ids)
+    liked_books = Book.objects.in_bulk(np.unique(np.concatenate(
+        list(liked_with.values()) + [EMPTY]
+    )).tolist())
     explain_info_dict = {
-        kw: [b for b in liked_rec_books if kw in b.keywords.all()]
-        for kw in common_keywords
+        keywords[kw]: [liked_books[b] for b in liked_with[kw].tolist()] + [
+            rec_books[i] for i in np.flatnonzero(
+                np.isin(rec_ids, index.books_of(kw))
+            )
+        ]
+        for kw in common_ids if kw in keywords
     }
     return explain_info_dict
 
 
+def neighbor_explanation(
+    recs: List[Tuple[Book, float]], provenance: Provenance
+) -> Dict[int, Dict]:
+    """
+    Explica las predicciones del recomendador user-user con la procedencia
+    guardada al calcularlas (`recommend_books(..., provenance=...)`), sin
+    ninguna consulta: cuántos vecinos valoran positivamente cada libro y
+    cuánto aportan los que más aportan. No incluye quiénes son.
+
+    ## Argumentos:
+    - `recs`: Lista de tuplas (`Book`, predicción) recomendadas.
+    - `provenance`: Procedencia de las predicciones.
+
+    ## Retorno:
+    - Diccionario con el ID de cada libro con procedencia y un diccionario
+    con el número de vecinos (`neighbors`) y la similitud, la aportación
+    (similitud x valoración) y la fracción de la predicción de los que más
+    aportan (`top`).
+    """
+    explanation: Dict[int, Dict] = dict()
+    for book, score in recs:
+        if book.id not in provenance:
+            continue
+        supporters, contributors = provenance[book.id]
+        explanation[book.id] = {
+            'neighbors': supporters,
+            'top': [
+                {
+                    'similarity': round(float(sim), 6),
+                    'contribution': round(float(contribution), 6),
+                    'share': round(float(contribution / score), 6)
+                    if score else 0.0,
+                }
+                for _, sim, contribution in contributors
+            ],
+        }
+    return explanation
+
+
+@timed('sorting')
 def sort_rec_books_by_keyword_count(
     explain_info_dict: Dict[Keyword, List[Book]],
     rec_books: List[Book]
@@ -88,14 +172,22 @@ def sort_rec_books_by_keyword_count(
     - Lista de libros recomendados ordenados por la importancia de las
     palabras clave que explican las recomendaciones.
     """
+    index = get_keyword_index()
+    keyword_ids = np.array(
+        [kw.id for kw in explain_info_dict], dtype=np.int64
+    )
+    sizes = np.array(
+        [len(books) for books in explain_info_dict.values()], dtype=np.int64
+    )
     # Ordenar los libros recomendados por la cantidad de palabras clave
+    scores = {
+        book.id: int(sizes[np.isin(
+            keyword_ids, index.keywords_of(book.id), assume_unique=True
+        )].sum())
+        for book in rec_books
+    }
     rec_books = sorted(
-        rec_books,
-        key=lambda book: sum(
-            len(explain_info_dict.get(kw)) for kw in book.keywords.all()
-            if explain_info_dict.get(kw) is not None
-        ),
-        reverse=True
+        rec_books, key=lambda book: scores[book.id], reverse=True
     )
     return rec_books
 
@@ -115,7 +207,8 @@ def _generate_random_color(counter: int) -> str:
 def _pyvis_graph(
     user: User,
     rec_books: List[Book],
-    kw_dict: Dict[Keyword, List[Book]]
+    kw_dict: Dict[Keyword, List[Book]],
+    user_ratings: Optional[Dict[int, float]] = None
 ) -> Network:
     """
     Método para generar un grafo con la librería pyVis y
@@ -128,6 +221,9 @@ def _pyvis_graph(
     - `kw_dict`: Diccionario con las palabras clave que explican las
     recomendaciones y los libros del perfil de usuario y de los
     recomendados que contienen dichas palabras clave.
+    - `user_ratings`: Valoraciones del usuario {ID de libro: valoración}.
+    Si se indican, los libros que le gustan se toman de `kw_dict` y el
+    grafo se genera sin consultas.
 
     ## Retorno:
     - Grafo generado con pyVis.
@@ -148,8 +244,21 @@ def _pyvis_graph(
     keywords = list(kw_dict.keys())
     # Añadir nodos de libros que le gustan al usuario conectados
     # con los libros recomendados por palabras clave
-    for book in _get_liked_books_with_certain_keywords(user, keywords):
-        rating = int(4 * user.get_book_rating(book) + 1)
+    if user_ratings is None:
+        liked_books = list(
+            _get_liked_books_with_certain_keywords(user, keywords)
+        )
+        user_ratings = dict(Rating.objects.filter(
+            user=user, book__in=liked_books
+        ).values_list('book_id', 'rating'))
+    else:
+        rec_ids = {book.id for book in rec_books}
+        liked_books = list({
+            book.id: book for books in kw_dict.values() for book in books
+            if book.id not in rec_ids
+        }.values())
+    for book in liked_books:
+        rating = int(4 * user_ratings[book.id] + 1)
         net.add_node(
             book.id,
             shape='image',
@@ -193,12 +302,12 @@ def _pyvis_graph(
     return net
 
 
+@timed('graph')
 def pyvis_graph_html(
     user: User,
     rec_books: List[Book],
-    kw_dict: Dict[Keyword, List[Book]]
-
-
+    kw_dict: Dict[Keyword, List[Book]],
+    user_ratings: Optional[Dict[int, float]] = None
 ) -> str:
     """
     Método para generar un grafo con la librería pyVis y
@@ -210,8 +319,12 @@ def pyvis_graph_html(
     - `kw_dict`: Diccionario con las palabras clave que explican las
     recomendaciones y los libros del perfil de usuario y de los
     recomendados que contienen dichas palabras clave.
+    - `user_ratings`: Valoraciones del usuario {ID de libro: valoración}
+    (opcional, ver `_pyvis_graph`).
 
     ## Retorno:
     - Código HTML del grafo.
     """
-    return _pyvis_graph(user, rec_books, kw_dict).generate_html()
+    return _pyvis_graph(
+        user, rec_books, kw_dict, user_ratings
+    ).generate_html()
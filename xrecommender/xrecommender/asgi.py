@@ -11,6 +11,12 @@ import os
 
 from django.core.asgi import get_asgi_application
 
+from application.warmup import start_warmup
+
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'xrecommender.settings')
 
 application = get_asgi_application()
+
+# Calentamiento (XBRECS_WARMUP) en segundo plano en cada proceso: /ready/
+# responde 503 hasta que termina
+start_warmup(background=True)
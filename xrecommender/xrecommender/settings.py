@@ -65,7 +65,62 @@ HAYSTACK_CONNECTIONS = {
 
 HAYSTACK_SIGNAL_PROCESSOR = 'haystack.signals.RealtimeSignalProcessor'
 
+# Snapshot del índice de autocompletado (si no existe, se construye
+# a partir de la base de datos en el primer uso)
+XBRECS_AUTOCOMPLETE_SNAPSHOT = os.environ.get(
+    'XBRECS_AUTOCOMPLETE_SNAPSHOT',
+    os.path.join(BASE_DIR, 'autocomplete_index.pkl')
+)
+
+# Snapshot del índice invertido de palabras clave y libros (si no existe,
+# se construye a partir de la base de datos en el primer uso)
+XBRECS_KEYWORD_INDEX_SNAPSHOT = os.environ.get(
+    'XBRECS_KEYWORD_INDEX_SNAPSHOT',
+    os.path.join(BASE_DIR, 'keyword_index.npz')
+)
+
+# Carpeta de snapshots del modelo (matrices compartidas entre procesos
+# con mmap). Si no hay ninguna generación activa, se usa la base de datos
+XBRECS_SNAPSHOT_DIR = os.environ.get(
+    'XBRECS_SNAPSHOT_DIR', os.path.join(BASE_DIR, 'snapshots')
+)
+
+# Búsqueda de vecinos en el snapshot: 'exact', 'quantized' o 'pca'
+# (candidatos con la matriz cuantizada o reducida y reordenación exacta
+# de los mejores)
+XBRECS_NEIGHBOR_SEARCH = os.getenv('XBRECS_NEIGHBOR_SEARCH', 'exact').lower()
+XBRECS_NEIGHBOR_CANDIDATES = int(
+    os.getenv('XBRECS_NEIGHBOR_CANDIDATES', '300')
+)
+# Hilos de la búsqueda exacta de vecinos por bloques
+XBRECS_NEIGHBOR_THREADS = int(
+    os.getenv('XBRECS_NEIGHBOR_THREADS', str(min(4, os.cpu_count() or 1)))
+)
+
+# Tabla persistente de vecinos de cada usuario (modelo UserNeighbor): si
+# está activada, las recomendaciones leen los vecinos con una consulta.
+# Cada valoración que cambia un embedding encola al usuario y `make
+# update_user_neighbors` (o `make refresh_recommendations`) actualiza la
+# tabla por lotes. Se construye con `make rebuild_user_neighbors`
+XBRECS_NEIGHBOR_TABLE = os.getenv(
+    'XBRECS_NEIGHBOR_TABLE', '0'
+).lower() in ['true', 't', '1']
+XBRECS_NEIGHBOR_TABLE_K = int(os.getenv('XBRECS_NEIGHBOR_TABLE_K', '50'))
+
+# Listas de recomendaciones guardadas (modelo UserRecommendation): cada
+# valoración marca como pendientes al usuario y a los usuarios cuya lista
+# de vecinos cambia, así que sólo se usan con XBRECS_NEIGHBOR_TABLE; `make
+# refresh_recommendations` recalcula sólo los pendientes por lotes
+XBRECS_STORED_RECOMMENDATIONS = os.getenv(
+    'XBRECS_STORED_RECOMMENDATIONS', '0'
+).lower() in ['true', 't', '1']
+XBRECS_STORED_RECOMMENDATIONS_K = int(
+    os.getenv('XBRECS_STORED_RECOMMENDATIONS_K', '50')
+)
+
 MIDDLEWARE = [
+    'application.timing.TimingMiddleware',
+    'application.query_budget.QueryBudgetMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -76,6 +131,47 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# Instrumentación de tiempos por tramo (cabecera Server-Timing, histogramas
+# en /application/metrics/ y, opcionalmente, una línea JSON en el log)
+XBRECS_TIMING = os.getenv('XBRECS_TIMING', '0').lower() in ['true', 't', '1']
+XBRECS_TIMING_LOG = os.getenv(
+    'XBRECS_TIMING_LOG', '0'
+).lower() in ['true', 't', '1']
+
+# Presupuesto de consultas por vista: 'off', 'warn' (aviso en el log con
+# la pila de la consulta que lo excede) o 'raise' (para pruebas)
+XBRECS_QUERY_BUDGET = os.getenv('XBRECS_QUERY_BUDGET', 'off').lower()
+
+# Calentamiento al arrancar (índices, snapshot y una recomendación) antes
+# de servir peticiones; con `gunicorn --preload` se hace antes del fork y
+# con ASGI, en segundo plano en cada proceso (/ready/ responde 503)
+XBRECS_WARMUP = os.getenv('XBRECS_WARMUP', '0').lower() in ['true', 't', '1']
+
+# Agrupación de cálculos de recomendaciones simultáneos para el mismo
+# usuario. Dentro de cada proceso siempre está activa; entre procesos, si
+# XBRECS_SINGLEFLIGHT_CACHE indica una caché compartida (p. ej. Redis o
+# Memcached) en la que se guarda el bloqueo y, durante
+# XBRECS_SINGLEFLIGHT_TTL segundos, el resultado. El bloqueo caduca a los
+# XBRECS_SINGLEFLIGHT_TIMEOUT segundos, que deben superar el peor cálculo:
+# fuera de Redis sólo se libera antes de que pueda haber caducado
+XBRECS_SINGLEFLIGHT_CACHE = os.getenv('XBRECS_SINGLEFLIGHT_CACHE', '')
+XBRECS_SINGLEFLIGHT_TIMEOUT = float(
+    os.getenv('XBRECS_SINGLEFLIGHT_TIMEOUT', '30')
+)
+XBRECS_SINGLEFLIGHT_TTL = float(os.getenv('XBRECS_SINGLEFLIGHT_TTL', '10'))
+
+# Vistas asíncronas de recomendación y valoración para el despliegue ASGI
+# (`make serve_asgi`). Su trabajo síncrono (NumPy y ORM) se ejecuta en un
+# pool de XBRECS_ASYNC_WORKERS hilos por proceso. Los middlewares de
+# tiempos y de presupuesto de consultas son síncronos: si se activan,
+# Django adapta las vistas y se pierde la ventaja de ASGI
+XBRECS_ASYNC_VIEWS = os.getenv(
+    'XBRECS_ASYNC_VIEWS', '0'
+).lower() in ['true', 't', '1']
+XBRECS_ASYNC_WORKERS = int(
+    os.getenv('XBRECS_ASYNC_WORKERS', str(min(8, (os.cpu_count() or 1) + 2)))
+)
+
 ROOT_URLCONF = 'xrecommender.urls'
 
 TEMPLATES = [
@@ -168,3 +264,19 @@ LOGIN_REDIRECT_URL = 'home'
 LOGOUT_REDIRECT_URL = 'home'
 
 EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'application': {
+            'handlers': ['console'],
+            'level': os.getenv('XBRECS_LOG_LEVEL', 'INFO'),
+        },
+    },
+}
@@ -0,0 +1,43 @@
+"""
+Settings para benchmarks y pruebas de carga en local.
+
+Usa SQLite, el backend simple de Haystack (búsqueda sobre el ORM, sin
+índice Whoosh) y un hasher de contraseñas rápido, de forma que no se
+necesita ningún servicio externo.
+"""
+
+from .settings import *  # noqa: F401,F403
+from .settings import BASE_DIR
+
+DEBUG = True
+
+SESSION_COOKIE_SECURE = False
+CSRF_COOKIE_SECURE = False
+SECURE_SSL_REDIRECT = False
+
+ALLOWED_HOSTS = ['localhost', '127.0.0.1', 'testserver']
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / 'bench.sqlite3',
+        'OPTIONS': {
+            'timeout': 30,
+        },
+    }
+}
+
+HAYSTACK_CONNECTIONS = {
+    'default': {
+        'ENGINE': 'haystack.backends.simple_backend.SimpleEngine',
+    },
+}
+
+HAYSTACK_SIGNAL_PROCESSOR = 'haystack.signals.BaseSignalProcessor'
+
+PASSWORD_HASHERS = ['django.contrib.auth.hashers.MD5PasswordHasher']
+
+XBRECS_AUTOCOMPLETE_SNAPSHOT = None
+XBRECS_SNAPSHOT_DIR = None
+
+BENCHMARK_BASELINE = BASE_DIR / 'benchmarks' / 'baseline.json'
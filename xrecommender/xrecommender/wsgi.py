@@ -11,6 +11,12 @@ import os
 
 from django.core.wsgi import get_wsgi_application
 
+from application.warmup import start_warmup
+
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'xrecommender.settings')
 
 application = get_wsgi_application()
+
+# Calentamiento (XBRECS_WARMUP) antes de servir peticiones; con
+# `gunicorn --preload`, en el proceso maestro antes del fork
+start_warmup()